@@ -2,6 +2,7 @@
 TalkArena - 主应用
 """
 import gradio as gr
+import asyncio
 import sys
 import os
 
@@ -9,7 +10,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
 from ui.handlers import (
-    get_scenarios, start_session, send_message,
+    get_scenarios, start_session, send_message_async,
     process_voice_input, end_session, init_models,
     handle_rescue
 )
@@ -239,7 +240,7 @@ def create_ui():
                             )
                             btn_send = gr.Button("发送", scale=0, min_width=60, elem_classes="send-btn")
                             
-                    audio_player = gr.Audio(visible=False, autoplay=True)
+                    audio_player = gr.Audio(visible=False, autoplay=True, streaming=True)  # 逐句追加播放
         
         # ========== Page 4: 复盘报告页 ==========
         with gr.Column(visible=False, elem_classes="report-page") as page_report:
@@ -562,7 +563,7 @@ def create_ui():
 请直接输出对话，不要任何解释："""
 
                 try:
-                    ai_opening = orch.llm.generate(opening_prompt, max_new_tokens=300)
+                    ai_opening = orch.llm.generate(opening_prompt, max_new_tokens=300, task="opening")
                     # 清理可能的多余内容
                     ai_opening = ai_opening.strip()
                     logging.info(f"[DEBUG] AI生成开场白: {ai_opening[:100]}...")
@@ -748,15 +749,18 @@ def create_ui():
             outputs=[page_select, page_chat, session_id, current_scene, chatbot]
         )
 
-        def handle_msg(sess, scene, text, history):
+        async def handle_msg(sess, scene, text, history):
+            # 异步处理：等待 LLM 网络响应时不占用 Gradio 工作线程
             if not sess:
-                return history, "", "", "", None, gr.update(), gr.update(), ""
+                return
             user = get_current_user()
             theme_color = scene.get("theme_color", "#4A90E2")
             characters = scene.get("characters")
             game_over_detected = False
-            for chat, _, ai_dom, user_dom, audio, game_over in send_message(sess, text, history):
+            async for chat, verdict, ai_dom, user_dom, audio, game_over in send_message_async(sess, text, history):
                 game_over_detected = game_over
+                # 没有新语音的阶段（包括晚于语音到达的 judged）不更新播放器，避免打断正在播放的语音
+                audio = audio or gr.update()
                 # 尝试解析当前讲话者
                 last_msg = chat[-1]["content"] if chat and len(chat) > 0 else ""
                 last_title = chat[-1].get("metadata", {}).get("title", "") if chat and len(chat) > 0 and chat[-1] else ""
@@ -774,7 +778,7 @@ def create_ui():
                 yield (
                     chat, "",
                     render_visual_stage(characters, speaker, user_dom, ai_dom),
-                    render_aura_sidebar(user_dom, ai_dom),
+                    render_aura_sidebar(user_dom, ai_dom, judged=bool(verdict)),
                     render_critique_box(judgment),
                     audio,
                     gr.update(),
@@ -788,8 +792,7 @@ def create_ui():
 
             # 游戏结束时自动触发结束对局
             if game_over_detected:
-                import time
-                time.sleep(2)  # 短暂延迟让用户看到最后的气场变化
+                await asyncio.sleep(2)  # 短暂延迟让用户看到最后的气场变化
 
                 # 显示加载界面
                 loading_html = '''
@@ -826,7 +829,7 @@ def create_ui():
                     npc_list = [{"name": c.get("name", "NPC"), "avatar": c.get("avatar", "👤")} for c in characters]
 
                     try:
-                        report_data = orch.generate_game_report(sess, scene_name, npc_list)
+                        report_data = await asyncio.to_thread(orch.generate_game_report, sess, scene_name, npc_list)
 
                         # 渲染HTML
                         from ui.report import render_report_card
@@ -872,8 +875,9 @@ def create_ui():
             theme_color = scene.get("theme_color", "#4A90E2")
             characters = scene.get("characters")
             game_over_detected = False
-            for chat, _, ai_dom, user_dom, audio, game_over in process_voice_input(sess, audio_path, history):
+            for chat, verdict, ai_dom, user_dom, audio, game_over in process_voice_input(sess, audio_path, history):
                 game_over_detected = game_over
+                audio = audio or gr.update()
                 last_title = chat[-1].get("metadata", {}).get("title", "") if chat and len(chat) > 0 and chat[-1] else ""
                 speaker = last_title.split(' ')[-1] if ' ' in last_title else last_title
 
@@ -887,7 +891,7 @@ def create_ui():
                 yield (
                     chat, "",
                     render_visual_stage(characters, speaker, user_dom, ai_dom),
-                    render_aura_sidebar(user_dom, ai_dom),
+                    render_aura_sidebar(user_dom, ai_dom, judged=bool(verdict)),
                     render_critique_box(judgment),
                     audio,
                     gr.update(),
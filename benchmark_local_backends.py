@@ -0,0 +1,131 @@
+"""本地 LLM 推理后端基准：transformers（_generate_local）与 ONNX Runtime 的首字延迟和生成速度对比
+
+用法:
+    python benchmark_local_backends.py                          # 两个后端，每个场景一条回合 prompt
+    python benchmark_local_backends.py --backends onnx --rounds 3
+    LOCAL_ONNX_THREADS=8 python benchmark_local_backends.py      # 指定 ONNX Runtime intra-op 线程数
+
+prompt 与 process_turn_streaming 相同（Orchestrator._build_turn_prompt / _reply_limits），
+每个后端在独立子进程中加载回复档位的本地模型（LOCAL_MODELS_MULTI=0，关闭合批与前缀缓存以便对比单次生成）。
+结果写入 outputs/benchmarks/local_backends.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+USER_INPUT = "我觉得您说得有道理，不过我还是想先把话说清楚。"
+RESULT_PATH = Path("outputs/benchmarks/local_backends.json")
+
+
+def turn_prompts():
+    """每个场景开场后用户说一句话时的回合 prompt，返回 [(场景, prompt, max_new_tokens, stop)]"""
+    from core.prompt_budget import PromptBuilder, estimate_tokens
+    from orchestrator import Orchestrator
+
+    # 只用提示词构造，不加载模型
+    orch = Orchestrator.__new__(Orchestrator)
+    orch.sessions = {}
+    orch.scenarios = orch._load_scenarios()
+    orch.prompt_builder = PromptBuilder(estimate_tokens)
+
+    prompts = []
+    for scenario_id, scenario in orch.scenarios.items():
+        session = orch.start_session(scenario_id)
+        session.chat_history.append((session.user_name, USER_INPUT))
+        prompt = orch._build_turn_prompt(session, scenario)
+        max_new_tokens, stop = orch._reply_limits(session, scenario)
+        prompts.append((scenario_id, prompt, max_new_tokens, stop))
+    return prompts
+
+
+def run_single(backend: str, rounds: int) -> dict:
+    """在当前进程中加载该后端的本地模型，对每条回合 prompt 流式生成 rounds 次"""
+    from model_loader import LLMLoader
+
+    loader = LLMLoader()
+    start = time.time()
+    loader._load_local_model()
+    load_time = time.time() - start
+
+    prompts = turn_prompts()
+    # 预热一次（ONNX Runtime 首次运行会做图优化与内存规划）
+    "".join(loader._generate_local_stream(prompts[0][1], 4, 0.7))
+
+    runs = []
+    for _ in range(rounds):
+        for scenario_id, prompt, max_new_tokens, stop in prompts:
+            start = time.time()
+            first_token_at = None
+            text = ""
+            for delta in loader._generate_local_stream(prompt, max_new_tokens, 0.7, stop=stop):
+                if first_token_at is None:
+                    first_token_at = time.time()
+                text += delta
+            elapsed = time.time() - start
+            tokens = loader.count_tokens(text)
+            decode_time = elapsed - (first_token_at - start) if first_token_at else elapsed
+            runs.append({
+                "scenario": scenario_id,
+                "ttft_s": round(first_token_at - start, 3) if first_token_at else None,
+                "tokens": tokens,
+                "tokens_per_s": round(tokens / decode_time, 2) if decode_time > 0 else 0.0,
+                "sample": text[:40],
+            })
+
+    ttfts = [r["ttft_s"] for r in runs if r["ttft_s"] is not None]
+    speeds = [r["tokens_per_s"] for r in runs if r["tokens"]]
+    return {
+        "backend": backend,
+        "model": loader.local_primary.name,
+        "load_time_s": round(load_time, 2),
+        "ttft_s": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+        "tokens_per_s": round(sum(speeds) / len(speeds), 2) if speeds else 0.0,
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 LLM 推理后端基准")
+    parser.add_argument("--backends", default="transformers,onnx", help="逗号分隔的后端：transformers / onnx")
+    parser.add_argument("--rounds", type=int, default=1, help="每条 prompt 的生成次数")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # 子进程：只测一个后端，结果以 JSON 输出到最后一行
+        print(json.dumps(run_single(args.single, args.rounds), ensure_ascii=False))
+        return
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        print(f"\n=== {backend} ===")
+        env = dict(os.environ, LOCAL_LLM_BACKEND=backend, LOCAL_MODELS_MULTI="0",
+                   LOCAL_BATCHING="0", LOCAL_PREFIX_CACHE="0", LOCAL_LLM_SPECULATIVE="0")
+        cmd = [sys.executable, __file__, "--single", backend, "--rounds", str(args.rounds)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+        if proc.returncode != 0:
+            print(f"失败: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{result['model']} | 加载 {result['load_time_s']}s | 首字 {result['ttft_s']}s | {result['tokens_per_s']} tokens/s")
+
+    if not results:
+        print("\n没有成功的测试")
+        return
+
+    print(f"\n{'后端':<14} {'模型':<14} {'加载(s)':>8} {'首字(s)':>8} {'tokens/s':>9}")
+    for r in results:
+        print(f"{r['backend']:<14} {r['model']:<14} {r['load_time_s']:>8} {r['ttft_s']:>8} {r['tokens_per_s']:>9}")
+
+    RESULT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    RESULT_PATH.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {RESULT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
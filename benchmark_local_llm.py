@@ -0,0 +1,217 @@
+"""本地 LLM CPU 推理模式基准：对比各量化模式的加载时间、常驻内存和生成速度
+
+用法:
+    python benchmark_local_llm.py                                   # 默认模型 + models/llm 下已下载权重的模型，全部模式
+    python benchmark_local_llm.py --models models/llm/Qwen/Qwen2-1___5B-Instruct --modes none,int8
+    python benchmark_local_llm.py --compile                         # 额外测试 torch.compile
+    python benchmark_local_llm.py --draft Qwen/Qwen2-1.5B-Instruct   # 额外测试投机解码（小模型起草）
+    python benchmark_local_llm.py --loaders default,mmap --load-only --modes bf16   # 启动基准：对比 from_pretrained 与内存映射加载
+
+每个 (模型, 模式) 在独立子进程中运行，内存数据互不干扰。结果写入 outputs/benchmarks/local_llm.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROMPT = "你是饭局上的长辈，晚辈刚刚敬酒时说错了话。请用一句话回应他，不超过50字。"
+RESULT_PATH = Path("outputs/benchmarks/local_llm.json")
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    status = Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+
+def rss_breakdown_mb() -> dict:
+    """常驻内存中的匿名页（进程私有）与文件页（内存映射的权重，可与其他进程共享 page cache），仅 Linux"""
+    status = Path("/proc/self/status")
+    if not status.exists():
+        return {}
+    fields = {"RssAnon:": "anon_mb", "RssFile:": "file_mb"}
+    return {
+        fields[line.split()[0]]: round(int(line.split()[1]) / 1024, 1)
+        for line in status.read_text().splitlines()
+        if line.split() and line.split()[0] in fields
+    }
+
+
+def has_weights(path: Path) -> bool:
+    return any(path.glob("*.safetensors")) or any(path.glob("*.bin"))
+
+
+def default_models():
+    from config.models import MODELS_CONFIG
+
+    models = [MODELS_CONFIG["llm"]["model_id"]]
+    for path in sorted(Path("models/llm/Qwen").glob("*")):
+        if not path.is_dir():
+            continue
+        if has_weights(path):
+            models.append(str(path))
+        else:
+            print(f"跳过 {path}：未下载权重文件")
+    return models
+
+
+def run_single(model_id: str, mode: str, compile_model: bool, max_new_tokens: int, draft_id: str = None,
+               loader: str = "default", load_only: bool = False) -> dict:
+    """在当前进程中加载并测试一个 (模型, 模式)，draft_id 不为空时用该模型起草做投机解码；
+    loader 为 mmap 时内存映射加载权重，load_only 时只测加载时间与内存"""
+    import torch
+    from contextlib import nullcontext
+    from config.models import MODELS_CONFIG
+    from core.speculative import SpeculativeStats
+    from model_loader import load_local_causal_lm
+
+    rss_before = rss_mb()
+    start = time.time()
+    model, tokenizer = load_local_causal_lm(
+        model_id,
+        cache_dir=MODELS_CONFIG["llm"]["cache_dir"],
+        quantization=mode,
+        compile_model=compile_model,
+        mmap_weights=loader == "mmap"
+    )
+    draft = None
+    if draft_id:
+        draft, _ = load_local_causal_lm(draft_id, cache_dir=MODELS_CONFIG["llm"]["draft"]["cache_dir"], quantization=mode,
+                                        mmap_weights=loader == "mmap")
+        draft.generation_config.num_assistant_tokens = MODELS_CONFIG["llm"]["draft"]["num_assistant_tokens"]
+    load_time = time.time() - start
+    rss_loaded = rss_mb()
+    label = mode + ("+compile" if compile_model else "") + ("+draft" if draft is not None else "") + \
+        ("+mmap" if loader == "mmap" else "")
+    if load_only:
+        return {
+            "model": model_id,
+            "mode": label,
+            "load_time_s": round(load_time, 2),
+            "rss_mb": round(rss_loaded, 1),
+            "model_rss_mb": round(rss_loaded - rss_before, 1),
+            **rss_breakdown_mb(),
+            "tokens_per_s": None,
+        }
+
+    inputs = tokenizer.apply_chat_template(
+        [{"role": "user", "content": PROMPT}], tokenize=True, add_generation_prompt=True, return_tensors="pt"
+    )
+    gen_kwargs = dict(do_sample=False, pad_token_id=tokenizer.eos_token_id)
+    if draft is not None:
+        gen_kwargs["assistant_model"] = draft
+
+    with torch.no_grad():
+        # 预热（torch.compile 的编译开销计入这里）
+        warmup_start = time.time()
+        model.generate(inputs, max_new_tokens=4, **gen_kwargs)
+        warmup_time = time.time() - warmup_start
+
+        stats = SpeculativeStats(model, draft) if draft is not None else None
+        start = time.time()
+        with stats or nullcontext():
+            outputs = model.generate(inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, **gen_kwargs)
+        gen_time = time.time() - start
+
+    new_tokens = outputs.shape[1] - inputs.shape[1]
+    return {
+        "model": model_id,
+        "mode": label,
+        "load_time_s": round(load_time, 2),
+        "rss_mb": round(rss_loaded, 1),
+        "model_rss_mb": round(rss_loaded - rss_before, 1),
+        **rss_breakdown_mb(),
+        "warmup_s": round(warmup_time, 2),
+        "new_tokens": int(new_tokens),
+        "tokens_per_s": round(new_tokens / gen_time, 2) if gen_time > 0 else 0.0,
+        "acceptance": round(stats.report(new_tokens)["acceptance"], 3) if stats else None,
+        "sample": tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True)[:60],
+    }
+
+
+def main():
+    from model_loader import LOCAL_QUANT_MODES
+
+    parser = argparse.ArgumentParser(description="本地 LLM CPU 推理模式基准")
+    parser.add_argument("--models", help="逗号分隔的模型 ID 或本地目录，默认为配置中的本地模型和 models/llm 下已下载的模型")
+    parser.add_argument("--modes", default=",".join(LOCAL_QUANT_MODES), help="逗号分隔的量化模式")
+    parser.add_argument("--compile", action="store_true", help="每个模式额外测试 torch.compile")
+    parser.add_argument("--draft", help="投机解码草稿模型 ID 或本地目录，每个组合额外测试一次投机解码")
+    parser.add_argument("--loaders", default="default", help="逗号分隔的权重加载方式：default（from_pretrained）/ mmap（内存映射）")
+    parser.add_argument("--load-only", action="store_true", help="只测加载时间与常驻内存（启动基准），不测生成")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--single", nargs=2, metavar=("MODEL", "MODE"), help=argparse.SUPPRESS)
+    parser.add_argument("--single-compile", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--single-draft", help=argparse.SUPPRESS)
+    parser.add_argument("--single-loader", default="default", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # 子进程：只测一个组合，结果以 JSON 输出到最后一行
+        result = run_single(args.single[0], args.single[1], args.single_compile, args.max_new_tokens, args.single_draft,
+                            args.single_loader, args.load_only)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    models = args.models.split(",") if args.models else default_models()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    loaders = [l.strip() for l in args.loaders.split(",") if l.strip()]
+    combos = [(model, mode, False, None, loader) for model in models for mode in modes for loader in loaders]
+    if args.compile:
+        combos += [(model, mode, True, None, loaders[0]) for model in models for mode in modes]
+    if args.draft:
+        combos += [(model, mode, False, args.draft, loaders[0]) for model in models for mode in modes if model != args.draft]
+
+    results = []
+    for model, mode, compile_model, draft, loader in combos:
+        label = f"{model} [{mode}{'+compile' if compile_model else ''}{'+draft' if draft else ''}{'+mmap' if loader == 'mmap' else ''}]"
+        print(f"\n=== {label} ===")
+        cmd = [sys.executable, __file__, "--single", model, mode, "--max-new-tokens", str(args.max_new_tokens),
+               "--single-loader", loader]
+        if compile_model:
+            cmd.append("--single-compile")
+        if draft:
+            cmd += ["--single-draft", draft]
+        if args.load_only:
+            cmd.append("--load-only")
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=os.environ.copy())
+        if proc.returncode != 0:
+            print(f"失败: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"加载 {result['load_time_s']}s | 内存 {result['rss_mb']}MB"
+              + (f" (匿名 {result['anon_mb']}MB / 文件映射 {result['file_mb']}MB)" if "anon_mb" in result else "")
+              + (f" | {result['tokens_per_s']} tokens/s" if result.get("tokens_per_s") is not None else "")
+              + (f" | 接受率 {result['acceptance']:.0%}" if result.get("acceptance") is not None else ""))
+
+    if not results:
+        print("\n没有成功的测试")
+        return
+
+    print(f"\n{'模型':<45} {'模式':<19} {'加载(s)':>8} {'内存(MB)':>9} {'匿名(MB)':>9} {'tokens/s':>9}")
+    for r in results:
+        print(f"{Path(r['model']).name:<45} {r['mode']:<19} {r['load_time_s']:>8} {r['rss_mb']:>9} "
+              f"{r.get('anon_mb', '-'):>9} {r['tokens_per_s'] if r['tokens_per_s'] is not None else '-':>9}")
+
+    RESULT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    RESULT_PATH.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {RESULT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""回合调用方式 A/B 对比：split（角色回复 + 裁判两次调用）与 combined（一次结构化调用同时返回台词与裁判结果）
+
+用法:
+    python benchmark_turn_modes.py                         # 两种方式，每个场景 4 回合
+    python benchmark_turn_modes.py --turns 8 --rounds 2
+    python benchmark_turn_modes.py --modes combined --scenarios negotiation
+
+每种方式在独立子进程中运行（TURN_MODE=<mode>，关闭 TTS 与救场预计算），按相同的用户台词走 process_turn_streaming，统计：
+回复可见延迟（到 ai_responded）、整回合延迟（到 judged）、每回合 API 调用次数、气场转移分布与结构化输出兜底次数。
+结果写入 outputs/benchmarks/turn_modes.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+USER_INPUTS = [
+    "我觉得您说得有道理，不过我还是想先把话说清楚。",
+    "这个我不同意，数据不是这么算的。",
+    "您先别急，听我把理由讲完。",
+    "那我们各退一步，您看怎么样？",
+]
+SHIFT_BUCKETS = [(-25, -10), (-9, -1), (0, 0), (1, 9), (10, 25)]
+RESULT_PATH = Path("outputs/benchmarks/turn_modes.json")
+
+
+class CountingCompletions:
+    """包一层 chat.completions，统计实际发出的 API 请求数（含对冲请求与重试）"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return self.inner.create(**kwargs)
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "mean": round(statistics.mean(values), 3),
+        "p50": round(values[len(values) // 2], 3),
+        "p90": round(values[min(len(values) - 1, int(0.9 * len(values)))], 3),
+    }
+
+
+def run_single(mode: str, scenarios, turns: int, rounds: int) -> dict:
+    """在当前进程中按 TURN_MODE 跑完所有场景的回合，返回统计结果"""
+    from core.metrics import metrics
+    from orchestrator import Orchestrator
+
+    orch = Orchestrator(enable_tts=False)
+    if not orch.llm.use_api:
+        raise RuntimeError("API 不可用，A/B 对比只统计 API 调用")
+    counter = CountingCompletions(orch.llm.client.chat.completions)
+    orch.llm.client.chat.completions = counter
+
+    records = []
+    for _ in range(rounds):
+        for scenario_id in scenarios or list(orch.scenarios):
+            session = orch.start_session(scenario_id)
+            for user_input in (USER_INPUTS * turns)[:turns]:
+                session.last_activity = time.time()     # 不计犹豫惩罚
+                calls_before = counter.calls
+                start = time.time()
+                reply_s = None
+                final = None
+                for update in orch.process_turn_streaming(session.session_id, user_input):
+                    if update["stage"] == "ai_responded":
+                        reply_s = time.time() - start
+                    elif update["stage"] == "judged":
+                        final = update
+                records.append({
+                    "scenario": scenario_id,
+                    "reply_s": round(reply_s, 3),
+                    "turn_s": round(time.time() - start, 3),
+                    "api_calls": counter.calls - calls_before,
+                    "shift": final["dominance_shift"],
+                    "comment": final["judgment"],
+                })
+                if final["game_over"]:
+                    break
+
+    shifts = [r["shift"] for r in records]
+    counters = metrics.snapshot()["counters"]
+    return {
+        "mode": mode,
+        "model": orch.llm.get_model_name(),
+        "turns": len(records),
+        "reply_s": summarize([r["reply_s"] for r in records]),
+        "turn_s": summarize([r["turn_s"] for r in records]),
+        "api_calls_per_turn": round(sum(r["api_calls"] for r in records) / len(records), 2) if records else 0.0,
+        "shift": {
+            "mean": round(statistics.mean(shifts), 2) if shifts else None,
+            "stdev": round(statistics.pstdev(shifts), 2) if shifts else None,
+            "buckets": {f"{lo}~{hi}": sum(lo <= s <= hi for s in shifts) for lo, hi in SHIFT_BUCKETS},
+        },
+        "json_fallbacks": {name: counters.get(f"llm.json.{name}.fallback", 0) for name in ("judge", "turn")},
+        "records": records,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回合调用方式 A/B 对比")
+    parser.add_argument("--modes", default="split,combined", help="逗号分隔的调用方式：split / combined")
+    parser.add_argument("--scenarios", default="", help="逗号分隔的场景 ID，默认全部场景")
+    parser.add_argument("--turns", type=int, default=4, help="每局的回合数")
+    parser.add_argument("--rounds", type=int, default=1, help="每个场景重复的局数")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    if args.single:
+        # 子进程：只测一种方式，结果以 JSON 输出到最后一行
+        print(json.dumps(run_single(args.single, scenarios, args.turns, args.rounds), ensure_ascii=False))
+        return
+
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"\n=== {mode} ===")
+        # 救场预计算会在后台额外发起调用，关闭以免计入回合调用次数
+        env = dict(os.environ, TURN_MODE=mode, TTS_ENABLED="0", RESCUE_PRECOMPUTE="0")
+        cmd = [sys.executable, __file__, "--single", mode, "--scenarios", args.scenarios,
+               "--turns", str(args.turns), "--rounds", str(args.rounds)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+        if proc.returncode != 0:
+            print(f"失败: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{result['model']} | {result['turns']} 回合 | 回复 {result['reply_s']['mean']}s | "
+              f"整回合 {result['turn_s']['mean']}s | {result['api_calls_per_turn']} 次调用/回合")
+
+    if not results:
+        print("\n没有成功的测试")
+        return
+
+    print(f"\n{'方式':<10} {'回复(s)':>8} {'整回合(s)':>10} {'调用/回合':>10} {'shift均值':>10} {'shift标准差':>11}  分布")
+    for r in results:
+        buckets = " ".join(f"{k}:{v}" for k, v in r["shift"]["buckets"].items())
+        print(f"{r['mode']:<10} {r['reply_s']['mean']:>8} {r['turn_s']['mean']:>10} {r['api_calls_per_turn']:>10} "
+              f"{r['shift']['mean']:>10} {r['shift']['stdev']:>11}  {buckets}")
+
+    RESULT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    RESULT_PATH.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {RESULT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,25 @@ MODELS_CONFIG = {
         "cache_dir": "./models/qwen",
         "device": "auto",
         "trust_remote_code": True,
+        # CPU 推理模式：none / bf16 / int8（见 model_loader.load_local_causal_lm，用 benchmark_local_llm.py 对比）
+        "quantization": os.environ.get("LOCAL_LLM_QUANT", "none").lower(),
+        "compile": os.environ.get("LOCAL_LLM_COMPILE", "0").lower() in {"1", "true", "yes", "on"},
+        # 本地推理后端：transformers / onnx（导出为 ONNX 后在 ONNX Runtime 上推理，见 core.onnx_backend）
+        "backend": os.environ.get("LOCAL_LLM_BACKEND", "transformers").lower(),
+        "onnx": {
+            "export_dir": "./models/onnx",
+            "intra_op_threads": int(os.environ.get("LOCAL_ONNX_THREADS", "0")),   # 0 表示物理核数
+        },
+        # 本地已有 safetensors 时内存映射加载权重（bf16 与文件 dtype 一致，为零拷贝；多进程共享 page cache）
+        "mmap": os.environ.get("LOCAL_LLM_MMAP", "1").lower() not in {"0", "false", "no", "off"},
+        # 投机解码草稿模型：与主模型同一分词器家族（Qwen2 / Qwen2.5），小模型起草、主模型验证
+        "draft": {
+            "enabled": os.environ.get("LOCAL_LLM_SPECULATIVE", "0").lower() in {"1", "true", "yes", "on"},
+            "model_id": os.environ.get("LOCAL_LLM_DRAFT", "Qwen/Qwen2-1.5B-Instruct"),
+            "cache_dir": "./models/llm",     # 即 models/llm/Qwen/Qwen2-1___5B-Instruct
+            "params_b": 1.5,                 # 不在 LOCAL_MODELS["specs"] 中时用于估算内存占用
+            "num_assistant_tokens": int(os.environ.get("LOCAL_LLM_DRAFT_TOKENS", "5")),   # 每轮起草 token 数（按接受情况自动调整）
+        },
     },
     "tts": {
         # Modelscope 上的简化情感 TTS
@@ -28,6 +47,201 @@ MODELS_CONFIG = {
     }
 }
 
+# 魔搭 API 异步 HTTP 连接池（所有 AsyncLLMLoader 共享同一个池）
+LLM_HTTP_POOL = {
+    "http2": os.environ.get("LLM_HTTP2", "1").lower() not in {"0", "false", "no", "off"},
+    "max_connections": int(os.environ.get("LLM_MAX_CONNECTIONS", "200")),
+    "max_keepalive_connections": int(os.environ.get("LLM_MAX_KEEPALIVE", "50")),
+    "keepalive_expiry": 60.0,   # 空闲连接保活秒数，避免每轮重新握手
+    "connect_timeout": 5.0,
+    "read_timeout": 60.0,
+}
+
+# 魔搭 API 客户端限流（进程级令牌桶，按优先级排队）
+LLM_RATE_LIMIT = {
+    "rate": float(os.environ.get("LLM_RATE_LIMIT_RPS", "2")),     # 每秒补充的请求令牌数
+    "burst": int(os.environ.get("LLM_RATE_LIMIT_BURST", "4")),    # 令牌桶容量
+    "aging_seconds": 30.0,        # 排队每满该秒数，优先级提升一级，防止复盘报告被永久饿死
+    "default_retry_after": 2.0,   # 429 未携带 Retry-After 时的基础暂停秒数
+}
+
+# 对冲请求：主模型超过其历史延迟分位数仍未响应时，向下一个可用模型发送同样的请求
+LLM_HEDGE = {
+    "enabled": os.environ.get("LLM_HEDGE", "0").lower() in {"1", "true", "yes", "on"},
+    "percentile": float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.9")),
+    "min_samples": 5,         # 样本数不足时使用 default_delay
+    "default_delay": 3.0,
+    "min_delay": 0.5,
+}
+
+# API 模型熔断与健康路由（每个 LLMLoader 一组熔断器，冷却到期后自动半开复查）
+LLM_CIRCUIT_BREAKER = {
+    "failure_threshold": int(os.environ.get("LLM_CB_FAILURES", "3")),   # 连续失败次数达到即熔断
+    "error_rate_threshold": 0.5,    # 滚动窗口错误率达到即熔断
+    "window": 20,                   # 滚动窗口调用数
+    "window_seconds": 60.0,         # 滚动窗口时长，更早的结果不再计入错误率
+    "min_calls": 5,                 # 窗口内调用数不足时不按错误率熔断
+    "cooldown": float(os.environ.get("LLM_CB_COOLDOWN", "30")),         # 熔断后首次半开复查的等待秒数
+    "max_cooldown": 300.0,          # 半开复查连续失败时冷却翻倍的上限
+    "latency_alpha": 0.3,           # 延迟 EWMA 平滑系数
+    "default_latency": 5.0,         # 无延迟样本时的估计秒数
+    "error_penalty": 4.0,           # 健康分中错误率的权重
+    "order_bias": 0.1,              # MODELS_TO_TRY 中靠前的模型在分数相近时优先
+}
+
+# API 模型档位：同一档位内由熔断路由按健康分选择，列表顺序即偏好顺序
+LLM_MODEL_TIERS = {
+    # 角色扮演、复盘文案：效果优先
+    "roleplay": ["ZhipuAI/GLM-4.7-Flash", "Qwen/Qwen3-32B", "Qwen/Qwen3-8B", "Qwen/Qwen2.5-7B-Instruct"],
+    # 裁判、打分等短输出：延迟优先
+    "fast": ["Qwen/Qwen2.5-7B-Instruct", "Qwen/Qwen3-8B", "ZhipuAI/GLM-4.7-Flash"],
+}
+
+# API 模型请求配置（见 core.model_profiles），按模型名前缀匹配，最长前缀优先
+# thinking: 混合推理模型关闭思考的方式（qwen3 / glm），思考会占用 max_tokens 并拖慢首字
+# json_mode: 支持的最强 JSON 输出模式；unsupported_params: 请求时去掉的参数
+LLM_MODEL_PROFILES = {
+    "thinking": os.environ.get("LLM_THINKING", "0").lower() in {"1", "true", "yes", "on"},
+    "profiles": {
+        "Qwen/Qwen3-": {"thinking": "qwen3"},
+        "ZhipuAI/GLM-4": {"thinking": "glm", "json_mode": "json_object"},
+        "Qwen/Qwen2.5-": {},
+    },
+}
+
+# 调用类型 -> 模型档位 + 限流优先级（core.rate_limiter.Priority 的成员名）
+# 档位可用环境变量覆盖，如 LLM_ROUTE_JUDGE=roleplay
+LLM_TASK_ROUTES = {
+    task: {"tier": os.environ.get(f"LLM_ROUTE_{task.upper()}", tier), "priority": priority}
+    for task, tier, priority in [
+        ("reply", "roleplay", "TURN"),            # 回合中的角色回复
+        ("opening", "roleplay", "TURN"),          # 开场白
+        ("judge", "fast", "JUDGE"),               # 回合裁判 JSON
+        ("rescue", "fast", "RESCUE"),             # 救场建议
+        ("report_scores", "fast", "REPORT"),      # 复盘打分 JSON
+        ("report_summary", "roleplay", "REPORT"), # 复盘总结 / 对决总结
+        ("npc_os", "roleplay", "REPORT"),         # NPC 内心 OS 与改进建议
+    ]
+}
+
+# Prompt token 预算：系统设定 + 局势 + 最近对话按 token 装进每类调用的预算（超出时丢弃最早的对话）
+# 计数使用已加载的本地模型分词器；API 模型用 tokenizer_path 下的 Qwen 分词器近似，不可用时按字符估算
+# 预算可用环境变量覆盖，如 PROMPT_BUDGET_REPLY=2048
+PROMPT_BUDGET = {
+    "tokenizer_path": os.environ.get("PROMPT_TOKENIZER_PATH", "models/llm/Qwen/Qwen2-1___5B-Instruct"),
+    "tasks": {
+        task: int(os.environ.get(f"PROMPT_BUDGET_{task.upper()}", budget))
+        for task, budget in [
+            ("reply", 1536),            # 回合回复（含救场后的回应）
+            ("rescue", 1024),           # 救场建议
+            ("report_scores", 3072),    # 复盘打分
+            ("report_summary", 3072),   # 复盘总结 / 对决总结
+            ("npc_os", 3072),           # NPC 内心 OS
+        ]
+    },
+}
+
+# 裁判 / 复盘等结构化调用的 JSON 约束输出
+# mode: json_schema（按 schema 约束）/ json_object（只保证合法 JSON）/ off（仅靠提示词）
+# 模型对 response_format 返回 400 时记住该模型并改为仅靠提示词；本地模型装有 lm-format-enforcer 时按 schema 约束解码
+LLM_JSON_OUTPUT = {
+    "mode": os.environ.get("LLM_JSON_MODE", "json_schema").lower(),
+    "retries": int(os.environ.get("LLM_JSON_RETRIES", "1")),   # 解析失败后的重试次数
+    "local_constrained": os.environ.get("LOCAL_JSON_CONSTRAINED", "1").lower() not in {"0", "false", "no", "off"},
+}
+
+# 角色回复的输出预算：按场景提示词中的“不超过N字”（没有时用 default_max_chars）换算 max_new_tokens，
+# overhead_tokens 留给“角色名: ”前缀和括号里的动作描写；停止序列在模型开始替用户或其他角色发言时截断
+REPLY_BUDGET = {
+    "default_max_chars": int(os.environ.get("REPLY_MAX_CHARS", "60")),
+    "tokens_per_char": float(os.environ.get("REPLY_TOKENS_PER_CHAR", "1.0")),   # 中文约 0.6~1 token/字，取上限
+    "overhead_tokens": 40,
+    "stop_sequences": os.environ.get("REPLY_STOP_SEQUENCES", "1").lower() not in {"0", "false", "no", "off"},
+}
+
+# 回合调用方式：split 为角色回复（流式）+ 裁判两次调用；combined 为一次结构化调用同时返回台词与裁判结果，
+# 每回合少一次 API 调用（限流配额减半），但台词不再流式推送（没有 ai_partial 阶段），裁判由角色模型兼任
+TURN_MODE = {
+    "mode": os.environ.get("TURN_MODE", "split").lower(),
+}
+
+# 救场建议预计算：用户气场在本回合下降时，回合结束后以最低优先级在后台生成救场建议，
+# 按 (session, 回合) 缓存，点击救场时直接返回；下一回合开始时作废
+RESCUE_PRECOMPUTE = {
+    "enabled": os.environ.get("RESCUE_PRECOMPUTE", "1").lower() not in {"0", "false", "no", "off"},
+    # 预计算使用独立的小线程池（所有 session 共享），排队中的低优先级请求不占用裁判与点击救场的线程
+    "workers": int(os.environ.get("RESCUE_PRECOMPUTE_WORKERS", "2")),
+}
+
+# 回合线程池：同步回合中与语音合成并行的裁判调用、点击救场的生成在此运行（所有 session 共享），
+# workers 即全服务同时进行的裁判 / 救场调用上限
+TURN_POOL = {
+    "workers": int(os.environ.get("TURN_POOL_WORKERS", "32")),
+}
+
+# 分句流水线语音合成：按句末标点（。！？；）切分流式回复，每句完整时立即合成，按顺序以 audio_chunk 阶段推送给播放器
+# min_chars: 可朗读字数少于该值的句子与下一句合并（每次合成有固定开销）；workers: 并行合成的句子数（所有 session 共享）
+TTS_PIPELINE = {
+    "enabled": os.environ.get("TTS_PIPELINE", "1").lower() not in {"0", "false", "no", "off"},
+    "min_chars": int(os.environ.get("TTS_PIPELINE_MIN_CHARS", "6")),
+    "workers": int(os.environ.get("TTS_PIPELINE_WORKERS", "3")),
+}
+
+# 本地模型 KV 前缀缓存：按 session 复用上一轮 prompt（场景设定、角色列表等）的 past_key_values
+LOCAL_PREFIX_CACHE = {
+    "enabled": os.environ.get("LOCAL_PREFIX_CACHE", "1").lower() not in {"0", "false", "no", "off"},
+    "max_mb": int(os.environ.get("LOCAL_PREFIX_CACHE_MB", "1024")),   # 所有 session 缓存的总内存上限，超出按 LRU 淘汰
+    "min_prefix_tokens": 32,        # 公共前缀短于该值时不复用
+}
+
+# 本地模型跨 session 合批推理：窗口内到达的并发请求合成一个 batch，单个请求仍走带前缀缓存的单独生成
+LOCAL_BATCHING = {
+    "enabled": os.environ.get("LOCAL_BATCHING", "1").lower() not in {"0", "false", "no", "off"},
+    "max_batch_size": int(os.environ.get("LOCAL_BATCH_SIZE", "8")),
+    "window_ms": float(os.environ.get("LOCAL_BATCH_WINDOW_MS", "30")),   # 首个请求到达后等待同批请求的毫秒数
+    # 单个请求的生成时限（秒）：超时的请求以 TimeoutError 结束，调度线程继续处理后面的请求
+    "request_timeout_s": float(os.environ.get("LOCAL_REQUEST_TIMEOUT", "120")),
+}
+
+# 本地模型后台预热：熔断的 API 模型占比达到 open_ratio 时提前加载，回退调用最多排队 queue_timeout 秒，
+# 仍未就绪则返回降级回复（空内容，由调用方兜底文案处理）
+LOCAL_WARMUP = {
+    "enabled": os.environ.get("LOCAL_WARMUP", "1").lower() not in {"0", "false", "no", "off"},
+    "open_ratio": float(os.environ.get("LOCAL_WARMUP_OPEN_RATIO", "0.5")),
+    "queue_timeout": float(os.environ.get("LOCAL_WARMUP_QUEUE_TIMEOUT", "3")),
+    "retry_after": 60.0,            # 加载失败后多久允许重新尝试
+}
+
+# 本地模型常驻：models/ 下的多个 checkpoint 按档位分工，在内存预算内常驻，超出预算按 LRU 卸载空闲模型
+# 启动时按预算为每个档位选定模型（偏好顺序见 tiers，放不下时依次降级）；回复所用档位的模型固定常驻
+LOCAL_MODELS = {
+    # 内存预算（MB），0 表示按启动时可用内存的 auto_ratio 自动确定
+    "ram_budget_mb": int(os.environ.get("LOCAL_MODELS_RAM_MB", "0")),
+    "auto_ratio": float(os.environ.get("LOCAL_MODELS_RAM_RATIO", "0.5")),
+    # 关闭后所有档位都用 MODELS_CONFIG["llm"] 的模型（与单模型时的行为一致）
+    "multi": os.environ.get("LOCAL_MODELS_MULTI", "1").lower() not in {"0", "false", "no", "off"},
+    "specs": {
+        "Qwen2.5-3B": {"model_id": MODELS_CONFIG["llm"]["model_id"], "cache_dir": MODELS_CONFIG["llm"]["cache_dir"], "params_b": 3.1},
+        "Qwen2-1.5B": {"model_id": "Qwen/Qwen2-1.5B-Instruct", "cache_dir": "./models/llm", "params_b": 1.5},
+        "Qwen2-7B": {"model_id": "Qwen/Qwen2-7B-Instruct", "cache_dir": "./models/llm", "params_b": 7.6},
+        "Qwen3-4B": {"model_id": "Qwen/Qwen3-4B", "cache_dir": "./models/llm", "params_b": 4.0},   # 需要 transformers>=4.51
+    },
+    # 档位与 LLM_MODEL_TIERS 一致（按 LLM_TASK_ROUTES 路由），列表顺序即偏好顺序
+    "tiers": {
+        "roleplay": os.environ.get("LOCAL_MODELS_ROLEPLAY", "Qwen2-7B,Qwen3-4B,Qwen2.5-3B,Qwen2-1.5B").split(","),
+        "fast": os.environ.get("LOCAL_MODELS_FAST", "Qwen2-1.5B,Qwen2.5-3B").split(","),
+    },
+}
+
+# 启动时 API 模型探测（并发探测 + 磁盘缓存，restart.sh 重启时跳过重复探测）
+LLM_PROBE = {
+    "cache_path": "outputs/cache/llm_probe.json",
+    "ttl_ok": float(os.environ.get("LLM_PROBE_TTL", "1800")),          # 可用结果缓存秒数
+    "ttl_fail": float(os.environ.get("LLM_PROBE_FAIL_TTL", "300")),    # 不可用结果缓存秒数（429 等多为暂时性）
+    "timeout": 10,                  # 单个模型探测超时
+    "network_check_timeout": 1.5,   # 断网快速检测超时
+}
+
 # 确保缓存目录存在
 for model_type in MODELS_CONFIG:
     cache_dir = MODELS_CONFIG[model_type]["cache_dir"]
@@ -0,0 +1 @@
+# 核心组件包：LLM 调用相关的限流、指标等基础设施
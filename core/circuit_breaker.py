@@ -0,0 +1,222 @@
+"""
+API 模型熔断与路由
+每个模型一个熔断器（closed / open / half-open），按滚动延迟与错误率打分，路由时选择当前最优模型
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+from core.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个模型的熔断器
+
+    - closed：正常放行；连续失败 failure_threshold 次，或滚动窗口（最近 window 次且不超过 window_seconds 秒）
+      内错误率超过 error_rate_threshold 时熔断
+    - open：拒绝请求；cooldown 秒后进入 half-open
+    - half-open：只放行一个探测请求，成功则恢复 closed，失败则重新熔断且冷却时间翻倍（不超过 max_cooldown）
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, error_rate_threshold: float = 0.5,
+                 window: int = 20, window_seconds: float = 60.0, min_calls: int = 5, cooldown: float = 30.0,
+                 max_cooldown: float = 300.0, latency_alpha: float = 0.3,
+                 on_state_change: Optional[Callable[[str, str, str], None]] = None):
+        self.name = name
+        self.on_state_change = on_state_change   # (模型名, 旧状态, 新状态)，在持锁状态下调用，不应回调本熔断器
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.latency_alpha = latency_alpha
+
+        self.state = CLOSED
+        self.latency: Optional[float] = None   # 延迟 EWMA（秒）
+        self._outcomes = deque(maxlen=window)  # 最近的 (时间, 是否成功)
+        self._consecutive_failures = 0
+        self._cooldown = cooldown
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._error_rate()
+
+    def available(self) -> bool:
+        """不改变状态地判断当前是否可能放行"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self._cooldown
+            return not self._trial_in_flight
+
+    def allow_request(self) -> bool:
+        """申请一次调用；open 冷却到期时转为 half-open 并占用探测名额"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self._cooldown:
+                    return False
+                self._transition(HALF_OPEN)
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self, latency: Optional[float] = None):
+        with self._lock:
+            self._outcomes.append((time.monotonic(), True))
+            self._consecutive_failures = 0
+            if latency is not None:
+                self.latency = latency if self.latency is None else (
+                    self.latency_alpha * latency + (1 - self.latency_alpha) * self.latency
+                )
+            if self.state != CLOSED:
+                self._cooldown = self.base_cooldown
+                self._transition(CLOSED)
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append((time.monotonic(), False))
+            self._consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+                self._open()
+            elif self.state == CLOSED and (
+                self._consecutive_failures >= self.failure_threshold
+                or (len(self._outcomes) >= self.min_calls and self._error_rate() >= self.error_rate_threshold)
+            ):
+                self._open()
+            self._trial_in_flight = False
+
+    def release(self):
+        """调用被取消（既不算成功也不算失败）时归还 half-open 探测名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def force_open(self):
+        """启动探测失败时直接熔断，冷却到期后自动走 half-open 复查"""
+        with self._lock:
+            if self.state != OPEN:
+                self._open()
+
+    def _error_rate(self) -> float:
+        # 过期的结果移出窗口，偶发失败的模型过一会儿就能恢复健康分
+        horizon = time.monotonic() - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._transition(OPEN)
+        metrics.incr(f"llm.circuit.open.{self.name}")
+
+    def _transition(self, state: str):
+        if state != self.state:
+            print(f"[CircuitBreaker] {self.name}: {self.state} -> {state}"
+                  + (f" (冷却 {self._cooldown:.0f}s)" if state == OPEN else ""))
+            old, self.state = self.state, state
+            if self.on_state_change:
+                self.on_state_change(self.name, old, state)
+
+
+class ModelRouter:
+    """按健康分选择 API 模型
+
+    分数 = 延迟 EWMA × (1 + error_penalty × 错误率) × (1 + order_bias × 列表序号)，越小越好；
+    没有延迟样本的模型按 default_latency 计，列表靠前的模型在分数相近时优先。
+    ranked/best/acquire 可传入 models 限定候选范围（如某个档位），序号按该列表计算。
+    """
+
+    def __init__(self, models: Iterable[str], config: Dict,
+                 on_state_change: Optional[Callable[[str, str, str], None]] = None):
+        self.models = list(models)
+        self.config = config
+        self.breakers = {
+            model: CircuitBreaker(
+                model,
+                failure_threshold=config["failure_threshold"],
+                error_rate_threshold=config["error_rate_threshold"],
+                window=config["window"],
+                window_seconds=config["window_seconds"],
+                min_calls=config["min_calls"],
+                cooldown=config["cooldown"],
+                max_cooldown=config["max_cooldown"],
+                latency_alpha=config["latency_alpha"],
+                on_state_change=on_state_change,
+            )
+            for model in self.models
+        }
+
+    def score(self, model: str, models: Optional[List[str]] = None) -> float:
+        breaker = self.breakers[model]
+        order = models if models is not None else self.models
+        latency = breaker.latency if breaker.latency is not None else self.config["default_latency"]
+        return (latency
+                * (1 + self.config["error_penalty"] * breaker.error_rate)
+                * (1 + self.config["order_bias"] * order.index(model)))
+
+    def ranked(self, exclude: Iterable[str] = (), models: Optional[Iterable[str]] = None) -> List[str]:
+        """当前可放行的模型，按分数从优到劣排序"""
+        exclude = set(exclude)
+        order = [m for m in (models if models is not None else self.models) if m in self.breakers]
+        candidates = [m for m in order if m not in exclude and self.breakers[m].available()]
+        return sorted(candidates, key=lambda m: self.score(m, order))
+
+    def best(self, models: Optional[Iterable[str]] = None) -> Optional[str]:
+        ranked = self.ranked(models=models)
+        return ranked[0] if ranked else None
+
+    def acquire(self, exclude: Iterable[str] = (), models: Optional[Iterable[str]] = None) -> Optional[str]:
+        """选出最优模型并占用一次调用（half-open 模型占用探测名额），全部熔断时返回 None"""
+        for model in self.ranked(exclude, models):
+            if self.breakers[model].allow_request():
+                return model
+        return None
+
+    def record_success(self, model: str, latency: Optional[float] = None):
+        self.breakers[model].record_success(latency)
+
+    def record_failure(self, model: str):
+        self.breakers[model].record_failure()
+
+    def release(self, model: str):
+        self.breakers[model].release()
+
+    def mark_unhealthy(self, model: str):
+        self.breakers[model].force_open()
+
+    def open_ratio(self) -> float:
+        """处于熔断（open）状态的模型占比"""
+        return sum(b.state == OPEN for b in self.breakers.values()) / len(self.breakers) if self.breakers else 0.0
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各模型状态，便于日志与排查"""
+        return {
+            model: {
+                "state": breaker.state,
+                "latency": breaker.latency,
+                "error_rate": breaker.error_rate,
+                "score": self.score(model),
+            }
+            for model, breaker in self.breakers.items()
+        }
+
+
+class NoHealthyModelError(RuntimeError):
+    """所有 API 模型都处于熔断状态"""
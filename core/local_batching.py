@@ -0,0 +1,240 @@
+"""
+本地模型跨 session 批量推理
+短时间窗口内到达的请求合并成一个 batch（左填充），逐步解码并把每一步的增量推送给各自的调用方
+"""
+import queue
+import threading
+import time
+from typing import Callable, Generator, List, Optional
+
+from core.metrics import metrics
+from core.prompt_budget import Prompt, as_messages
+from core.stop_sequences import StopSequenceFilter
+
+_DONE = object()
+
+
+class LocalRequest:
+    """一次本地生成请求，out 队列依次收到文本增量、异常或 _DONE"""
+
+    def __init__(self, text: Prompt, max_new_tokens: int, temperature: float, **kwargs):
+        self.text = text
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.kwargs = kwargs          # 单请求路径的额外参数（session_id / task / stop 等）
+        self.out = queue.Queue()
+        self.cancel = threading.Event()  # 调用方提前停止读取；单请求路径据此让 generate 提前结束
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel.is_set()
+
+
+class LocalBatchScheduler:
+    """本地推理调度器
+
+    - 后台线程从队列取请求，首个请求到达后再等 window 秒收集同批请求（最多 max_batch_size 个）
+    - 只有 1 个请求时走 run_single（保留 KV 前缀缓存等单请求优化）
+    - 多个请求时左填充成一个 batch 逐 token 解码，各请求独立结束（EOS、停止序列或 max_new_tokens）
+    - 一个 batch 运行期间到达的请求在下一轮合批
+    - 每个请求最多生成 request_timeout 秒，超时以 TimeoutError 结束，不会卡住调度线程；
+      run_single(request, timeout) 需要保证在 timeout 秒内产出增量或结束，
+      并在 request.cancel 被设置或生成器关闭时停止生成
+    """
+
+    def __init__(self, model, tokenizer, run_single: Callable[[LocalRequest, float], Generator[str, None, None]],
+                 max_batch_size: int = 8, window: float = 0.03, request_timeout: float = 120.0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.run_single = run_single
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.request_timeout = request_timeout
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: Prompt, max_new_tokens: int, temperature: float, **kwargs) -> Generator[str, None, None]:
+        """提交请求并逐段返回生成的文本增量"""
+        request = LocalRequest(text, max_new_tokens, temperature, **kwargs)
+        self._ensure_worker()
+        self._queue.put(request)
+        try:
+            while True:
+                item = request.out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            request.cancel.set()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, daemon=True, name="local-llm-batcher")
+                self._worker.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [r for r in batch if not r.cancelled]
+            if not batch:
+                continue
+            metrics.observe("llm.local.batch_size", len(batch))
+            try:
+                if len(batch) == 1:
+                    request = batch[0]
+                    deadline = time.monotonic() + self.request_timeout
+                    stream = self.run_single(request, self.request_timeout)
+                    try:
+                        for delta in stream:
+                            if request.cancelled:
+                                break
+                            request.out.put(delta)
+                            if time.monotonic() > deadline:
+                                raise TimeoutError(f"本地生成超过 {self.request_timeout:.0f}s")
+                    finally:
+                        # 关闭生成器会停止并等待其 generate 线程，之后才取下一批，避免两个生成同时占用模型
+                        stream.close()
+                else:
+                    self._run_batch(batch)
+            except Exception as e:
+                print(f"[LocalBatcher] 本地生成失败: {e}")
+                for request in batch:
+                    request.out.put(e)
+            finally:
+                for request in batch:
+                    request.out.put(_DONE)
+
+    def _eos_token_ids(self) -> set:
+        ids = {self.tokenizer.eos_token_id}
+        config_eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        if isinstance(config_eos, int):
+            ids.add(config_eos)
+        elif config_eos:
+            ids.update(config_eos)
+        ids.discard(None)
+        return ids
+
+    def _encode(self, batch: List[LocalRequest]):
+        """按 chat 模板拼好各请求的 prompt，左填充成一个 batch"""
+        texts = [
+            self.tokenizer.apply_chat_template(
+                as_messages(r.text), tokenize=False, add_generation_prompt=True,
+                enable_thinking=False   # Qwen3 模板关闭思考，其他模板忽略该参数
+            )
+            for r in batch
+        ]
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            if self.tokenizer.pad_token_id is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            return self.tokenizer(texts, return_tensors="pt", padding=True)
+        finally:
+            self.tokenizer.padding_side = padding_side
+
+    @staticmethod
+    def _sample(logits, temperatures, top_p: float = 0.9):
+        """逐行按各自的温度 + top-p 采样"""
+        import torch
+
+        logits = logits / temperatures.clamp(min=1e-5).unsqueeze(-1)
+        probs = torch.softmax(logits.float(), dim=-1)
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True, dim=-1)
+        # 累计概率超过 top_p 之后的 token 置零（至少保留概率最高的一个）
+        drop = sorted_probs.cumsum(dim=-1) - sorted_probs > top_p
+        sorted_probs = sorted_probs.masked_fill(drop, 0.0)
+        choice = torch.multinomial(sorted_probs, num_samples=1)
+        return sorted_idx.gather(-1, choice).squeeze(-1)
+
+    @staticmethod
+    def _finish_row(request: LocalRequest, stop_filter: StopSequenceFilter):
+        """该行结束（EOS 或达到 max_new_tokens）时输出停止序列过滤器暂存的文本"""
+        tail = stop_filter.flush()
+        if tail and not request.cancelled:
+            request.out.put(tail)
+
+    def _run_batch(self, batch: List[LocalRequest]):
+        import torch
+
+        start = time.time()
+        deadline = time.monotonic() + self.request_timeout
+        encoded = self._encode(batch)
+        input_ids = encoded["input_ids"]
+        attention_mask = encoded["attention_mask"]
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+        temperatures = torch.tensor([r.temperature for r in batch], dtype=torch.float32)
+        eos_ids = self._eos_token_ids()
+        pad_id = self.tokenizer.pad_token_id
+
+        generated: List[List[int]] = [[] for _ in batch]
+        emitted = [""] * len(batch)
+        stop_filters = [StopSequenceFilter(r.kwargs.get("stop") or []) for r in batch]
+        finished = [False] * len(batch)
+        max_steps = max(r.max_new_tokens for r in batch)
+        first_token_at: Optional[float] = None
+        total_tokens = 0
+
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                 position_ids=position_ids, use_cache=True)
+            for step in range(max_steps):
+                next_tokens = self._sample(outputs.logits[:, -1, :], temperatures)
+                if first_token_at is None:
+                    first_token_at = time.time()
+                    metrics.observe("llm.local.ttft", first_token_at - start)
+
+                for i, request in enumerate(batch):
+                    if finished[i]:
+                        next_tokens[i] = pad_id
+                        continue
+                    token = int(next_tokens[i])
+                    if token in eos_ids or request.cancelled:
+                        self._finish_row(request, stop_filters[i])
+                        finished[i] = True
+                        continue
+                    generated[i].append(token)
+                    total_tokens += 1
+                    # 整段解码后取差量，末尾是不完整的多字节字符时先不输出
+                    text = self.tokenizer.decode(generated[i], skip_special_tokens=True)
+                    if not text.endswith("�") and len(text) > len(emitted[i]):
+                        delta = stop_filters[i].feed(text[len(emitted[i]):])
+                        if delta:
+                            request.out.put(delta)
+                        emitted[i] = text
+                    if stop_filters[i].stopped:
+                        metrics.incr("llm.local.stop_hit")
+                        finished[i] = True
+                    elif len(generated[i]) >= request.max_new_tokens:
+                        self._finish_row(request, stop_filters[i])
+                        finished[i] = True
+
+                if not all(finished) and time.monotonic() > deadline:
+                    print(f"[LocalBatcher] batch 生成超过 {self.request_timeout:.0f}s，结束未完成的请求")
+                    for i, request in enumerate(batch):
+                        if not finished[i]:
+                            request.out.put(TimeoutError(f"本地生成超过 {self.request_timeout:.0f}s"))
+                            finished[i] = True
+                if all(finished):
+                    break
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(batch), 1))], dim=-1)
+                position_ids = position_ids[:, -1:] + 1
+                outputs = self.model(input_ids=next_tokens.unsqueeze(-1), attention_mask=attention_mask,
+                                     position_ids=position_ids, past_key_values=outputs.past_key_values,
+                                     use_cache=True)
+
+        elapsed = time.time() - start
+        tokens_per_s = total_tokens / elapsed if elapsed > 0 else 0.0
+        metrics.observe("llm.local.batch_tokens_per_s", tokens_per_s)
+        print(f"[LocalBatcher] batch={len(batch)}, {total_tokens} tokens, {elapsed:.1f}s, {tokens_per_s:.1f} tokens/s")
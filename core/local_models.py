@@ -0,0 +1,210 @@
+"""
+本地模型常驻管理
+在内存预算内常驻多个本地模型：启动时按可用内存为每个档位选定模型，用到时加载，超出预算按 LRU 卸载
+"""
+import gc
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from core.metrics import metrics
+
+# 每个参数占用的字节数（int8 动态量化只量化 Linear，embedding 等仍为 fp32）
+BYTES_PER_PARAM = {"none": 4.0, "bf16": 2.0, "int8": 1.3}
+DTYPE_BYTES = {"float32": 4, "bfloat16": 2, "float16": 2}
+# 权重之外的运行时开销（KV cache、激活、分词器等）
+RUNTIME_OVERHEAD = 1.15
+
+
+def available_memory_bytes() -> int:
+    """当前可用内存（MemAvailable），无法获取时返回 0"""
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        pass
+    meminfo = Path("/proc/meminfo")
+    if meminfo.exists():
+        for line in meminfo.read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def local_model_dir(spec: dict) -> Path:
+    """ModelScope 缓存目录（模型 ID 中的 "." 在目录名里写作 "___"）"""
+    return Path(spec["cache_dir"]) / spec["model_id"].replace(".", "___")
+
+
+def estimate_model_bytes(spec: dict, quantization: str) -> int:
+    """估算加载后的常驻内存：优先按本地 safetensors 索引的权重大小推算参数量，否则用 spec["params_b"]"""
+    params = spec["params_b"] * 1e9
+    model_dir = local_model_dir(spec)
+    index = model_dir / "model.safetensors.index.json"
+    if index.exists():
+        try:
+            total_size = json.loads(index.read_text())["metadata"]["total_size"]
+            dtype = json.loads((model_dir / "config.json").read_text()).get("torch_dtype", "bfloat16")
+            params = total_size / DTYPE_BYTES.get(dtype, 2)
+        except (OSError, ValueError, KeyError):
+            pass
+    return int(params * BYTES_PER_PARAM.get(quantization, 4.0) * RUNTIME_OVERHEAD)
+
+
+@dataclass
+class ResidentModel:
+    name: str
+    model: object
+    tokenizer: object
+    nbytes: int
+    pinned: bool = False          # 主模型常驻，不参与 LRU 卸载
+    refs: int = 0                 # 正在使用该模型的调用数，大于 0 时不卸载
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class LocalModelManager:
+    """本地模型常驻管理
+
+    - specs: 模型名 -> {model_id, cache_dir, params_b}
+    - tiers: 档位 -> 候选模型名（按偏好排序），与 LLM_TASK_ROUTES 的档位一致
+    - plan(): 启动时按预算为每个档位选定模型，后面的档位至少预留其最小候选的内存
+    - acquire(name) / release(resident): 用到时加载，超出预算时卸载最久未用且空闲的模型
+    """
+
+    def __init__(self, specs: Dict[str, dict], tiers: Dict[str, List[str]], budget_bytes: int,
+                 quantization: str, load_fn: Callable[[dict], Tuple[object, object]]):
+        self.specs = specs
+        self.tiers = tiers
+        self.budget_bytes = budget_bytes
+        self.quantization = quantization
+        self.load_fn = load_fn
+        self.selection: Dict[str, str] = {}
+        self.resident: Dict[str, ResidentModel] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Event] = {}
+        self._reserved = 0            # 正在加载的模型预留的字节数，并发加载时一起计入预算
+
+    def estimate(self, name: str) -> int:
+        return estimate_model_bytes(self.specs[name], self.quantization)
+
+    def plan(self) -> Dict[str, str]:
+        """按内存预算为每个档位选定模型（同一模型可服务多个档位）"""
+        tiers = [(tier, [c for c in candidates if c in self.specs]) for tier, candidates in self.tiers.items()]
+        tiers = [(tier, candidates) for tier, candidates in tiers if candidates]
+        remaining = self.budget_bytes
+        selection: Dict[str, str] = {}
+        for i, (tier, candidates) in enumerate(tiers):
+            chosen = set(selection.values())
+
+            def fits(name: str) -> bool:
+                # 选中 name 后，后面尚未被已选模型覆盖的档位至少还要放下其最小候选
+                if name in chosen:
+                    return True
+                uncovered = [later for _, later in tiers[i + 1:] if not (chosen | {name}) & set(later)]
+                reserve = sum(min(self.estimate(c) for c in later) for later in uncovered)
+                return self.estimate(name) + reserve <= remaining
+
+            pick = next((c for c in candidates if fits(c)), None)
+            pick = pick or next((c for c in candidates if self.estimate(c) <= remaining), None)
+            pick = pick or min(candidates, key=self.estimate)
+            if pick not in chosen:
+                remaining -= self.estimate(pick)
+            selection[tier] = pick
+        self.selection = selection
+        summary = ", ".join(f"{tier}={name}({self.estimate(name) / 2**30:.1f}GB)" for tier, name in selection.items())
+        print(f"[LocalModels] 内存预算 {self.budget_bytes / 2**30:.1f}GB，档位选择: {summary}")
+        return selection
+
+    def fallbacks(self, tier: str) -> List[str]:
+        """该档位的加载顺序：选定的模型，其后是比它小的候选"""
+        candidates = [c for c in self.tiers.get(tier, []) if c in self.specs]
+        chosen = self.selection.get(tier)
+        if chosen not in candidates:
+            return candidates
+        return [chosen] + [c for c in candidates if c != chosen and self.estimate(c) <= self.estimate(chosen)]
+
+    def acquire(self, name: str, pin: bool = False) -> ResidentModel:
+        """取得一个常驻模型（必要时加载），用完需调用 release"""
+        while True:
+            with self._lock:
+                resident = self.resident.get(name)
+                if resident is not None:
+                    resident.refs += 1
+                    resident.last_used = time.monotonic()
+                    resident.pinned = resident.pinned or pin
+                    metrics.incr("llm.local.models.hit")
+                    return resident
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = threading.Event()
+                    break
+            # 其他线程正在加载同一个模型
+            loading.wait()
+
+        nbytes = 0
+        try:
+            nbytes = self._make_room(self.estimate(name))
+            start = time.time()
+            print(f"[LocalModels] 加载 {name}（约 {nbytes / 2**30:.1f}GB）...")
+            model, tokenizer = self.load_fn(self.specs[name])
+            metrics.incr("llm.local.models.load")
+            metrics.observe(f"llm.local.models.load_time.{name}", time.time() - start)
+            resident = ResidentModel(name, model, tokenizer, nbytes, pinned=pin, refs=1)
+            with self._lock:
+                self.resident[name] = resident
+            print(f"[LocalModels] ✓ {name} 已常驻 ({time.time() - start:.1f}s)，当前占用 {self.used_bytes() / 2**30:.1f}GB")
+            return resident
+        finally:
+            with self._lock:
+                self._reserved -= nbytes
+                self._loading.pop(name).set()
+
+    def release(self, resident: ResidentModel):
+        with self._lock:
+            resident.refs = max(0, resident.refs - 1)
+            resident.last_used = time.monotonic()
+
+    def can_fit(self, name: str) -> bool:
+        """name 已常驻，或卸载所有可卸载的模型后能放进预算"""
+        with self._lock:
+            if name in self.resident:
+                return True
+            kept = sum(r.nbytes for r in self.resident.values() if r.pinned or r.refs > 0)
+            return kept + self._reserved + self.estimate(name) <= self.budget_bytes
+
+    def used_bytes(self) -> int:
+        return sum(r.nbytes for r in self.resident.values())
+
+    def _make_room(self, nbytes: int) -> int:
+        """卸载最久未用、未固定且空闲的模型，直到能放下 nbytes（计入其他线程正在加载的预留），
+        并在同一把锁内为本次加载预留 nbytes，返回预留的字节数（加载结束后归还）；放不下时仍然加载并给出警告"""
+        with self._lock:
+            while self.used_bytes() + self._reserved + nbytes > self.budget_bytes:
+                idle = [r for r in self.resident.values() if not r.pinned and r.refs == 0]
+                if not idle:
+                    print(f"[LocalModels] 警告: 无可卸载的模型，加载后将超出内存预算 "
+                          f"({(self.used_bytes() + self._reserved + nbytes) / 2**30:.1f}GB > {self.budget_bytes / 2**30:.1f}GB)")
+                    break
+                victim = min(idle, key=lambda r: r.last_used)
+                del self.resident[victim.name]
+                metrics.incr("llm.local.models.evict")
+                print(f"[LocalModels] 卸载 {victim.name}，释放约 {victim.nbytes / 2**30:.1f}GB")
+            self._reserved += nbytes
+        gc.collect()
+        return nbytes
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "budget_gb": round(self.budget_bytes / 2**30, 2),
+                "used_gb": round(self.used_bytes() / 2**30, 2),
+                "selection": dict(self.selection),
+                "resident": {name: {"pinned": r.pinned, "refs": r.refs} for name, r in self.resident.items()},
+            }
@@ -0,0 +1,76 @@
+"""
+进程内轻量指标
+计数器 + 最近 N 个样本的分位数，用于 LLM 调用耗时、限流等待等统计
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+
+class Metrics:
+    """线程安全的计数器与样本统计"""
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.max_samples)
+            self._samples[name].append(value)
+
+    def count(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """返回样本的 q 分位数（q 取 0~1），无样本时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(q * len(samples)))
+        return samples[idx]
+
+    def snapshot(self) -> Dict:
+        """导出当前所有指标：{"counters": {...}, "samples": {name: {count, mean, p50, p90, p99}}}"""
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+
+        summary = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            n = len(values)
+            summary[name] = {
+                "count": n,
+                "mean": sum(values) / n,
+                "p50": values[min(n - 1, int(0.5 * n))],
+                "p90": values[min(n - 1, int(0.9 * n))],
+                "p99": values[min(n - 1, int(0.99 * n))],
+            }
+        return {"counters": counters, "samples": summary}
+
+    def report(self, prefix: str = "") -> str:
+        """以文本形式输出名称以 prefix 开头的指标，便于写日志"""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            if name.startswith(prefix):
+                lines.append(f"{name} = {value:g}")
+        for name, s in sorted(snap["samples"].items()):
+            if name.startswith(prefix):
+                lines.append(f"{name}: n={s['count']} mean={s['mean']:.2f} p50={s['p50']:.2f} p90={s['p90']:.2f} p99={s['p99']:.2f}")
+        return "\n".join(lines)
+
+
+# 进程级单例
+metrics = Metrics()
@@ -0,0 +1,91 @@
+"""
+safetensors 内存映射加载
+直接 mmap 各个分片，按文件头把张量映射成 torch.frombuffer 视图，再以 assign 方式装进空模型：
+权重 dtype 与文件一致时不拷贝（冷启动只建立映射，页面按需读入），多个进程加载同一 checkpoint 时共享 OS page cache
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+def safetensors_files(model_dir: Path) -> List[Path]:
+    """checkpoint 目录下的 safetensors 分片（按 index 的 weight_map），没有时为空列表"""
+    index = model_dir / "model.safetensors.index.json"
+    if index.exists():
+        weight_map = json.loads(index.read_text())["weight_map"]
+        return [model_dir / name for name in sorted(set(weight_map.values()))]
+    single = model_dir / "model.safetensors"
+    return [single] if single.exists() else []
+
+
+def mmap_safetensors(path: Path) -> Dict[str, "torch.Tensor"]:
+    """把一个 safetensors 文件映射为 {名称: 张量}，张量直接引用映射的页面（写时复制，不会改动文件）"""
+    import torch
+
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_len
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        count = (end - start) // dtype.itemsize
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=count, offset=base + start).view(info["shape"])
+    return tensors
+
+
+def load_mmap_causal_lm(model_dir: Path, torch_dtype: Optional["torch.dtype"] = None):
+    """以内存映射方式加载 CausalLM 权重（不含分词器），目录中没有 safetensors 时抛出 FileNotFoundError
+
+    torch_dtype 与文件 dtype 不同时该张量会被转换（即拷贝），只有一致时才是零拷贝。
+    需要 accelerate（构建不分配权重的空模型）和 torch>=2.1（load_state_dict(assign=True)）。
+    """
+    import torch
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+    files = safetensors_files(model_dir)
+    if not files:
+        raise FileNotFoundError(f"{model_dir} 下没有 safetensors 权重")
+
+    config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+    # 只把参数放到 meta 设备，rotary 等非持久 buffer 照常在 CPU 上初始化
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=True)
+
+    state = {}
+    copied = 0
+    for path in files:
+        for name, tensor in mmap_safetensors(path).items():
+            if torch_dtype is not None and tensor.is_floating_point() and tensor.dtype != torch_dtype:
+                tensor = tensor.to(torch_dtype)
+                copied += 1
+            state[name] = tensor
+    model.load_state_dict(state, strict=False, assign=True)
+    if getattr(config, "tie_word_embeddings", False):
+        model.tie_weights()
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"以下权重未在 checkpoint 中找到: {', '.join(missing[:5])}")
+    if (model_dir / "generation_config.json").exists():
+        model.generation_config = GenerationConfig.from_pretrained(model_dir)
+    if copied:
+        print(f"[MmapLoader] {copied} 个张量的 dtype 与文件不同，已转换（这部分不是零拷贝）")
+    model.eval()
+    return model
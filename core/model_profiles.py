@@ -0,0 +1,67 @@
+"""
+API 模型请求配置
+混合推理模型（Qwen3、GLM-4.x）默认会先输出思考内容，思考占满 max_tokens 时 message.content 为空。
+按模型名前缀匹配 profile，组装请求时关闭思考、去掉该模型不支持的参数，并按其支持程度选择 JSON 输出模式
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# 各家关闭思考的请求参数（放在 extra_body 里）
+THINKING_SWITCHES = {
+    "qwen3": lambda enabled: {"enable_thinking": enabled},
+    "glm": lambda enabled: {"thinking": {"type": "enabled" if enabled else "disabled"}},
+}
+
+# JSON 输出模式由弱到强
+JSON_MODES = ("off", "json_object", "json_schema")
+
+
+def reasoning_text(obj) -> str:
+    """消息或流式增量中的思考内容（reasoning_content，SDK 未声明该字段时在 model_extra 里）"""
+    if obj is None:
+        return ""
+    text = getattr(obj, "reasoning_content", None)
+    if text is None:
+        text = (getattr(obj, "model_extra", None) or {}).get("reasoning_content")
+    return text or ""
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    name: str
+    thinking: Optional[str] = None          # THINKING_SWITCHES 的键，None 表示不是混合推理模型
+    json_mode: str = "json_schema"          # 支持的最强 JSON 输出模式
+    unsupported_params: Tuple[str, ...] = ()
+
+    def json_mode_for(self, requested: str) -> str:
+        """请求的 JSON 模式与模型支持程度取较弱者"""
+        if requested not in JSON_MODES:
+            return requested
+        return JSON_MODES[min(JSON_MODES.index(requested), JSON_MODES.index(self.json_mode))]
+
+    def apply(self, kwargs: dict, thinking: bool = False) -> dict:
+        """去掉不支持的参数，混合推理模型附加思考开关"""
+        kwargs = {k: v for k, v in kwargs.items() if k not in self.unsupported_params}
+        if self.thinking in THINKING_SWITCHES:
+            kwargs["extra_body"] = {**kwargs.get("extra_body", {}), **THINKING_SWITCHES[self.thinking](thinking)}
+        return kwargs
+
+
+class ModelProfiles:
+    """按模型名前缀（最长匹配优先）查找 profile，没有匹配时为默认 profile"""
+
+    def __init__(self, profiles: Dict[str, dict]):
+        self._profiles = sorted(profiles.items(), key=lambda item: len(item[0]), reverse=True)
+        self._cache: Dict[str, ModelProfile] = {}
+
+    def get(self, model: str) -> ModelProfile:
+        profile = self._cache.get(model)
+        if profile is None:
+            spec = next((spec for prefix, spec in self._profiles if model.startswith(prefix)), {})
+            profile = self._cache[model] = ModelProfile(
+                name=model,
+                thinking=spec.get("thinking"),
+                json_mode=spec.get("json_mode", "json_schema"),
+                unsupported_params=tuple(spec.get("unsupported_params", ())),
+            )
+        return profile
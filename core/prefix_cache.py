@@ -0,0 +1,91 @@
+"""
+本地模型 KV 前缀缓存
+按 session（+ 调用类型）保存上一轮 prompt 的 past_key_values，下一轮只需 prefill 与上一轮不同的部分
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from core.metrics import metrics
+
+
+def common_prefix_length(a, b) -> int:
+    """两个一维 token id 张量的公共前缀长度"""
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatch = (a[:n] != b[:n]).nonzero()
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+def cache_nbytes(cache) -> int:
+    """估算 DynamicCache 占用的字节数（兼容新旧两种内部结构）"""
+    if hasattr(cache, "layers"):
+        tensors = [t for layer in cache.layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    else:
+        tensors = list(getattr(cache, "key_cache", [])) + list(getattr(cache, "value_cache", []))
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None and hasattr(t, "numel"))
+
+
+class PrefixCache:
+    """LRU 的 past_key_values 缓存，总占用超过 max_bytes 时淘汰最久未用的条目
+
+    take() 会把条目从缓存中取出（同一 key 的并发调用不会共用同一个 cache 对象），生成结束后再用 put() 放回。
+    """
+
+    def __init__(self, max_bytes: int, min_prefix_tokens: int = 32):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries: "OrderedDict[str, Tuple[object, object, int]]" = OrderedDict()  # key -> (ids, cache, nbytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def take(self, key: str, input_ids) -> Tuple[Optional[object], int]:
+        """取出 key 的缓存并裁剪到与 input_ids 的公共前缀，返回 (cache, 复用 token 数)；未命中返回 (None, 0)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._total_bytes -= entry[2]
+        if entry is None:
+            metrics.incr("llm.local.prefix_cache.miss")
+            return None, 0
+
+        cached_ids, cache, _ = entry
+        # 至少留一个 token 给本轮 prefill，generate 才能算出下一个 token 的 logits
+        reused = min(common_prefix_length(cached_ids, input_ids), len(input_ids) - 1)
+        if reused < self.min_prefix_tokens:
+            metrics.incr("llm.local.prefix_cache.miss")
+            return None, 0
+
+        cache.crop(reused)
+        metrics.incr("llm.local.prefix_cache.hit")
+        metrics.observe("llm.local.prefix_cache.reused_tokens", reused)
+        return cache, reused
+
+    def put(self, key: str, input_ids, cache):
+        """保存本轮 prompt 对应的 cache（生成出的 token 与下一轮 prompt 格式不同，只保留 prompt 部分）"""
+        cache.crop(len(input_ids))
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._total_bytes -= old[2]
+            self._entries[key] = (input_ids, cache, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted
+                metrics.incr("llm.local.prefix_cache.evict")
+
+    def drop(self, prefix: str):
+        """删除 key 以 prefix 开头的所有条目（session 结束时调用）"""
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._total_bytes -= self._entries.pop(key)[2]
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes
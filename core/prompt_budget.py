@@ -0,0 +1,136 @@
+"""
+Prompt token 预算
+按当前模型的分词器计数，把系统设定、局势等固定部分和尽可能多的最近对话装进每类调用的 token 预算
+
+build_messages 生成多条消息：稳定的 system 消息在前，对话历史按时间顺序居中，气场等每轮变化的内容放在末尾，
+相邻两次调用的前缀保持一致，可以命中服务端的提示缓存（以及本地模型的 KV 前缀缓存）
+"""
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from core.metrics import metrics
+
+# generate 系列接口的 prompt：字符串（视为一条 user 消息）或 OpenAI 格式的消息列表
+Prompt = Union[str, List[Dict[str, str]]]
+
+# chat 模板中每条消息的角色标记等开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """没有分词器时的估算：中文字符与全角标点各计 1 个，其余字符约 4 个计 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def as_messages(prompt: Prompt) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+
+
+@dataclass
+class PackedPrompt:
+    text: str
+    tokens: int          # 整个 prompt 的 token 数
+    turns: int           # 装入的对话条数
+    total_turns: int     # 可用的对话条数
+
+
+@dataclass
+class PackedMessages:
+    messages: List[Dict[str, str]]
+    tokens: int
+    turns: int
+    total_turns: int
+
+
+class PromptBuilder:
+    """按 token 预算装填对话历史
+
+    render(context) 生成完整 prompt（context 为拼好的对话记录），先计算不含对话时的固定开销，
+    再从最新一条往前装填，直到预算用完；最新一条总会保留。单条对话的 token 数有 LRU 缓存，
+    每回合只需对新增的对话分词。
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], cache_size: int = 4096):
+        self.count_tokens = count_tokens
+        self.cache_size = cache_size
+        self._line_tokens: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def build(self, task: str, render: Callable[[str], str], history: Sequence[Tuple[str, str]],
+              budget: int) -> PackedPrompt:
+        remaining = budget - self.count_tokens(render(""))
+        lines: List[str] = []
+        for name, text in reversed(history):
+            line = f"{name}: {text}"
+            cost = self._count_line(line) + 1   # 换行
+            if lines and cost > remaining:
+                break
+            lines.append(line)
+            remaining -= cost
+        lines.reverse()
+
+        prompt = render("\n".join(lines))
+        tokens = self.count_tokens(prompt)
+        metrics.observe(f"llm.prompt_tokens.{task}", tokens)
+        if len(lines) < len(history):
+            metrics.incr(f"llm.prompt_truncated.{task}")
+        return PackedPrompt(prompt, tokens, len(lines), len(history))
+
+    def build_messages(self, task: str, system: str, history: Sequence[Tuple[str, str]], tail: str, budget: int,
+                       is_assistant: Optional[Callable[[str], bool]] = None) -> PackedMessages:
+        """system + 对话历史 + tail 的消息列表，对话历史按预算从最新一条往前装填
+
+        is_assistant(name) 为真的发言作为 assistant 消息、其余作为 user 消息（相邻同角色合并为一条），
+        tail 并入最后一条 user 消息；不传 is_assistant 时对话记录与 tail 合成一条 user 消息。
+        """
+        remaining = budget - self.count_tokens(system) - self.count_tokens(tail) - 2 * MESSAGE_OVERHEAD_TOKENS
+        lines: List[Tuple[str, str]] = []
+        for name, text in reversed(history):
+            line = f"{name}: {text}"
+            cost = self._count_line(line) + (MESSAGE_OVERHEAD_TOKENS if is_assistant else 1)
+            if lines and cost > remaining:
+                break
+            lines.append((name, line))
+            remaining -= cost
+        lines.reverse()
+
+        messages = [{"role": "system", "content": system}]
+        if is_assistant is None:
+            context = "\n".join(line for _, line in lines)
+            messages.append({"role": "user", "content": f"{context}\n\n{tail}" if context else tail})
+        else:
+            for name, line in lines:
+                role = "assistant" if is_assistant(name) else "user"
+                if messages[-1]["role"] == role:
+                    messages[-1] = {"role": role, "content": f"{messages[-1]['content']}\n{line}"}
+                else:
+                    messages.append({"role": role, "content": line})
+            if messages[-1]["role"] == "user":
+                messages[-1] = {"role": "user", "content": f"{messages[-1]['content']}\n\n{tail}"}
+            else:
+                messages.append({"role": "user", "content": tail})
+
+        tokens = budget - remaining
+        metrics.observe(f"llm.prompt_tokens.{task}", tokens)
+        if len(lines) < len(history):
+            metrics.incr(f"llm.prompt_truncated.{task}")
+        return PackedMessages(messages, tokens, len(lines), len(history))
+
+    def _count_line(self, line: str) -> int:
+        with self._lock:
+            tokens = self._line_tokens.get(line)
+            if tokens is not None:
+                self._line_tokens.move_to_end(line)
+                return tokens
+        tokens = self.count_tokens(line)
+        with self._lock:
+            self._line_tokens[line] = tokens
+            if len(self._line_tokens) > self.cache_size:
+                self._line_tokens.popitem(last=False)
+        return tokens
@@ -0,0 +1,154 @@
+"""
+魔搭 API 客户端限流
+进程级令牌桶 + 优先级排队：回合回复 > 裁判 > 救场建议 > 复盘报告
+"""
+import asyncio
+import itertools
+import threading
+import time
+from enum import IntEnum
+from typing import Optional
+
+from core.metrics import metrics
+
+
+class Priority(IntEnum):
+    """LLM 请求优先级，数值越小越优先"""
+    TURN = 0     # 玩家回合中的角色回复（含开场白）
+    JUDGE = 1    # 回合裁判
+    RESCUE = 2   # 救场建议
+    REPORT = 3   # 复盘报告 / 对决总结
+
+
+class PriorityRateLimiter:
+    """令牌桶限流器
+
+    - 每秒补充 rate 个令牌，最多积累 burst 个
+    - 排队时只有“当前最优先”的请求可以取令牌；等待越久优先级越高（aging_seconds 提升一级），避免低优先级永久饿死
+    - 收到 429 时调用 penalize(retry_after)，在 Retry-After 到期前所有请求都暂停
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, rate: float, burst: int, aging_seconds: float = 30.0):
+        self.rate = rate
+        self.capacity = burst
+        self.aging_seconds = aging_seconds
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters = {}   # ticket -> (priority, enqueued_at)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority: Priority = Priority.TURN, timeout: Optional[float] = None) -> float:
+        """阻塞直到拿到令牌，返回等待秒数；超时抛出 TimeoutError"""
+        ticket, start = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_take(ticket)
+                if wait <= 0:
+                    return self._record_wait(priority, start)
+                if timeout is not None and time.monotonic() - start + wait > timeout:
+                    raise TimeoutError(f"限流等待超时 ({priority.name})")
+                time.sleep(min(wait, self.POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket)
+
+    async def acquire_async(self, priority: Priority = Priority.TURN, timeout: Optional[float] = None) -> float:
+        """acquire 的异步版本，等待期间让出事件循环"""
+        ticket, start = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_take(ticket)
+                if wait <= 0:
+                    return self._record_wait(priority, start)
+                if timeout is not None and time.monotonic() - start + wait > timeout:
+                    raise TimeoutError(f"限流等待超时 ({priority.name})")
+                await asyncio.sleep(min(wait, self.POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket)
+
+    def penalize(self, retry_after: float):
+        """服务端返回 429：清空令牌，并在 retry_after 秒内暂停所有请求"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._updated = now
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        metrics.incr("llm.ratelimit.429")
+        print(f"[RateLimiter] 收到 429，暂停 {retry_after:.1f}s")
+
+    def _enqueue(self, priority: Priority):
+        ticket = next(self._seq)
+        now = time.monotonic()
+        with self._lock:
+            self._waiters[ticket] = (priority, now)
+        return ticket, now
+
+    def _dequeue(self, ticket: int):
+        with self._lock:
+            self._waiters.pop(ticket, None)
+
+    def _head(self, now: float) -> int:
+        """当前最优先的排队请求（优先级按等待时长提升，同级先到先得）"""
+        return min(
+            self._waiters,
+            key=lambda t: (self._waiters[t][0] - (now - self._waiters[t][1]) / self.aging_seconds, t)
+        )
+
+    def _try_take(self, ticket: int) -> float:
+        """尝试取令牌：成功返回 0，否则返回建议等待秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._head(now) != ticket:
+                return self.POLL_INTERVAL
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _record_wait(self, priority: Priority, start: float) -> float:
+        waited = time.monotonic() - start
+        metrics.observe(f"llm.ratelimit.wait.{priority.name.lower()}", waited)
+        if waited > 0.5:
+            print(f"[RateLimiter] {priority.name} 请求排队 {waited:.1f}s")
+        return waited
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """是否为 429 Too Many Requests"""
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从异常附带的响应头中解析 Retry-After（秒数或 HTTP 日期）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,82 @@
+"""
+投机解码统计
+小模型起草、大模型验证（transformers 的 assisted generation）时，用 forward hook 统计两边的调用次数，
+估算每次调用的草稿接受率和生成速度
+"""
+import threading
+import time
+
+from core.metrics import metrics
+
+
+def vocab_mismatches(target_tokenizer, draft_tokenizer) -> int:
+    """草稿模型词表中与主模型编号不同（或主模型没有）的 token 数，为 0 时可以投机解码。
+
+    同一家族的新版本会在词表末尾追加特殊 token（如 Qwen2.5 比 Qwen2 多出视觉 / 工具相关 token），
+    主模型多出的 token 不影响起草与验证，因此不要求两边词表完全相同。
+    """
+    target_vocab = target_tokenizer.get_vocab()
+    return sum(1 for token, index in draft_tokenizer.get_vocab().items() if target_vocab.get(token) != index)
+
+
+class SpeculativeStats:
+    """一次投机解码调用的统计（with 块内统计 forward 次数）
+
+    草稿模型每次 forward 产出 1 个候选 token；目标模型每次 forward 验证一批候选，
+    接受其中若干个并额外产出 1 个 token，因此 接受数 ≈ 新 token 数 - 验证次数。
+    模型在多个 session 间共享，hook 只统计进入 with 块的线程（即本次 generate 所在线程）的 forward。
+    """
+
+    def __init__(self, target, draft):
+        self.target = target
+        self.draft = draft
+        self.target_forwards = 0
+        self.draft_forwards = 0
+        self.start = 0.0
+        self._handles = []
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        self._handles = [
+            self.target.register_forward_hook(self._count_target),
+            self.draft.register_forward_hook(self._count_draft),
+        ]
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        return False
+
+    def _count_target(self, *args):
+        if threading.get_ident() == self._thread:
+            self.target_forwards += 1
+
+    def _count_draft(self, *args):
+        if threading.get_ident() == self._thread:
+            self.draft_forwards += 1
+
+    def report(self, new_tokens: int) -> dict:
+        """记录指标并打印本次调用的接受率与速度"""
+        elapsed = time.time() - self.start
+        accepted = max(0, new_tokens - self.target_forwards)
+        acceptance = accepted / self.draft_forwards if self.draft_forwards else 0.0
+        tokens_per_s = new_tokens / elapsed if elapsed > 0 else 0.0
+        tokens_per_step = new_tokens / self.target_forwards if self.target_forwards else 0.0
+
+        metrics.observe("llm.local.spec.acceptance", acceptance)
+        metrics.observe("llm.local.spec.tokens_per_step", tokens_per_step)
+        metrics.observe("llm.local.spec.tokens_per_s", tokens_per_s)
+        print(f"[Speculative] {new_tokens} tokens | 草稿 {self.draft_forwards} 个，接受率 {acceptance:.0%} | "
+              f"验证 {self.target_forwards} 次，{tokens_per_step:.2f} tokens/次 | {tokens_per_s:.1f} tokens/s")
+        return {
+            "new_tokens": new_tokens,
+            "drafted": self.draft_forwards,
+            "accepted": accepted,
+            "acceptance": acceptance,
+            "tokens_per_step": tokens_per_step,
+            "tokens_per_s": tokens_per_s,
+        }
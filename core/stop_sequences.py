@@ -0,0 +1,92 @@
+"""
+停止序列
+API 由服务端在 stop 处截断；本地模型用 StoppingCriteria 提前结束生成，并从输出中截掉停止序列
+"""
+from typing import List, Sequence, Tuple
+
+# OpenAI 兼容接口 stop 参数最多 4 个
+MAX_API_STOP_SEQUENCES = 4
+
+
+def truncate_at_stop(text: str, stop: Sequence[str]) -> Tuple[str, bool]:
+    """在最早出现的停止序列处截断，返回 (截断后文本, 是否命中)"""
+    positions = [i for i in (text.find(s) for s in stop if s) if i != -1]
+    if not positions:
+        return text, False
+    return text[:min(positions)], True
+
+
+class StopSequenceCriteria:
+    """本地 generate 的 stopping_criteria：新生成的文本（忽略开头空白）出现任一停止序列即结束该行"""
+
+    def __init__(self, tokenizer, stop: Sequence[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop = [s for s in stop if s]
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        done = []
+        for row in input_ids:
+            text = self.tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True).lstrip()
+            done.append(truncate_at_stop(text, self.stop)[1])
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class CancelCriteria:
+    """本地 generate 的 stopping_criteria：cancel 事件被设置（调用方不再读取输出）后所有行在下一步结束"""
+
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        return torch.full((input_ids.shape[0],), self.cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class StopSequenceFilter:
+    """流式输出过滤：跳过开头空白，暂存可能是停止序列开头的末尾文本，命中停止序列后不再输出"""
+
+    def __init__(self, stop: Sequence[str]):
+        self.stop: List[str] = [s for s in stop if s]
+        self.buffer = ""
+        self.started = False
+        self.stopped = False
+
+    def feed(self, delta: str) -> str:
+        """输入一段增量，返回可以安全输出的文本"""
+        if self.stopped:
+            return ""
+        if not self.started:
+            delta = delta.lstrip()
+            if not delta:
+                return ""
+            self.started = True
+        self.buffer += delta
+        text, hit = truncate_at_stop(self.buffer, self.stop)
+        if hit:
+            self.stopped = True
+            self.buffer = ""
+            return text
+        hold = self._partial_match_length(self.buffer)
+        out = self.buffer[:len(self.buffer) - hold]
+        self.buffer = self.buffer[len(out):]
+        return out
+
+    def flush(self) -> str:
+        """生成结束时输出暂存的文本"""
+        out = "" if self.stopped else self.buffer
+        self.buffer = ""
+        return out
+
+    def _partial_match_length(self, text: str) -> int:
+        """text 末尾与某个停止序列开头重合的最大长度"""
+        best = 0
+        for s in self.stop:
+            for n in range(min(len(s) - 1, len(text)), best, -1):
+                if text.endswith(s[:n]):
+                    best = n
+                    break
+        return best
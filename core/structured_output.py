@@ -0,0 +1,107 @@
+"""
+结构化（JSON）输出
+描述每类调用的 JSON Schema 与输出上限，并把模型原始输出解析、校验成 dict
+"""
+import json
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True)
+class JsonSchema:
+    """一类结构化调用：name 用于指标命名，max_tokens 按 schema 的实际长度收紧"""
+    name: str
+    schema: Dict[str, Any]
+    max_tokens: int
+
+    def response_format(self, mode: str) -> Optional[Dict[str, Any]]:
+        """OpenAI 兼容接口的 response_format 参数；mode 为 json_schema / json_object / off
+
+        不开 strict：strict 模式要求每个对象都声明 additionalProperties: false，且不接受 minimum/maximum，
+        不满足时服务端直接返回 400；这里的 schema 只作引导，数值范围由 coerce 截断
+        """
+        if mode == "json_schema":
+            return {"type": "json_schema", "json_schema": {"name": self.name, "schema": self.schema}}
+        if mode == "json_object":
+            return {"type": "json_object"}
+        return None
+
+
+def is_response_format_rejected(error: Exception) -> bool:
+    """是否为服务端拒绝 response_format 参数的 400（错误内容提到 response_format / json_schema 等）；
+    其他 400（prompt 过长、参数错误等）不算"""
+    if getattr(error, "status_code", None) != 400:
+        return False
+    detail = f"{getattr(error, 'body', None) or ''} {error}".lower()
+    return any(key in detail for key in ("response_format", "json_schema", "json_object", "json mode"))
+
+
+def extract_json(text: str) -> Any:
+    """从模型输出中取出 JSON：去掉 <think> 段和 ``` 代码块围栏，必要时截取第一个 { 到最后一个 }"""
+    text = re.sub(r"<think>.*?</think>", "", text or "", flags=re.S).strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, flags=re.S)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+def coerce(value: Any, schema: Dict[str, Any], path: str = "$") -> Any:
+    """按 schema 校验并做宽松转换（数字字符串转整数、整数按 minimum/maximum 截断），不符合时抛出 ValueError"""
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise ValueError(f"{path} 应为对象")
+        result = dict(value)
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path}.{key} 缺失")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                result[key] = coerce(value[key], sub_schema, f"{path}.{key}")
+        return result
+    if kind == "array":
+        if not isinstance(value, list):
+            raise ValueError(f"{path} 应为数组")
+        item_schema = schema.get("items", {})
+        return [coerce(item, item_schema, f"{path}[{i}]") for i, item in enumerate(value)]
+    if kind in ("integer", "number"):
+        if isinstance(value, bool):
+            raise ValueError(f"{path} 应为数字")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{path} 应为数字: {value!r}")
+        # Infinity / NaN / 1e400 等无法截断成有限数字，int() 还会抛 OverflowError
+        if not math.isfinite(number):
+            raise ValueError(f"{path} 应为有限数字: {value!r}")
+        if kind == "integer":
+            number = int(number)
+        if "minimum" in schema:
+            number = max(schema["minimum"], number)
+        if "maximum" in schema:
+            number = min(schema["maximum"], number)
+        return number
+    if kind == "boolean":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        raise ValueError(f"{path} 应为布尔值")
+    if kind == "string":
+        if isinstance(value, (dict, list)) or value is None:
+            raise ValueError(f"{path} 应为字符串")
+        return str(value)
+    return value
+
+
+def parse_structured(text: str, schema: JsonSchema) -> Dict[str, Any]:
+    """解析并校验模型输出，失败时抛出 ValueError"""
+    return coerce(extract_json(text), schema.schema)
@@ -0,0 +1,164 @@
+"""
+分句流水线语音合成
+按中文句末标点（。！？；）和换行把流式回复切成句子，每句完整时立即提交合成，合成结果按句子顺序交给播放器。
+括号内的动作描写不朗读，也不在括号内断句；行首的“角色名:”前缀去掉
+"""
+import io
+import re
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, Iterable, List, Optional, Tuple
+
+SENTENCE_END = "。！？；"
+TRAILING = SENTENCE_END + "”’」』…"   # 紧跟句末标点的连续标点 / 引号归入同一句
+OPEN_BRACKETS = "（("
+CLOSE_BRACKETS = "）)"
+
+
+def speakable(text: str, names: Iterable[str] = ()) -> str:
+    """句子中需要朗读的部分：去掉括号内的动作描写（含未闭合的）和行首角色名前缀，没有文字时返回空串"""
+    text = re.sub(r"[（(][^）)]*[）)]?", "", text).strip()
+    for name in names:
+        for sep in (":", "："):
+            if text.startswith(name + sep):
+                text = text[len(name) + 1:].strip()
+    return text if re.search(r"\w", text) else ""
+
+
+class SentenceSplitter:
+    """增量切句：feed 返回已完整的句子，flush 返回剩余文本"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._depth = 0           # 括号嵌套深度，括号内不断句
+        self._ended = False       # 已遇到句末标点，等下一个非标点字符再切出
+
+    def feed(self, text: str) -> List[str]:
+        sentences = []
+        for ch in text:
+            if self._ended and ch not in TRAILING:
+                sentences.append(self._cut())
+            if ch == "\n":
+                # 换行是下一位角色发言或新段落
+                if self._buffer.strip():
+                    sentences.append(self._cut())
+                self._buffer, self._depth = "", 0
+                continue
+            self._buffer += ch
+            if ch in OPEN_BRACKETS:
+                self._depth += 1
+            elif ch in CLOSE_BRACKETS:
+                self._depth = max(0, self._depth - 1)
+            elif ch in SENTENCE_END and self._depth == 0:
+                self._ended = True
+        return sentences
+
+    def flush(self) -> List[str]:
+        return [self._cut()] if self._buffer.strip() else []
+
+    def _cut(self) -> str:
+        sentence, self._buffer, self._ended = self._buffer, "", False
+        return sentence
+
+
+def merge_audio(chunks: List[bytes]) -> bytes:
+    """把按句合成的音频拼成一段 WAV（用于回放与对局记录）"""
+    if len(chunks) == 1:
+        return chunks[0]
+    from pydub import AudioSegment
+
+    merged = AudioSegment.empty()
+    for chunk in chunks:
+        merged += AudioSegment.from_file(io.BytesIO(chunk))
+    out = io.BytesIO()
+    merged.export(out, format="wav")
+    return out.getvalue()
+
+
+class TTSPipeline:
+    """一次回复的分句合成
+
+    - feed(delta) 随流式文本切句，可朗读字数不足 min_chars 的句子与下一句合并后提交到 executor（多句并行合成）
+    - ready() 非阻塞地按句子顺序取出已合成的音频，next_chunk() 阻塞等待下一段（finish() 之后使用）
+    - first_audio_at / last_audio_at 为首段与最后一段音频交给调用方的时间
+    """
+
+    def __init__(self, synthesize: Callable[[str], Optional[bytes]], executor: Executor,
+                 names: Iterable[str] = (), min_chars: int = 6):
+        self.synthesize = synthesize
+        self.executor = executor
+        self.names = list(names)
+        self.min_chars = min_chars
+        self._splitter = SentenceSplitter()
+        self._pending = ""
+        self._jobs: List[Tuple[str, Future]] = []
+        self._next = 0
+        self.chunks: List[bytes] = []
+        self.first_audio_at: Optional[float] = None
+        self.last_audio_at: Optional[float] = None
+
+    def feed(self, text: str):
+        for sentence in self._splitter.feed(text):
+            self._add(sentence)
+
+    def finish(self, fallback_text: str = ""):
+        """文本结束：提交剩余部分；整段回复没有可朗读的句子时（如使用了 fallback 回复）改为合成 fallback_text"""
+        for sentence in self._splitter.flush():
+            self._add(sentence)
+        if not self._jobs and not self._pending and fallback_text:
+            self._splitter = SentenceSplitter()
+            for sentence in self._splitter.feed(fallback_text) + self._splitter.flush():
+                self._add(sentence)
+        if self._pending:
+            self._submit(self._pending)
+
+    def ready(self) -> List[Tuple[int, bytes]]:
+        chunks = []
+        while self._next < len(self._jobs) and self._jobs[self._next][1].done():
+            chunk = self._take()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def next_chunk(self) -> Optional[Tuple[int, bytes]]:
+        while self._next < len(self._jobs):
+            chunk = self._take()
+            if chunk:
+                return chunk
+        return None
+
+    @property
+    def sentences(self) -> int:
+        return len(self._jobs)
+
+    def _add(self, sentence: str):
+        text = speakable(sentence, self.names)
+        if not text:
+            return
+        self._pending += text
+        if len(self._pending) >= self.min_chars:
+            self._submit(self._pending)
+
+    def _submit(self, text: str):
+        self._pending = ""
+        self._jobs.append((text, self.executor.submit(self.synthesize, text)))
+
+    def _take(self) -> Optional[Tuple[int, bytes]]:
+        """取出下一句的合成结果；合成失败的句子跳过"""
+        index = self._next
+        text, future = self._jobs[index]
+        self._next += 1
+        try:
+            data = future.result()
+        except Exception as e:
+            print(f"[TTSPipeline] 第 {index + 1} 句合成异常: {e}")
+            data = None
+        if not data:
+            print(f"[TTSPipeline] 第 {index + 1} 句合成失败，跳过: {text[:20]}")
+            return None
+        now = time.time()
+        if self.first_audio_at is None:
+            self.first_audio_at = now
+        self.last_audio_at = now
+        self.chunks.append(data)
+        return index, data
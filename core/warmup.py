@@ -0,0 +1,72 @@
+"""
+后台预热
+在后台线程中执行一次性的加载函数（如本地 LLM），调用方可查询状态或限时等待
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from core.metrics import metrics
+
+COLD = "cold"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class BackgroundWarmup:
+    """状态：cold（未加载）→ loading → ready / failed；failed 在 retry_after 秒后允许重新加载"""
+
+    def __init__(self, name: str, load_fn: Callable[[], None], retry_after: float = 60.0):
+        self.name = name
+        self.load_fn = load_fn
+        self.retry_after = retry_after
+        self.state = COLD
+        self.error: Optional[Exception] = None
+        self._failed_at = 0.0
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, reason: str = "") -> bool:
+        """开始后台加载（已在加载或已就绪时忽略），返回是否新启动了加载"""
+        with self._lock:
+            if self.state in (LOADING, READY):
+                return False
+            if self.state == FAILED and time.monotonic() - self._failed_at < self.retry_after:
+                return False
+            self._set_state(LOADING)
+            self._done = threading.Event()
+        print(f"[Warmup] 后台加载 {self.name}" + (f"（{reason}）" if reason else ""))
+        threading.Thread(target=self._run, daemon=True, name=f"warmup-{self.name}").start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """确保已开始加载并最多等待 timeout 秒（None 为一直等待），返回是否就绪"""
+        self.start()
+        if self.state == LOADING:
+            self._done.wait(timeout)
+        return self.state == READY
+
+    def _run(self):
+        start = time.time()
+        try:
+            self.load_fn()
+        except Exception as e:
+            with self._lock:
+                self.error = e
+                self._failed_at = time.monotonic()
+                self._set_state(FAILED)
+            print(f"[Warmup] {self.name} 加载失败: {e}")
+        else:
+            elapsed = time.time() - start
+            metrics.observe(f"warmup.{self.name}.load_time", elapsed)
+            with self._lock:
+                self.error = None
+                self._set_state(READY)
+            print(f"[Warmup] ✓ {self.name} 就绪 ({elapsed:.1f}s)")
+        finally:
+            self._done.set()
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.incr(f"warmup.{self.name}.{state}")
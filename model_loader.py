@@ -1,5 +1,101 @@
+from contextlib import contextmanager
 from pathlib import Path
-from config.models import MODELS_CONFIG
+from typing import AsyncGenerator, Generator, List, Optional
+from config.models import (MODELS_CONFIG, LLM_HTTP_POOL, LLM_PROBE, LLM_RATE_LIMIT, LLM_HEDGE, LLM_CIRCUIT_BREAKER,
+                           LLM_MODEL_TIERS, LLM_MODEL_PROFILES, LLM_TASK_ROUTES, LOCAL_PREFIX_CACHE,
+                           LOCAL_BATCHING, LOCAL_WARMUP, LOCAL_MODELS, LLM_JSON_OUTPUT, PROMPT_BUDGET)
+from core.circuit_breaker import OPEN, ModelRouter, NoHealthyModelError
+from core.local_batching import LocalBatchScheduler
+from core.local_models import LocalModelManager, available_memory_bytes
+from core.model_profiles import ModelProfiles, reasoning_text
+from core.prefix_cache import PrefixCache
+from core.prompt_budget import Prompt, as_messages, estimate_tokens
+from core.speculative import SpeculativeStats, vocab_mismatches
+from core.stop_sequences import MAX_API_STOP_SEQUENCES, CancelCriteria, StopSequenceCriteria, StopSequenceFilter, truncate_at_stop
+from core.structured_output import JsonSchema, is_response_format_rejected, parse_structured
+from core.warmup import READY, BackgroundWarmup
+from core.metrics import metrics
+from core.rate_limiter import Priority, PriorityRateLimiter, is_rate_limited, retry_after_seconds
+
+# 进程内共享的异步 HTTP 连接池，见 get_shared_async_http_client()
+_shared_async_http_client = None
+
+def get_shared_async_http_client():
+    """获取（懒创建）进程共享的 httpx.AsyncClient：keep-alive + HTTP/2 + 连接数上限"""
+    global _shared_async_http_client
+    if _shared_async_http_client is None:
+        import importlib.util
+        import httpx
+        
+        http2 = LLM_HTTP_POOL["http2"]
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("[LLMLoader] 未安装 h2，HTTP/2 不可用，回退到 HTTP/1.1 (pip install 'httpx[http2]')")
+            http2 = False
+        
+        _shared_async_http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_POOL["max_connections"],
+                max_keepalive_connections=LLM_HTTP_POOL["max_keepalive_connections"],
+                keepalive_expiry=LLM_HTTP_POOL["keepalive_expiry"],
+            ),
+            timeout=httpx.Timeout(
+                LLM_HTTP_POOL["read_timeout"],
+                connect=LLM_HTTP_POOL["connect_timeout"],
+            ),
+        )
+        print(f"[LLMLoader] ✓ 共享连接池就绪 (http2={http2}, max_connections={LLM_HTTP_POOL['max_connections']})")
+    return _shared_async_http_client
+
+LOCAL_QUANT_MODES = ("none", "bf16", "int8")
+
+def load_local_causal_lm(model_id: str, cache_dir: Optional[str] = None, quantization: str = "none",
+                         compile_model: bool = False, mmap_weights: bool = False):
+    """在 CPU 上加载 CausalLM，返回 (model, tokenizer)
+
+    quantization: none = fp32 原始精度；bf16 = 半精度权重（内存减半）；int8 = Linear 层动态量化（权重 int8，激活按需量化）
+    compile_model: 用 torch.compile 编译 forward，首次生成较慢，之后单 token 延迟更低
+    mmap_weights: 本地已有 safetensors 时内存映射加载（见 core.mmap_loader），bf16 下为零拷贝；失败时回退 from_pretrained
+    """
+    import torch
+    from modelscope import AutoModelForCausalLM, AutoTokenizer
+    
+    if quantization not in LOCAL_QUANT_MODES:
+        raise ValueError(f"未知的量化模式: {quantization}（可选 {', '.join(LOCAL_QUANT_MODES)}）")
+    
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_id,
+        cache_dir=cache_dir,
+        trust_remote_code=True
+    )
+    
+    torch_dtype = torch.bfloat16 if quantization == "bf16" else torch.float32
+    model = None
+    if mmap_weights:
+        from core.local_models import local_model_dir
+        from core.mmap_loader import load_mmap_causal_lm
+        
+        model_dir = Path(model_id) if Path(model_id).is_dir() else local_model_dir({"model_id": model_id, "cache_dir": cache_dir or "."})
+        try:
+            model = load_mmap_causal_lm(model_dir, torch_dtype)
+        except Exception as e:
+            print(f"[LLMLoader] {model_id} 内存映射加载失败，改用 from_pretrained: {e}")
+    if model is None:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            cache_dir=cache_dir,
+            device_map="cpu",
+            trust_remote_code=True,
+            low_cpu_mem_usage=True,
+            torch_dtype=torch_dtype
+        )
+        model.eval()
+    
+    if quantization == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if compile_model:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model, tokenizer
 
 class LLMLoader:
     # 魔搭 API-Inference 配置
@@ -11,14 +107,43 @@ class LLMLoader:
         "Qwen/Qwen3-32B",
         "Qwen/Qwen2.5-7B-Instruct",
     ]
+    # 进程级限流器：同一 API Key 的所有 LLMLoader 实例共享
+    RATE_LIMITER = PriorityRateLimiter(
+        rate=LLM_RATE_LIMIT["rate"],
+        burst=LLM_RATE_LIMIT["burst"],
+        aging_seconds=LLM_RATE_LIMIT["aging_seconds"]
+    )
     
     def __init__(self):
         self.client = None
         self.model_name = None
         self.use_api = False
-        # 本地模型 fallback
+        self.healthy_models = []
+        # 每个模型一个熔断器，调用时按健康分选择当前最优模型
+        self.router = ModelRouter(self.MODELS_TO_TRY, LLM_CIRCUIT_BREAKER, on_state_change=self._on_model_state_change)
+        # 每个 API 模型的请求配置：关闭思考、不支持的参数、JSON 输出模式
+        self.profiles = ModelProfiles(LLM_MODEL_PROFILES["profiles"])
+        self._reasoning_warned = set()
+        # 本地模型 fallback：API 健康度下降时在后台预热，不在玩家回合内同步加载
+        # local_model / local_tokenizer 为回复档位的主模型；其他档位的模型由 local_models 按内存预算常驻或卸载
+        self.local_models: Optional[LocalModelManager] = None
+        self.local_primary = None
         self.local_model = None
         self.local_tokenizer = None
+        self.draft_model = None         # 投机解码草稿模型（MODELS_CONFIG["llm"]["draft"]）
+        self.local_warmup = BackgroundWarmup("local-llm", self._load_local_model, retry_after=LOCAL_WARMUP["retry_after"])
+        # 本地模型按 session 复用上一轮 prompt 的 KV cache
+        self.prefix_cache = PrefixCache(
+            max_bytes=LOCAL_PREFIX_CACHE["max_mb"] * 1024 * 1024,
+            min_prefix_tokens=LOCAL_PREFIX_CACHE["min_prefix_tokens"]
+        )
+        self.local_batcher = None
+        # 结构化输出：拒绝 response_format 的 API 模型；本地约束解码用的词表数据（首次使用时构建）
+        self._json_mode_unsupported = set()
+        self._json_tokenizer_data = {}
+        self._json_enforcer_missing = False
+        # prompt token 计数用的分词器（API 模型的近似），None 表示尚未加载，False 表示不可用
+        self._prompt_tokenizer = None
         
     def load(self):
         """加载 LLM，优先使用魔搭 API"""
@@ -27,32 +152,146 @@ class LLMLoader:
         
         from openai import OpenAI
         
+        # 关闭 SDK 内置重试，429 统一交给 RATE_LIMITER 按优先级处理
         self.client = OpenAI(
             base_url=self.API_BASE_URL,
-            api_key=self.API_KEY
+            api_key=self.API_KEY,
+            max_retries=0
         )
         
-        # 依次尝试模型
-        for model in self.MODELS_TO_TRY:
-            print(f"[LLMLoader] 测试模型: {model}")
-            if self._test_model(model):
-                self.model_name = model
-                self.use_api = True
-                print(f"[LLMLoader] ✓ 使用魔搭 API: {model}")
-                return
+        # 断网快速路径：连不上 API 主机就不必逐个等待模型探测超时
+        if not self._network_available():
+            print("[LLMLoader] 无法连接魔搭 API 主机（可能离线），直接使用本地模型...")
+            self._load_local_model_blocking()
+            return
+        
+        model = self._select_model()
+        if model:
+            self.model_name = model
+            self.use_api = True
+            print(f"[LLMLoader] ✓ 使用魔搭 API: {model}")
+            # 预先加载 prompt 计数用的分词器（读盘），避免首回合在异步路径的事件循环里加载
+            self._get_prompt_tokenizer()
+            return
         
         # API 全部失败，回退到本地模型
         print("[LLMLoader] API 模型均不可用，回退到本地模型...")
-        self._load_local_model()
+        self._load_local_model_blocking()
+    
+    def _network_available(self) -> bool:
+        """TCP 连接 API 主机，检测网络是否可达（DNS 失败或超时均视为离线）"""
+        import socket
+        from urllib.parse import urlparse
+        
+        url = urlparse(self.API_BASE_URL)
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            with socket.create_connection((url.hostname, port), timeout=LLM_PROBE["network_check_timeout"]):
+                return True
+        except OSError as e:
+            print(f"[LLMLoader] 网络检测失败: {e}")
+            return False
+    
+    def _select_model(self):
+        """并发探测 MODELS_TO_TRY，按优先级返回第一个可用模型（均不可用时返回 None）"""
+        import time
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        cache = self._load_probe_cache()
+        now = time.time()
+        results = {}
+        for model in self.MODELS_TO_TRY:
+            entry = cache.get(model)
+            if not entry:
+                continue
+            ttl = LLM_PROBE["ttl_ok"] if entry["ok"] else LLM_PROBE["ttl_fail"]
+            if now - entry["checked_at"] < ttl:
+                results[model] = entry["ok"]
+                print(f"[LLMLoader] 探测缓存命中: {model} -> {'可用' if entry['ok'] else '不可用'}")
+        
+        pending = [m for m in self.MODELS_TO_TRY if m not in results]
+        futures = {}
+        executor = None
+        if pending:
+            print(f"[LLMLoader] 并发探测 {len(pending)} 个模型: {', '.join(pending)}")
+            lock = threading.Lock()
+            
+            def probe(model):
+                start = time.time()
+                ok = self._test_model(model)
+                with lock:
+                    cache[model] = {"ok": ok, "checked_at": time.time(), "latency": round(time.time() - start, 2)}
+                    self._save_probe_cache(cache)
+                return ok
+            
+            executor = ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="llm-probe")
+            futures = {m: executor.submit(probe, m) for m in pending}
+        
+        chosen = None
+        try:
+            # 按优先级等待：高优先级模型的结果出来前不会选择低优先级模型
+            for model in self.MODELS_TO_TRY:
+                ok = results[model] if model in results else futures[model].result()
+                if ok:
+                    chosen = model
+                    break
+        finally:
+            if executor:
+                # 低优先级模型仍在后台探测，结果会写入缓存，这里不再等待
+                executor.shutdown(wait=False)
+        
+        self.healthy_models = [m for m in self.MODELS_TO_TRY
+                               if results.get(m) or (m in futures and futures[m].done() and futures[m].result())]
+        # 探测失败的模型先熔断，冷却到期后由 half-open 请求复查，不会永久下架
+        for model in self.MODELS_TO_TRY:
+            failed = results.get(model) is False or (
+                model in futures and futures[model].done() and not futures[model].result()
+            )
+            if failed:
+                self.router.mark_unhealthy(model)
+        return chosen
+    
+    def _load_probe_cache(self) -> dict:
+        """读取探测缓存，API 地址变化或文件损坏时视为空"""
+        import json
+        
+        path = Path(LLM_PROBE["cache_path"])
+        if not path.exists():
+            return {}
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"[LLMLoader] 探测缓存读取失败，忽略: {e}")
+            return {}
+        if data.get("base_url") != self.API_BASE_URL:
+            return {}
+        return data.get("models", {})
+    
+    def _save_probe_cache(self, cache: dict):
+        import json
+        
+        path = Path(LLM_PROBE["cache_path"])
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(
+                json.dumps({"base_url": self.API_BASE_URL, "models": cache}, ensure_ascii=False, indent=2),
+                encoding="utf-8"
+            )
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"[LLMLoader] 探测缓存写入失败: {e}")
     
     def _test_model(self, model: str) -> bool:
         """测试模型是否可用"""
         try:
+            self.RATE_LIMITER.acquire(Priority.TURN)
             response = self.client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": "你好"}],
-                max_tokens=10,
-                timeout=10
+                timeout=LLM_PROBE["timeout"],
+                **self.profiles.get(model).apply({"max_tokens": 10}, thinking=LLM_MODEL_PROFILES["thinking"])
             )
             content = response.choices[0].message.content
             return content is not None and content.strip() != ""
@@ -61,128 +300,1278 @@ class LLMLoader:
             return False
     
     def _load_local_model(self):
-        """加载本地模型"""
-        print("[LLMLoader] 加载本地 Qwen2.5-3B 模型...")
-        from modelscope import AutoModelForCausalLM, AutoTokenizer
-        
+        """加载本地模型：按内存预算为各档位选定 checkpoint，回复档位的主模型固定常驻（加载失败时依次换更小的候选）"""
         config = MODELS_CONFIG["llm"]
+        if config["backend"] == "onnx":
+            print("[LLMLoader] 加载本地模型 (backend=onnx)...")
+        else:
+            print(f"[LLMLoader] 加载本地模型 (quantization={config['quantization']}, compile={config['compile']})...")
         
-        self.local_tokenizer = AutoTokenizer.from_pretrained(
-            config["model_id"],
-            cache_dir=config["cache_dir"],
-            trust_remote_code=True
-        )
-        
-        self.local_model = AutoModelForCausalLM.from_pretrained(
-            config["model_id"],
-            cache_dir=config["cache_dir"],
-            device_map="cpu",
-            trust_remote_code=True,
-            low_cpu_mem_usage=True
+        self.local_models = self._build_local_models(config)
+        error = None
+        for name in self.local_models.fallbacks(self._task_route("reply")["tier"]):
+            try:
+                self.local_primary = self.local_models.acquire(name, pin=True)
+                break
+            except Exception as e:
+                error = e
+                print(f"[LLMLoader] 本地模型 {name} 加载失败: {e}")
+        else:
+            raise error or RuntimeError("没有可用的本地模型")
+        self.local_models.release(self.local_primary)
+        self.local_model, self.local_tokenizer = self.local_primary.model, self.local_primary.tokenizer
+        print(f"[LLMLoader] ✓ 本地模型加载成功 ({self.local_primary.name})")
+        if config["draft"]["enabled"] and config["backend"] == "onnx":
+            print("[LLMLoader] ONNX 后端不支持投机解码，忽略草稿模型")
+        elif config["draft"]["enabled"]:
+            self._load_draft_model(config)
+    
+    def _build_local_models(self, config: dict) -> LocalModelManager:
+        """按 LOCAL_MODELS 创建常驻管理器，并按内存预算为各档位选定模型"""
+        specs, tiers = LOCAL_MODELS["specs"], LOCAL_MODELS["tiers"]
+        if not LOCAL_MODELS["multi"]:
+            default = next(name for name, spec in specs.items() if spec["model_id"] == config["model_id"])
+            specs, tiers = {default: specs[default]}, {tier: [default] for tier in tiers}
+        budget = LOCAL_MODELS["ram_budget_mb"] * 1024 * 1024
+        if budget <= 0:
+            budget = int(available_memory_bytes() * LOCAL_MODELS["auto_ratio"])
+        manager = LocalModelManager(specs, tiers, budget, config["quantization"], self._load_local_checkpoint)
+        if budget <= 0:
+            # 无法获取可用内存：只放得下各档位的最小候选
+            manager.budget_bytes = sum(min(manager.estimate(c) for c in names) for names in tiers.values())
+        manager.plan()
+        return manager
+    
+    def _load_local_checkpoint(self, spec: dict):
+        config = MODELS_CONFIG["llm"]
+        if config["backend"] == "onnx":
+            from core.onnx_backend import load_onnx_causal_lm
+            return load_onnx_causal_lm(
+                spec["model_id"],
+                cache_dir=spec["cache_dir"],
+                export_dir=config["onnx"]["export_dir"],
+                intra_op_threads=config["onnx"]["intra_op_threads"]
+            )
+        return load_local_causal_lm(
+            spec["model_id"],
+            cache_dir=spec["cache_dir"],
+            quantization=config["quantization"],
+            compile_model=config["compile"],
+            mmap_weights=config["mmap"]
         )
-        self.use_api = False
-        print("[LLMLoader] ✓ 本地模型加载成功")
     
-    def get_model_name(self) -> str:
-        """获取当前使用的模型名称"""
+    @contextmanager
+    def _local_for_task(self, task: str):
+        """该调用类型本地生成所用的常驻模型：所在档位选定的模型（用到时加载，可能被 LRU 卸载），加载失败时用主模型"""
+        primary = self.local_primary
+        for name in self.local_models.fallbacks(self._task_route(task)["tier"]):
+            if name == primary.name:
+                break
+            try:
+                resident = self.local_models.acquire(name)
+            except Exception as e:
+                print(f"[LLMLoader] 本地模型 {name} 加载失败，改用 {primary.name}: {e}")
+                continue
+            try:
+                yield resident
+            finally:
+                self.local_models.release(resident)
+            return
+        yield primary
+    
+    def _load_draft_model(self, config: dict):
+        """加载投机解码草稿模型（经由 local_models，计入内存预算并与同名档位模型共用），
+        失败或词表与主模型不兼容时只打印警告，本地生成照常进行"""
+        draft = config["draft"]
+        specs = self.local_models.specs
+        name = next((n for n, spec in specs.items() if spec["model_id"] == draft["model_id"]), None)
+        if name is None:
+            name = draft["model_id"].split("/")[-1]
+            specs[name] = {"model_id": draft["model_id"], "cache_dir": draft["cache_dir"], "params_b": draft["params_b"]}
+        if name == self.local_primary.name:
+            print(f"[LLMLoader] 警告: 草稿模型与主模型同为 {name}，不启用投机解码")
+            return
+        if not self.local_models.can_fit(name):
+            print(f"[LLMLoader] 警告: 内存预算放不下草稿模型 {name}（约 {self.local_models.estimate(name) / 2**30:.1f}GB），"
+                  f"不启用投机解码")
+            return
+        print(f"[LLMLoader] 加载投机解码草稿模型 {draft['model_id']}...")
+        try:
+            resident = self.local_models.acquire(name)
+        except Exception as e:
+            print(f"[LLMLoader] 警告: 草稿模型加载失败，不启用投机解码: {e}")
+            return
+        try:
+            mismatches = vocab_mismatches(self.local_tokenizer, resident.tokenizer)
+            if mismatches:
+                print(f"[LLMLoader] 警告: 草稿模型 {name} 与主模型 {self.local_primary.name} 的词表不兼容"
+                      f"（{mismatches} 个 token 编号不同），不启用投机解码")
+                return
+            # 草稿模型与主模型一样固定常驻
+            self.local_models.release(self.local_models.acquire(name, pin=True))
+        finally:
+            self.local_models.release(resident)
+        draft_model = resident.model
+        draft_model.generation_config.num_assistant_tokens = draft["num_assistant_tokens"]
+        draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+        self.draft_model = draft_model
+        print(f"[LLMLoader] ✓ 投机解码已启用（草稿模型 {name}）")
+    
+    def _load_local_model_blocking(self):
+        """启动阶段同步加载本地模型（经由 local_warmup，保证只加载一次），失败时抛出原异常"""
+        if not self.local_warmup.wait():
+            raise self.local_warmup.error
+    
+    def _on_model_state_change(self, model: str, old: str, new: str):
+        """熔断的 API 模型占比达到阈值即视为健康度下降，提前在后台预热本地模型"""
+        if not self.use_api or not LOCAL_WARMUP["enabled"] or new != OPEN:
+            return
+        if self.router.open_ratio() >= LOCAL_WARMUP["open_ratio"]:
+            self.local_warmup.start(reason=f"{model} 熔断，API 健康度下降")
+    
+    def _local_model_ready(self) -> bool:
+        """本地 fallback 是否可用：未加载时开始后台加载，并最多排队等待 queue_timeout 秒"""
+        if self.local_warmup.wait(LOCAL_WARMUP["queue_timeout"]):
+            return True
+        metrics.incr("llm.local.degraded")
+        print(f"[LLMLoader] 本地模型尚未就绪 ({self.local_warmup.state})，本次返回降级回复")
+        return False
+    
+    def get_local_model_state(self) -> str:
+        """本地模型状态：cold / loading / ready / failed"""
+        return self.local_warmup.state
+    
+    def get_model_name(self, task: str = "reply") -> str:
+        """获取该调用类型当前会使用的模型名称（API 模型全部熔断时为本地模型）"""
         if self.use_api:
-            return self.model_name.split('/')[-1] if self.model_name else "API"
-        else:
-            return "Qwen2.5-3B (local)"
+            model = self.router.best(models=self._task_models(task)) or self.router.best()
+            if model:
+                return model.split('/')[-1]
+        state = self.local_warmup.state
+        name = "Qwen2.5-3B"
+        if self.local_models is not None:
+            name = self.local_models.selection.get(self._task_route(task)["tier"], name)
+        return f"{name} (local)" if state == READY else f"{name} (local, {state})"
+    
+    def count_tokens(self, text: str) -> int:
+        """按当前模型的分词器计数：本地模型已加载时用其分词器，否则用 PROMPT_BUDGET["tokenizer_path"] 的 Qwen 分词器近似"""
+        tokenizer = self.local_tokenizer or self._get_prompt_tokenizer()
+        if not tokenizer:
+            return estimate_tokens(text)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    
+    def _get_prompt_tokenizer(self):
+        if self._prompt_tokenizer is None:
+            path = PROMPT_BUDGET["tokenizer_path"]
+            try:
+                from transformers import AutoTokenizer
+                self._prompt_tokenizer = AutoTokenizer.from_pretrained(path)
+                print(f"[LLMLoader] prompt token 计数使用分词器: {path}")
+            except Exception as e:
+                self._prompt_tokenizer = False
+                print(f"[LLMLoader] 无法加载分词器 {path}，prompt token 数按字符估算: {e}")
+        return self._prompt_tokenizer
     
-    def generate(self, text: str, max_new_tokens: int = 2000, temperature: float = 0.7) -> str:
-        """生成回复"""
+    def generate(self, text: Prompt, max_new_tokens: int = 2000, temperature: float = 0.7, priority: Optional[Priority] = None,
+                 hedge: Optional[bool] = None, task: str = "reply",
+                 session_id: Optional[str] = None, stop: Optional[List[str]] = None) -> str:
+        """生成回复
+
+        task 决定模型档位和限流优先级（见 LLM_TASK_ROUTES）；hedge=True（或 LLM_HEDGE=1）时启用对冲请求；
+        传入 session_id 时本地模型会复用该 session 上一轮的 KV 前缀缓存；
+        stop 为停止序列（API 最多取前 4 个），输出不含停止序列本身。
+        """
+        priority = self._task_priority(task) if priority is None else priority
         if self.use_api:
             try:
-                return self._generate_api(text, max_new_tokens, temperature)
+                if self._hedge_enabled(hedge):
+                    return "".join(self._generate_api_hedged(text, max_new_tokens, temperature, priority, task, stream=False, stop=stop))
+                return self._generate_api(text, max_new_tokens, temperature, priority, task, stop=stop)
             except Exception as e:
                 print(f"[LLMLoader] API调用失败: {e}")
-                print("[LLMLoader] 自动切换到本地模型...")
-                if not self.local_model:
-                    self._load_local_model()
-                self.use_api = False
-                return self._generate_local(text, max_new_tokens, temperature)
-        else:
-            return self._generate_local(text, max_new_tokens, temperature)
+                print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+        if not self._local_model_ready():
+            # 降级：返回空内容，由调用方的兜底文案处理
+            return ""
+        return self._generate_local(text, max_new_tokens, temperature, session_id, task, stop=stop)
     
-    def _generate_api(self, text: str, max_new_tokens: int, temperature: float) -> str:
-        """使用魔搭 API 生成，带重试和模型轮换"""
+    def generate_stream(self, text: Prompt, max_new_tokens: int = 2000, temperature: float = 0.7, priority: Optional[Priority] = None,
+                        hedge: Optional[bool] = None, task: str = "reply",
+                        session_id: Optional[str] = None, stop: Optional[List[str]] = None) -> Generator[str, None, None]:
+        """流式生成回复，逐段 yield 文本增量"""
+        priority = self._task_priority(task) if priority is None else priority
+        if self.use_api:
+            emitted = False
+            try:
+                if self._hedge_enabled(hedge):
+                    api_stream = self._generate_api_hedged(text, max_new_tokens, temperature, priority, task, stream=True, stop=stop)
+                else:
+                    api_stream = self._generate_api_stream(text, max_new_tokens, temperature, priority, task, stop=stop)
+                for delta in api_stream:
+                    emitted = True
+                    yield delta
+                return
+            except Exception as e:
+                print(f"[LLMLoader] API流式调用失败: {e}")
+                if emitted:
+                    # 已经输出了部分内容，不再切换模型重来，避免前端出现重复文本
+                    return
+                print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+        if not self._local_model_ready():
+            return
+        yield from self._generate_local_stream(text, max_new_tokens, temperature, session_id, task, stop)
+    
+    def generate_json(self, text: Prompt, schema: JsonSchema, task: str, temperature: float = 0.7,
+                      session_id: Optional[str] = None) -> Optional[dict]:
+        """结构化生成：按 schema 约束输出（API 用 response_format，本地用约束解码），max_tokens 取 schema.max_tokens
+
+        解析或校验失败时最多重试 LLM_JSON_OUTPUT["retries"] 次，仍失败返回 None，由调用方使用默认值。
+        """
+        priority = self._task_priority(task)
+        for attempt in range(LLM_JSON_OUTPUT["retries"] + 1):
+            raw = None
+            if self.use_api:
+                try:
+                    raw = self._generate_api(text, schema.max_tokens, temperature, priority, task, json_schema=schema)
+                except Exception as e:
+                    print(f"[LLMLoader] API调用失败: {e}")
+                    print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+            if raw is None:
+                # API 不可用时回退本地模型；本地也未就绪时为降级（空输出），不再重试
+                raw = self._generate_local(text, schema.max_tokens, temperature, session_id, task,
+                                           json_schema=schema) if self._local_model_ready() else ""
+            result = self._parse_json_output(raw, schema)
+            if result is not None or not raw:
+                break
+        if result is None:
+            metrics.incr(f"llm.json.{schema.name}.fallback")
+        return result
+    
+    def _parse_json_output(self, raw: str, schema: JsonSchema) -> Optional[dict]:
+        """解析一次结构化调用的输出；失败（含空输出）计为一次浪费的调用"""
+        metrics.incr(f"llm.json.{schema.name}.calls")
+        try:
+            return parse_structured(raw, schema)
+        except ValueError as e:
+            metrics.incr(f"llm.json.{schema.name}.parse_fail")
+            print(f"[LLMLoader] {schema.name} 结构化输出解析失败: {e} | 原文: {raw[:100]!r}")
+            return None
+    
+    def _json_response_kwargs(self, model: str, json_schema: Optional[JsonSchema]) -> dict:
+        """该模型本次请求的 response_format 参数（未要求结构化输出或模型已知不支持时为空）"""
+        if json_schema is None or model in self._json_mode_unsupported:
+            return {}
+        response_format = json_schema.response_format(self.profiles.get(model).json_mode_for(LLM_JSON_OUTPUT["mode"]))
+        return {"response_format": response_format} if response_format else {}
+    
+    def _json_mode_rejected(self, model: str, error: Exception) -> bool:
+        """服务端因 response_format 返回 400 时视为模型不支持：记住该模型，之后只靠提示词约束，不计入熔断；
+        其他错误（包括与 response_format 无关的 400）照常重试并计入熔断"""
+        if not is_response_format_rejected(error):
+            return False
+        self._json_mode_unsupported.add(model)
+        self.router.release(model)
+        metrics.incr("llm.json.response_format_rejected")
+        print(f"[LLMLoader] {model} 不支持 response_format={LLM_JSON_OUTPUT['mode']}，改为仅靠提示词约束: {error}")
+        return True
+    
+    def _request_kwargs(self, model: str, max_new_tokens: int, temperature: float,
+                        stop: Optional[List[str]] = None, json_kwargs: Optional[dict] = None,
+                        stream: bool = False) -> dict:
+        """按模型 profile 组装 create() 的生成参数：混合推理模型关闭思考，去掉该模型不支持的参数；
+        stream=True 时请求在最后一个分块返回 usage（用于统计提示缓存命中）"""
+        kwargs = {
+            "max_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            **(json_kwargs or {}),
+            **self._stop_kwargs(stop),
+        }
+        if stream:
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+        return self.profiles.get(model).apply(kwargs, thinking=LLM_MODEL_PROFILES["thinking"])
+    
+    def _record_usage(self, model: str, task: str, usage):
+        """记录服务端返回的 prompt token 数及其中命中提示缓存的部分（usage.prompt_tokens_details.cached_tokens）"""
+        if usage is None or not getattr(usage, "prompt_tokens", None):
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        metrics.incr(f"llm.prompt_cache.{task}.prompt_tokens", usage.prompt_tokens)
+        metrics.incr(f"llm.prompt_cache.{task}.cached_tokens", cached)
+        print(f"[LLMLoader] 提示缓存: {model} 命中 {cached}/{usage.prompt_tokens} tokens")
+    
+    def prompt_cache_report(self) -> str:
+        """各调用类型累计的提示缓存命中率，便于写日志"""
+        lines = []
+        for task in LLM_TASK_ROUTES:
+            prompt_tokens = metrics.count(f"llm.prompt_cache.{task}.prompt_tokens")
+            if prompt_tokens:
+                cached = metrics.count(f"llm.prompt_cache.{task}.cached_tokens")
+                lines.append(f"{task}: {cached:g}/{prompt_tokens:g} tokens ({cached / prompt_tokens:.0%})")
+        return "\n".join(lines)
+    
+    def _record_completion(self, model: str, task: str, usage, reasoning_chars: int):
+        """一次 API 调用结束后的用量记录（提示缓存命中、思考内容字数），普通、流式与对冲调用共用"""
+        self._record_usage(model, task, usage)
+        self._note_reasoning(model, reasoning_chars)
+    
+    def _note_reasoning(self, model: str, chars: int):
+        """记录模型返回的思考内容字数；关闭思考后仍有思考内容时提示一次，便于修正 LLM_MODEL_PROFILES"""
+        if not chars:
+            return
+        metrics.observe(f"llm.reasoning_chars.{model}", chars)
+        if model not in self._reasoning_warned and not LLM_MODEL_PROFILES["thinking"]:
+            self._reasoning_warned.add(model)
+            print(f"[LLMLoader] 警告: {model} 仍返回思考内容 ({chars}字)，请检查 LLM_MODEL_PROFILES 中的 thinking 配置")
+    
+    @staticmethod
+    def _stop_kwargs(stop: Optional[List[str]]) -> dict:
+        """API 的 stop 参数（OpenAI 兼容接口最多 4 个），没有停止序列时不传"""
+        return {"stop": list(stop)[:MAX_API_STOP_SEQUENCES]} if stop else {}
+    
+    def _generate_api(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                      task: str = "reply", json_schema: Optional[JsonSchema] = None,
+                      stop: Optional[List[str]] = None) -> str:
+        """使用魔搭 API 生成：每次尝试都由 router 选择当前最优模型，结果计入该模型的熔断器
+
+        传入 json_schema 时附带 response_format（见 LLM_JSON_OUTPUT），模型不支持时自动去掉。
+        """
         import time
         
-        # 如果当前模型多次失败，可能需要重新选择模型
-        # 这里简化处理：如果在3次重试中都失败，则在下一次调用时切换模型
-        
         for attempt in range(3):
+            model = self._acquire_model(task)
+            json_kwargs = self._json_response_kwargs(model, json_schema)
             try:
+                self.RATE_LIMITER.acquire(priority)
                 start = time.time()
                 response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[{"role": "user", "content": text}],
-                    max_tokens=max_new_tokens,
-                    temperature=temperature,
-                    top_p=0.9
+                    model=model,
+                    messages=as_messages(text),
+                    **self._request_kwargs(model, max_new_tokens, temperature, stop, json_kwargs)
                 )
-                elapsed = time.time() - start
-                
-                content = response.choices[0].message.content
-                finish_reason = response.choices[0].finish_reason
-                
-                print(f"[LLMLoader] API响应: {elapsed:.1f}s, finish_reason={finish_reason}")
+            except Exception as e:
+                if json_kwargs and self._json_mode_rejected(model, e):
+                    continue
+                self._record_api_error(model, e)
+                print(f"[LLMLoader] API调用异常 {model} (attempt {attempt+1}/3): {e}")
+                if attempt < 2:
+                    time.sleep(self._backoff_after_error(e, attempt))
+                    continue
+                raise
+            
+            elapsed = time.time() - start
+            metrics.observe(f"llm.latency.{model}", elapsed)
+            metrics.observe(f"llm.task.{task}", elapsed)
+            
+            message = response.choices[0].message
+            content = message.content
+            finish_reason = response.choices[0].finish_reason
+            reasoning_chars = len(reasoning_text(message))
+            print(f"[LLMLoader] API响应: {model} {elapsed:.1f}s, finish_reason={finish_reason}")
+            self._record_completion(model, task, getattr(response, "usage", None), reasoning_chars)
+            
+            if content is None or content.strip() == "":
+                # 空内容计为一次失败，持续为空的模型会被熔断，下一次尝试由 router 换模型
+                self.router.record_failure(model)
+                print(f"[LLMLoader] 警告: API返回空内容 (attempt {attempt+1}/3, 思考内容 {reasoning_chars}字, "
+                      f"finish_reason={finish_reason})")
+                if attempt < 2:
+                    continue
+                return ""
+            
+            self.router.record_success(model, elapsed)
+            self.model_name = model
+            result = content.strip()
+            print(f"[LLMLoader] API返回: {len(result)}字符")
+            return result
+        
+        return ""
+    
+    def _generate_api_stream(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                             task: str = "reply", stop: Optional[List[str]] = None) -> Generator[str, None, None]:
+        """使用魔搭 API 流式生成（stream=True），首个增量到达前失败会换当前最优模型重试"""
+        import time
+        
+        for attempt in range(3):
+            model = self._acquire_model(task)
+            first_token_at = None
+            total_chars = 0
+            reasoning_chars = 0
+            try:
+                self.RATE_LIMITER.acquire(priority)
+                start = time.time()
+                stream = self.client.chat.completions.create(
+                    model=model,
+                    messages=as_messages(text),
+                    **self._request_kwargs(model, max_new_tokens, temperature, stop, stream=True)
+                )
+                finish_reason = None
+                usage = None
+                for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    finish_reason = choice.finish_reason or finish_reason
+                    delta = choice.delta.content if choice.delta else None
+                    reasoning_chars += len(reasoning_text(choice.delta))
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        metrics.observe(f"llm.ttft.{model}", first_token_at - start)
+                        metrics.observe(f"llm.task.{task}.ttft", first_token_at - start)
+                        print(f"[LLMLoader] API首字延迟: {model} {first_token_at - start:.2f}s")
+                    total_chars += len(delta)
+                    yield delta
                 
-                if content is None or content.strip() == "":
-                    print(f"[LLMLoader] 警告: API返回空内容 (attempt {attempt+1}/3). Message: {response.choices[0].message}")
+                print(f"[LLMLoader] API流式响应: {time.time() - start:.1f}s, {total_chars}字符, finish_reason={finish_reason}")
+                self._record_completion(model, task, usage, reasoning_chars)
+                if total_chars == 0:
+                    self.router.record_failure(model)
                     if attempt < 2:
-                        # 尝试增加一点延时
-                        time.sleep(2)
+                        print(f"[LLMLoader] 警告: API流式返回空内容 (attempt {attempt+1}/3, 思考内容 {reasoning_chars}字)")
                         continue
-                    # 如果三次都空，尝试换个模型（如果还有的话）
-                    print(f"[LLMLoader] 模型 {self.model_name} 持续返回空内容，尝试下架它...")
-                    if self.model_name in self.MODELS_TO_TRY:
-                        self.MODELS_TO_TRY.remove(self.model_name)
-                    if self.MODELS_TO_TRY:
-                        self.model_name = self.MODELS_TO_TRY[0]
-                        print(f"[LLMLoader] 切换到新模型: {self.model_name}")
-                        # 递归尝试一次新模型
-                        return self._generate_api(text, max_new_tokens, temperature)
-                    return ""
-                
-                result = content.strip()
-                print(f"[LLMLoader] API返回: {len(result)}字符")
-                return result
+                    return
+                self.router.record_success(model, first_token_at - start)
+                metrics.observe(f"llm.task.{task}", time.time() - start)
+                self.model_name = model
+                return
                 
+            except GeneratorExit:
+                # 调用方提前停止读取，不计入模型健康；关闭响应流以释放连接并让上游停止生成
+                self.router.release(model)
+                stream.close()
+                raise
             except Exception as e:
-                print(f"[LLMLoader] API调用异常 (attempt {attempt+1}/3): {e}")
+                self._record_api_error(model, e)
+                if first_token_at is not None:
+                    raise
+                print(f"[LLMLoader] API流式调用异常 {model} (attempt {attempt+1}/3): {e}")
                 if attempt < 2:
-                    time.sleep(1)
+                    time.sleep(self._backoff_after_error(e, attempt))
                     continue
                 raise
+    
+    def _task_route(self, task: str) -> dict:
+        if task not in LLM_TASK_ROUTES:
+            raise ValueError(f"未知的 LLM 调用类型: {task}")
+        return LLM_TASK_ROUTES[task]
+    
+    def _task_priority(self, task: str) -> Priority:
+        return Priority[self._task_route(task)["priority"]]
+    
+    def _task_models(self, task: str) -> list:
+        """该调用类型所在档位的模型列表（档位未配置时为全部模型）"""
+        return LLM_MODEL_TIERS.get(self._task_route(task)["tier"], self.MODELS_TO_TRY)
+    
+    def _acquire_model(self, task: str = "reply") -> str:
+        """向 router 申请该调用类型档位内的最优模型；档位内全部熔断时跨档位选择，全部熔断时抛出 NoHealthyModelError"""
+        model = self.router.acquire(models=self._task_models(task)) or self.router.acquire()
+        if model is None:
+            raise NoHealthyModelError("所有 API 模型均处于熔断状态")
+        return model
+    
+    def _record_api_error(self, model: str, error: Exception):
+        """429 是 API Key 级别的限流，不算模型故障；其他异常计入该模型的熔断器"""
+        if is_rate_limited(error):
+            self.router.release(model)
+        else:
+            self.router.record_failure(model)
+    
+    def _hedge_enabled(self, hedge: Optional[bool]) -> bool:
+        return LLM_HEDGE["enabled"] if hedge is None else hedge
+    
+    def _hedge_backup_model(self, primary: str, task: str) -> Optional[str]:
+        """同档位内除 primary 外健康分最优的可用模型（只查看，不占用调用名额）"""
+        ranked = self.router.ranked(exclude={primary}, models=self._task_models(task))
+        return ranked[0] if ranked else None
+    
+    def _hedge_delay(self, model: str, stream: bool) -> float:
+        """对冲等待时间：该模型历史延迟（流式为首字延迟）的配置分位数，样本不足时用默认值"""
+        name = f"llm.ttft.{model}" if stream else f"llm.latency.{model}"
+        samples = metrics.snapshot()["samples"].get(name)
+        if not samples or samples["count"] < LLM_HEDGE["min_samples"]:
+            return LLM_HEDGE["default_delay"]
+        return max(LLM_HEDGE["min_delay"], metrics.percentile(name, LLM_HEDGE["percentile"]))
+    
+    def _record_hedge_result(self, primary: str, winner: str, fired: bool, elapsed: float, task: str, stream: bool):
+        metrics.observe(f"llm.task.{task}.ttft" if stream else f"llm.task.{task}", elapsed)
+        if fired:
+            metrics.incr("llm.hedge.fired")
+            if winner != primary:
+                metrics.incr("llm.hedge.won")
+        fired_count = metrics.count("llm.hedge.fired")
+        won_rate = metrics.count("llm.hedge.won") / fired_count if fired_count else 0.0
+        print(f"[LLMLoader] 对冲请求: primary={primary}, fired={fired}, winner={winner}, {elapsed:.1f}s "
+              f"(累计触发 {fired_count:g}/{metrics.count('llm.hedge.calls'):g} 次，对冲胜出率 {won_rate:.0%})")
+    
+    def _api_single_attempt(self, model: str, text: Prompt, max_new_tokens: int, temperature: float,
+                            priority: Priority, cancel, emit, stop: Optional[List[str]] = None, task: str = "reply") -> str:
+        """对冲用的单次流式请求：每个增量调用 emit(delta)，cancel 置位后关闭连接，返回完整文本"""
+        import time
         
-        return ""
+        self.RATE_LIMITER.acquire(priority)
+        if cancel.is_set():
+            self.router.release(model)
+            return ""
+        start = time.time()
+        first_token_at = None
+        parts = []
+        usage = None
+        reasoning_chars = 0
+        try:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=as_messages(text),
+                **self._request_kwargs(model, max_new_tokens, temperature, stop, stream=True)
+            )
+            try:
+                for chunk in stream:
+                    if cancel.is_set():
+                        # 输家：关闭底层 HTTP 连接，服务端随之停止生成；不计入模型健康
+                        self.router.release(model)
+                        return ""
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices or not chunk.choices[0].delta:
+                        continue
+                    reasoning_chars += len(reasoning_text(chunk.choices[0].delta))
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        metrics.observe(f"llm.ttft.{model}", first_token_at - start)
+                    parts.append(delta)
+                    emit(delta)
+            finally:
+                stream.close()
+        except Exception as e:
+            self._record_api_error(model, e)
+            raise
+        metrics.observe(f"llm.latency.{model}", time.time() - start)
+        self._record_completion(model, task, usage, reasoning_chars)
+        result = "".join(parts).strip()
+        if result:
+            self.router.record_success(model, first_token_at - start)
+        else:
+            self.router.record_failure(model)
+        return result
     
-    def _generate_local(self, text: str, max_new_tokens: int, temperature: float) -> str:
-        """使用本地模型生成"""
-        messages = [{"role": "user", "content": text}]
-        inputs = self.local_tokenizer.apply_chat_template(
-            messages,
+    def _generate_api_hedged(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                             task: str, stream: bool, stop: Optional[List[str]] = None) -> Generator[str, None, None]:
+        """对冲请求：主模型超过历史延迟分位数仍未响应时，向下一个可用模型发同样的 prompt，取先响应者并取消另一个
+        
+        stream=True 时以首个增量先到者为胜，之后持续输出胜者的增量；stream=False 时以先完整返回者为胜。
+        """
+        import queue
+        import threading
+        import time
+        
+        primary = self._acquire_model(task)
+        backup = self._hedge_backup_model(primary, task)
+        events = queue.Queue()
+        cancels = {}
+        
+        def launch(model):
+            cancels[model] = threading.Event()
+            
+            def run():
+                try:
+                    result = self._api_single_attempt(
+                        model, text, max_new_tokens, temperature, priority, cancels[model],
+                        lambda delta: events.put((model, "delta", delta)), stop, task
+                    )
+                    events.put((model, "done", result))
+                except Exception as e:
+                    events.put((model, "error", e))
+            
+            threading.Thread(target=run, daemon=True, name=f"llm-hedge-{model}").start()
+        
+        metrics.incr("llm.hedge.calls")
+        start = time.time()
+        launch(primary)
+        fire_at = start + self._hedge_delay(primary, stream) if backup else None
+        running = {primary}
+        first_deltas = {}
+        winner = None
+        result = ""
+        last_error = None
+        
+        try:
+            while winner is None and (running or fire_at is not None):
+                timeout = None if fire_at is None else max(0.0, fire_at - time.time())
+                try:
+                    model, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    waited, fire_at = fire_at - start, None
+                    backup = self.router.acquire(exclude={primary}, models=self._task_models(task))
+                    if backup is None:
+                        continue
+                    print(f"[LLMLoader] {primary} 超过 {waited:.1f}s 未响应，对冲请求 {backup}")
+                    launch(backup)
+                    running.add(backup)
+                    continue
+            
+                if kind == "delta":
+                    if stream:
+                        winner, result = model, payload
+                    first_deltas.setdefault(model, payload)
+                elif kind == "done":
+                    running.discard(model)
+                    if payload:
+                        winner, result = model, (first_deltas.get(model, payload) if stream else payload)
+                else:
+                    running.discard(model)
+                    last_error = payload
+                    print(f"[LLMLoader] 对冲请求 {model} 失败: {payload}")
+                    if fire_at is not None:
+                        # 主模型直接失败，立即启用备选模型
+                        fire_at = time.time()
+            
+            for model, cancel in cancels.items():
+                if model != winner:
+                    cancel.set()
+            
+            if winner is None:
+                if last_error:
+                    raise last_error
+                return
+            
+            self.model_name = winner
+            self._record_hedge_result(primary, winner, backup in cancels, time.time() - start, task, stream)
+            yield result
+            if not stream:
+                return
+            
+            # 流式：继续转发胜者的后续增量，忽略输家
+            while True:
+                model, kind, payload = events.get()
+                if model != winner:
+                    continue
+                if kind == "delta":
+                    yield payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    return
+        finally:
+            # 调用方提前关闭生成器（GeneratorExit）或出错时，所有仍在进行的请求一并取消
+            for cancel in cancels.values():
+                cancel.set()
+    
+    def _backoff_after_error(self, error: Exception, attempt: int) -> float:
+        """API 异常后的退避秒数：429 交给限流器（遵循 Retry-After，所有请求一起暂停），其余错误短暂指数退避"""
+        if is_rate_limited(error):
+            retry_after = retry_after_seconds(error)
+            if retry_after is None:
+                retry_after = LLM_RATE_LIMIT["default_retry_after"] * (attempt + 1)
+            self.RATE_LIMITER.penalize(retry_after)
+            return 0.0
+        return 0.5 * (2 ** attempt)
+    
+    def _build_local_inputs(self, text: Prompt, tokenizer):
+        """构造本地模型输入，返回 (input_ids, attention_mask)"""
+        inputs = tokenizer.apply_chat_template(
+            as_messages(text),
             tokenize=True,
             add_generation_prompt=True,
-            return_tensors="pt"
+            return_tensors="pt",
+            enable_thinking=False   # Qwen3 模板关闭思考，其他模板忽略该参数
+        )
+        
+        attention_mask = (inputs != tokenizer.pad_token_id).long()
+        return inputs, attention_mask
+    
+    def _take_prefix_cache(self, inputs, session_id: Optional[str], task: str, model_name: str):
+        """取出该 session 的 KV 前缀缓存，返回 (cache_key, past_key_values)；未启用、ONNX 后端或没有 session 时为 (None, None)"""
+        if not session_id or not LOCAL_PREFIX_CACHE["enabled"] or MODELS_CONFIG["llm"]["backend"] == "onnx":
+            return None, None
+        from transformers import DynamicCache
+        
+        key = f"{session_id}:{task}:{model_name}"
+        cache, reused = self.prefix_cache.take(key, inputs[0])
+        if cache is None:
+            return key, DynamicCache()
+        print(f"[LLMLoader] 本地前缀缓存命中: 复用 {reused}/{inputs.shape[1]} tokens")
+        return key, cache
+    
+    def release_session(self, session_id: str):
+        """session 结束时释放其本地 KV 前缀缓存"""
+        self.prefix_cache.drop(f"{session_id}:")
+    
+    def _get_local_batcher(self) -> LocalBatchScheduler:
+        if self.local_batcher is None:
+            self.local_batcher = LocalBatchScheduler(
+                self.local_model,
+                self.local_tokenizer,
+                run_single=lambda r, timeout: self._generate_local_stream_single(
+                    r.text, r.max_new_tokens, r.temperature, timeout=timeout, cancel=r.cancel, **r.kwargs
+                ),
+                max_batch_size=LOCAL_BATCHING["max_batch_size"],
+                window=LOCAL_BATCHING["window_ms"] / 1000,
+                request_timeout=LOCAL_BATCHING["request_timeout_s"]
+            )
+        return self.local_batcher
+    
+    def _generate_local_stream(self, text: Prompt, max_new_tokens: int, temperature: float,
+                               session_id: Optional[str] = None, task: str = "reply",
+                               stop: Optional[List[str]] = None) -> Generator[str, None, None]:
+        """本地模型流式生成；启用 LOCAL_BATCHING 时多个 session 的并发请求会合批推理（仅限主模型）"""
+        with self._local_for_task(task) as local:
+            if self._use_local_batcher(local):
+                yield from self._get_local_batcher().submit(
+                    text, max_new_tokens, temperature, session_id=session_id, task=task, stop=stop
+                )
+            else:
+                yield from self._generate_local_stream_single(text, max_new_tokens, temperature, session_id, task, stop, local)
+    
+    def _use_local_batcher(self, local) -> bool:
+        """合批推理只用于 transformers 后端的主模型（ONNX 图的 KV cache 由 ORTModel 内部管理，不支持逐步合批）"""
+        return LOCAL_BATCHING["enabled"] and local is self.local_primary and MODELS_CONFIG["llm"]["backend"] != "onnx"
+    
+    def _speculative(self, local):
+        """本地生成的投机解码参数与统计，返回 (generate 额外参数, SpeculativeStats 或 None)；草稿模型只配合主模型"""
+        if self.draft_model is None or local is not self.local_primary:
+            return {}, None
+        return {"assistant_model": self.draft_model}, SpeculativeStats(local.model, self.draft_model)
+    
+    def _local_stopping_criteria(self, stop: Optional[List[str]], prompt_length: int, tokenizer, cancel=None):
+        """停止序列与取消事件对应的 stopping_criteria，两者都没有时为 None"""
+        criteria = []
+        if stop:
+            criteria.append(StopSequenceCriteria(tokenizer, stop, prompt_length))
+        if cancel is not None:
+            criteria.append(CancelCriteria(cancel))
+        if not criteria:
+            return None
+        from transformers import StoppingCriteriaList
+        return StoppingCriteriaList(criteria)
+    
+    def _generate_local_stream_single(self, text: Prompt, max_new_tokens: int, temperature: float,
+                                      session_id: Optional[str] = None, task: str = "reply",
+                                      stop: Optional[List[str]] = None, local=None,
+                                      timeout: Optional[float] = None,
+                                      cancel=None) -> Generator[str, None, None]:
+        """使用本地模型单独流式生成（TextIteratorStreamer + 后台生成线程），命中停止序列即结束；
+        local 为 local_models 的常驻模型（默认主模型），主模型加载了草稿模型时走投机解码；
+        timeout 为生成时限（秒），到时 generate 自行结束，等待增量超时抛出 TimeoutError；
+        cancel 被设置或生成器被提前关闭时 generate 在下一步结束，关闭时等待生成线程退出"""
+        import queue
+        import time
+        from contextlib import nullcontext
+        from threading import Event, Thread
+        from transformers import TextIteratorStreamer
+        
+        local = local or self.local_primary
+        inputs, attention_mask = self._build_local_inputs(text, local.tokenizer)
+        cache_key, past_key_values = self._take_prefix_cache(inputs, session_id, task, local.name)
+        streamer = TextIteratorStreamer(
+            local.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=timeout
         )
+        spec_kwargs, spec_stats = self._speculative(local)
+        cancel = cancel or Event()
+        result = {}
+        
+        def run():
+            try:
+                with spec_stats or nullcontext():
+                    result["outputs"] = local.model.generate(
+                        inputs=inputs,
+                        attention_mask=attention_mask,
+                        max_new_tokens=max_new_tokens,
+                        temperature=temperature,
+                        top_p=0.9,
+                        do_sample=True,
+                        pad_token_id=local.tokenizer.eos_token_id,
+                        streamer=streamer,
+                        past_key_values=past_key_values,
+                        stopping_criteria=self._local_stopping_criteria(stop, inputs.shape[1], local.tokenizer, cancel),
+                        max_time=timeout,
+                        **spec_kwargs
+                    )
+            except Exception as e:
+                result["error"] = e
+            finally:
+                # 生成失败时 generate 不会结束 streamer，这里保证下面的迭代能退出
+                streamer.end()
         
-        attention_mask = (inputs != self.local_tokenizer.pad_token_id).long()
+        thread = Thread(target=run, daemon=True)
         
-        outputs = self.local_model.generate(
-            inputs,
-            attention_mask=attention_mask,
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=self.local_tokenizer.eos_token_id
+        start = time.time()
+        first_token_at = None
+        stop_filter = StopSequenceFilter(stop or [])
+        thread.start()
+        try:
+            for delta in streamer:
+                delta = stop_filter.feed(delta)
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.time()
+                    metrics.observe("llm.local.ttft", first_token_at - start)
+                    print(f"[LLMLoader] 本地首字延迟: {first_token_at - start:.2f}s")
+                yield delta
+        except queue.Empty:
+            # generate 卡住（不抛异常也不产出）；后台线程由 max_time 停止生成，不在这里等待
+            cancel.set()
+            metrics.incr("llm.local.timeout")
+            raise TimeoutError(f"本地生成 {timeout:.0f}s 内没有新的输出")
+        except GeneratorExit:
+            # 调用方不再读取：让 generate 在下一步结束并等它退出，之后的请求才不会与它争用模型
+            cancel.set()
+            thread.join()
+            raise
+        thread.join()
+        if "error" in result:
+            print(f"[LLMLoader] 本地生成失败: {result['error']}")
+            raise result["error"]
+        if spec_stats and "outputs" in result:
+            spec_stats.report(result["outputs"].shape[1] - inputs.shape[1])
+        if stop_filter.stopped:
+            metrics.incr("llm.local.stop_hit")
+        else:
+            tail = stop_filter.flush()
+            if tail:
+                yield tail
+        if cache_key:
+            self.prefix_cache.put(cache_key, inputs[0], past_key_values)
+    
+    def _local_json_constraint(self, json_schema: Optional[JsonSchema], local):
+        """本地模型按 JSON Schema 约束解码的 prefix_allowed_tokens_fn（需要 lm-format-enforcer，未安装时为 None）"""
+        if json_schema is None or not LLM_JSON_OUTPUT["local_constrained"] or self._json_enforcer_missing:
+            return None
+        try:
+            from lmformatenforcer import JsonSchemaParser
+            from lmformatenforcer.integrations.transformers import (
+                build_token_enforcer_tokenizer_data,
+                build_transformers_prefix_allowed_tokens_fn
+            )
+        except ImportError:
+            self._json_enforcer_missing = True
+            print("[LLMLoader] 未安装 lm-format-enforcer，本地结构化输出仅靠提示词约束")
+            return None
+        
+        if local.name not in self._json_tokenizer_data:
+            self._json_tokenizer_data[local.name] = build_token_enforcer_tokenizer_data(local.tokenizer)
+        return build_transformers_prefix_allowed_tokens_fn(
+            self._json_tokenizer_data[local.name], JsonSchemaParser(json_schema.schema)
         )
+    
+    def _generate_local(self, text: Prompt, max_new_tokens: int, temperature: float,
+                        session_id: Optional[str] = None, task: str = "reply",
+                        json_schema: Optional[JsonSchema] = None, stop: Optional[List[str]] = None) -> str:
+        """使用本地模型生成；传入 json_schema 时走单独生成以便约束解码（合批推理不支持逐请求约束），
+        使用该调用类型档位的常驻模型，主模型加载了草稿模型时走投机解码"""
+        with self._local_for_task(task) as local:
+            constraint = self._local_json_constraint(json_schema, local)
+            if constraint is None and self._use_local_batcher(local):
+                return "".join(self._generate_local_stream(text, max_new_tokens, temperature, session_id, task, stop)).strip()
+            return self._generate_local_single(text, max_new_tokens, temperature, session_id, task, stop, local, constraint)
+    
+    def _generate_local_single(self, text: Prompt, max_new_tokens: int, temperature: float, session_id: Optional[str],
+                               task: str, stop: Optional[List[str]], local, constraint) -> str:
+        from contextlib import nullcontext
+        
+        inputs, attention_mask = self._build_local_inputs(text, local.tokenizer)
+        cache_key, past_key_values = self._take_prefix_cache(inputs, session_id, task, local.name)
+        spec_kwargs, spec_stats = self._speculative(local)
+        
+        with spec_stats or nullcontext():
+            outputs = local.model.generate(
+                inputs,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=local.tokenizer.eos_token_id,
+                past_key_values=past_key_values,
+                prefix_allowed_tokens_fn=constraint,
+                stopping_criteria=self._local_stopping_criteria(stop, inputs.shape[1], local.tokenizer),
+                **spec_kwargs
+            )
+        if spec_stats:
+            spec_stats.report(outputs.shape[1] - inputs.shape[1])
+        if cache_key:
+            self.prefix_cache.put(cache_key, inputs[0], past_key_values)
+        
+        response = local.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        response = response.split("assistant\n")[-1].strip() if "assistant" in response else response
+        if stop:
+            response, hit = truncate_at_stop(response.lstrip(), stop)
+            if hit:
+                metrics.incr("llm.local.stop_hit")
+        return response.strip()
+
+class AsyncLLMLoader(LLMLoader):
+    """LLMLoader 的异步版本：API 请求走 AsyncOpenAI + 共享连接池，等待网络时不占用工作线程
+    
+    模型选择（load）和本地 fallback 与 LLMLoader 共用，同步接口仍然可用。
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.async_client = None
+    
+    def _get_async_client(self):
+        if self.async_client is None:
+            from openai import AsyncOpenAI
+            
+            self.async_client = AsyncOpenAI(
+                base_url=self.API_BASE_URL,
+                api_key=self.API_KEY,
+                http_client=get_shared_async_http_client(),
+                max_retries=0
+            )
+        return self.async_client
+    
+    async def agenerate(self, text: Prompt, max_new_tokens: int = 2000, temperature: float = 0.7, priority: Optional[Priority] = None,
+                        hedge: Optional[bool] = None, task: str = "reply",
+                        session_id: Optional[str] = None, stop: Optional[List[str]] = None) -> str:
+        """异步生成回复；task / hedge / session_id / stop 含义同 generate"""
+        import asyncio
+        
+        priority = self._task_priority(task) if priority is None else priority
+        if self.use_api:
+            try:
+                if self._hedge_enabled(hedge):
+                    return "".join([d async for d in self._agenerate_api_hedged(text, max_new_tokens, temperature, priority, task, stream=False, stop=stop)])
+                return await self._agenerate_api(text, max_new_tokens, temperature, priority, task, stop=stop)
+            except Exception as e:
+                print(f"[LLMLoader] API调用失败: {e}")
+                print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+        if not await asyncio.to_thread(self._local_model_ready):
+            return ""
+        return await asyncio.to_thread(self._generate_local, text, max_new_tokens, temperature, session_id, task, None, stop)
+    
+    async def agenerate_json(self, text: Prompt, schema: JsonSchema, task: str, temperature: float = 0.7,
+                             session_id: Optional[str] = None) -> Optional[dict]:
+        """异步结构化生成，约束、重试与回退策略同 generate_json"""
+        import asyncio
+        
+        priority = self._task_priority(task)
+        for attempt in range(LLM_JSON_OUTPUT["retries"] + 1):
+            raw = None
+            if self.use_api:
+                try:
+                    raw = await self._agenerate_api(text, schema.max_tokens, temperature, priority, task, json_schema=schema)
+                except Exception as e:
+                    print(f"[LLMLoader] API调用失败: {e}")
+                    print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+            if raw is None:
+                raw = await asyncio.to_thread(
+                    self._generate_local, text, schema.max_tokens, temperature, session_id, task, schema
+                ) if await asyncio.to_thread(self._local_model_ready) else ""
+            result = self._parse_json_output(raw, schema)
+            if result is not None or not raw:
+                break
+        if result is None:
+            metrics.incr(f"llm.json.{schema.name}.fallback")
+        return result
+    
+    async def agenerate_stream(self, text: Prompt, max_new_tokens: int = 2000, temperature: float = 0.7, priority: Optional[Priority] = None,
+                               hedge: Optional[bool] = None, task: str = "reply",
+                               session_id: Optional[str] = None, stop: Optional[List[str]] = None) -> AsyncGenerator[str, None]:
+        """异步流式生成回复，逐段 yield 文本增量"""
+        import asyncio
+        
+        priority = self._task_priority(task) if priority is None else priority
+        if self.use_api:
+            emitted = False
+            try:
+                if self._hedge_enabled(hedge):
+                    api_stream = self._agenerate_api_hedged(text, max_new_tokens, temperature, priority, task, stream=True, stop=stop)
+                else:
+                    api_stream = self._agenerate_api_stream(text, max_new_tokens, temperature, priority, task, stop=stop)
+                async for delta in api_stream:
+                    emitted = True
+                    yield delta
+                return
+            except Exception as e:
+                print(f"[LLMLoader] API流式调用失败: {e}")
+                if emitted:
+                    return
+                print("[LLMLoader] 本次调用回退到本地模型（API 模型熔断恢复后自动切回）...")
+        if not await asyncio.to_thread(self._local_model_ready):
+            return
+        
+        # 本地模型是 CPU 计算，逐个增量在线程中取出，避免阻塞事件循环
+        local_stream = self._generate_local_stream(text, max_new_tokens, temperature, session_id, task, stop)
+        while True:
+            delta = await asyncio.to_thread(next, local_stream, None)
+            if delta is None:
+                break
+            yield delta
+    
+    async def _aapi_single_attempt(self, model: str, text: Prompt, max_new_tokens: int, temperature: float,
+                                   priority: Priority, emit, stop: Optional[List[str]] = None, task: str = "reply") -> str:
+        """对冲用的单次异步流式请求，任务被取消时 async with 会关闭连接"""
+        import asyncio
+        import time
+        
+        first_token_at = None
+        parts = []
+        usage = None
+        reasoning_chars = 0
+        try:
+            await self.RATE_LIMITER.acquire_async(priority)
+            start = time.time()
+            stream = await self._get_async_client().chat.completions.create(
+                model=model,
+                messages=as_messages(text),
+                **self._request_kwargs(model, max_new_tokens, temperature, stop, stream=True)
+            )
+            async with stream:
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices or not chunk.choices[0].delta:
+                        continue
+                    reasoning_chars += len(reasoning_text(chunk.choices[0].delta))
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        metrics.observe(f"llm.ttft.{model}", first_token_at - start)
+                    parts.append(delta)
+                    emit(delta)
+        except asyncio.CancelledError:
+            # 输家被取消，不计入模型健康
+            self.router.release(model)
+            raise
+        except Exception as e:
+            self._record_api_error(model, e)
+            raise
+        metrics.observe(f"llm.latency.{model}", time.time() - start)
+        self._record_completion(model, task, usage, reasoning_chars)
+        result = "".join(parts).strip()
+        if result:
+            self.router.record_success(model, first_token_at - start)
+        else:
+            self.router.record_failure(model)
+        return result
+    
+    async def _agenerate_api_hedged(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                                    task: str, stream: bool, stop: Optional[List[str]] = None) -> AsyncGenerator[str, None]:
+        """_generate_api_hedged 的异步版本，输家任务直接 cancel()"""
+        import asyncio
+        import time
+        
+        primary = self._acquire_model(task)
+        backup = self._hedge_backup_model(primary, task)
+        events = asyncio.Queue()
+        jobs = {}
+        
+        def launch(model):
+            async def run():
+                try:
+                    result = await self._aapi_single_attempt(
+                        model, text, max_new_tokens, temperature, priority,
+                        lambda delta: events.put_nowait((model, "delta", delta)), stop, task
+                    )
+                    events.put_nowait((model, "done", result))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    events.put_nowait((model, "error", e))
+            jobs[model] = asyncio.create_task(run())
+        
+        metrics.incr("llm.hedge.calls")
+        start = time.time()
+        launch(primary)
+        fire_at = start + self._hedge_delay(primary, stream) if backup else None
+        running = {primary}
+        first_deltas = {}
+        winner = None
+        result = ""
+        last_error = None
+        
+        try:
+            while winner is None and (running or fire_at is not None):
+                timeout = None if fire_at is None else max(0.0, fire_at - time.time())
+                try:
+                    model, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    waited, fire_at = fire_at - start, None
+                    backup = self.router.acquire(exclude={primary}, models=self._task_models(task))
+                    if backup is None:
+                        continue
+                    print(f"[LLMLoader] {primary} 超过 {waited:.1f}s 未响应，对冲请求 {backup}")
+                    launch(backup)
+                    running.add(backup)
+                    continue
+                
+                if kind == "delta":
+                    if stream:
+                        winner, result = model, payload
+                    first_deltas.setdefault(model, payload)
+                elif kind == "done":
+                    running.discard(model)
+                    if payload:
+                        winner, result = model, (first_deltas.get(model, payload) if stream else payload)
+                else:
+                    running.discard(model)
+                    last_error = payload
+                    print(f"[LLMLoader] 对冲请求 {model} 失败: {payload}")
+                    if fire_at is not None:
+                        fire_at = time.time()
+            
+            for model, job in jobs.items():
+                if model != winner:
+                    job.cancel()
+            
+            if winner is None:
+                if last_error:
+                    raise last_error
+                return
+            
+            self.model_name = winner
+            self._record_hedge_result(primary, winner, backup in jobs, time.time() - start, task, stream)
+            yield result
+            if not stream:
+                return
+            
+            while True:
+                model, kind, payload = await events.get()
+                if model != winner:
+                    continue
+                if kind == "delta":
+                    yield payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    return
+        finally:
+            for job in jobs.values():
+                job.cancel()
+    
+    async def _agenerate_api(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                             task: str = "reply", json_schema: Optional[JsonSchema] = None,
+                             stop: Optional[List[str]] = None) -> str:
+        """异步调用魔搭 API，重试、模型路由与 response_format 策略与 _generate_api 一致"""
+        import asyncio
+        import time
+        
+        client = self._get_async_client()
+        for attempt in range(3):
+            model = self._acquire_model(task)
+            json_kwargs = self._json_response_kwargs(model, json_schema)
+            try:
+                await self.RATE_LIMITER.acquire_async(priority)
+                start = time.time()
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=as_messages(text),
+                    **self._request_kwargs(model, max_new_tokens, temperature, stop, json_kwargs)
+                )
+            except asyncio.CancelledError:
+                self.router.release(model)
+                raise
+            except Exception as e:
+                if json_kwargs and self._json_mode_rejected(model, e):
+                    continue
+                self._record_api_error(model, e)
+                print(f"[LLMLoader] API调用异常(async) {model} (attempt {attempt+1}/3): {e}")
+                if attempt < 2:
+                    await asyncio.sleep(self._backoff_after_error(e, attempt))
+                    continue
+                raise
+            
+            elapsed = time.time() - start
+            metrics.observe(f"llm.latency.{model}", elapsed)
+            metrics.observe(f"llm.task.{task}", elapsed)
+            
+            message = response.choices[0].message
+            content = message.content
+            finish_reason = response.choices[0].finish_reason
+            reasoning_chars = len(reasoning_text(message))
+            print(f"[LLMLoader] API响应(async): {model} {elapsed:.1f}s, finish_reason={finish_reason}")
+            self._record_completion(model, task, getattr(response, "usage", None), reasoning_chars)
+            
+            if content is None or content.strip() == "":
+                self.router.record_failure(model)
+                print(f"[LLMLoader] 警告: API返回空内容 (attempt {attempt+1}/3, 思考内容 {reasoning_chars}字, "
+                      f"finish_reason={finish_reason})")
+                if attempt < 2:
+                    continue
+                return ""
+            
+            self.router.record_success(model, elapsed)
+            self.model_name = model
+            return content.strip()
         
-        response = self.local_tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return response.split("assistant\n")[-1].strip() if "assistant" in response else response
+        return ""
+    
+    async def _agenerate_api_stream(self, text: Prompt, max_new_tokens: int, temperature: float, priority: Priority,
+                                    task: str = "reply", stop: Optional[List[str]] = None) -> AsyncGenerator[str, None]:
+        """异步流式调用魔搭 API，首个增量到达前失败会换当前最优模型重试"""
+        import asyncio
+        import time
+        
+        client = self._get_async_client()
+        for attempt in range(3):
+            model = self._acquire_model(task)
+            first_token_at = None
+            total_chars = 0
+            reasoning_chars = 0
+            stream = None
+            try:
+                await self.RATE_LIMITER.acquire_async(priority)
+                start = time.time()
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=as_messages(text),
+                    **self._request_kwargs(model, max_new_tokens, temperature, stop, stream=True)
+                )
+                usage = None
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content if chunk.choices[0].delta else None
+                    reasoning_chars += len(reasoning_text(chunk.choices[0].delta))
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        metrics.observe(f"llm.ttft.{model}", first_token_at - start)
+                        metrics.observe(f"llm.task.{task}.ttft", first_token_at - start)
+                        print(f"[LLMLoader] API首字延迟(async): {model} {first_token_at - start:.2f}s")
+                    total_chars += len(delta)
+                    yield delta
+                
+                print(f"[LLMLoader] API流式响应(async): {time.time() - start:.1f}s, {total_chars}字符")
+                self._record_completion(model, task, usage, reasoning_chars)
+                if total_chars == 0:
+                    self.router.record_failure(model)
+                    if attempt < 2:
+                        print(f"[LLMLoader] 警告: API流式返回空内容 (attempt {attempt+1}/3, 思考内容 {reasoning_chars}字)")
+                        continue
+                    return
+                self.router.record_success(model, first_token_at - start)
+                metrics.observe(f"llm.task.{task}", time.time() - start)
+                self.model_name = model
+                return
+                
+            except (GeneratorExit, asyncio.CancelledError):
+                self.router.release(model)
+                if stream is not None:
+                    await stream.close()
+                raise
+            except Exception as e:
+                self._record_api_error(model, e)
+                if first_token_at is not None:
+                    raise
+                print(f"[LLMLoader] API流式调用异常(async) {model} (attempt {attempt+1}/3): {e}")
+                if attempt < 2:
+                    await asyncio.sleep(self._backoff_after_error(e, attempt))
+                    continue
+                raise
 
 class TTSLoader:
     def __init__(self):
@@ -1,14 +1,22 @@
 import uuid
 import os
+import asyncio
 import re
 import time
 import json
 import logging
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Generator
-from dataclasses import dataclass, field
-from model_loader import LLMLoader, TTSLoader
+from typing import AsyncGenerator, Dict, List, Optional, Tuple, Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from config.models import PROMPT_BUDGET, REPLY_BUDGET, RESCUE_PRECOMPUTE, TTS_PIPELINE, TURN_MODE, TURN_POOL
+from model_loader import AsyncLLMLoader, TTSLoader
+from core.metrics import metrics
+from core.rate_limiter import Priority
+from core.prompt_budget import PromptBuilder
+from core.structured_output import JsonSchema
+from core.tts_pipeline import TTSPipeline, merge_audio
 
 LOG_DIR = Path("outputs/logs")
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -23,6 +31,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger("TalkArena")
 
+# 结构化调用的输出 schema，max_tokens 按各自输出长度收紧
+JUDGE_SCHEMA = JsonSchema(
+    name="judge",
+    schema={
+        "type": "object",
+        "properties": {
+            "shift": {"type": "integer", "minimum": -25, "maximum": 25},
+            "comment": {"type": "string"},
+        },
+        "required": ["shift", "comment"],
+    },
+    max_tokens=80,
+)
+
+# 一次调用同时返回台词与裁判结果（TURN_MODE=combined），shift / comment 与 JUDGE_SCHEMA 相同；
+# max_tokens 每回合按台词预算加上 JUDGE_SCHEMA.max_tokens
+TURN_SCHEMA = JsonSchema(
+    name="turn",
+    schema={
+        "type": "object",
+        "properties": {"reply": {"type": "string"}, **JUDGE_SCHEMA.schema["properties"]},
+        "required": ["reply", "shift", "comment"],
+    },
+    max_tokens=JUDGE_SCHEMA.max_tokens,
+)
+
+# 回合回复的本轮要求（split / combined 两种调用方式相同）
+TURN_INSTRUCTIONS = """【本轮回复要求】
+完全进入角色，保持强势和攻击性；针对对方刚才说的内容进行反驳、质疑或施压。"""
+
+JUDGE_CRITERIA = """【评判维度】
+1. 论点强度：论据充分性、逻辑严密性
+2. 气势表现：语气自信度、压迫感
+3. 反击有效性：是否有效回应对方攻击
+4. 心理战术：是否动摇对方信心"""
+
+_SCORE = {"type": "integer", "minimum": 0, "maximum": 100}
+REPORT_SCORES_SCHEMA = JsonSchema(
+    name="report_scores",
+    schema={
+        "type": "object",
+        "properties": {
+            "metrics": {
+                "type": "object",
+                "properties": {key: _SCORE for key in ("oily", "friendliness", "logic", "humor", "respect")},
+                "required": ["oily", "friendliness", "logic", "humor", "respect"],
+            },
+        },
+        "required": ["metrics"],
+    },
+    max_tokens=80,
+)
+
+NPC_OS_SCHEMA = JsonSchema(
+    name="npc_os",
+    schema={
+        "type": "object",
+        "properties": {
+            "npc_inner_voice": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "os": {"type": "string"}},
+                    "required": ["name", "os"],
+                },
+            },
+            "high_light_suggestion": {"type": "string"},
+        },
+        "required": ["npc_inner_voice", "high_light_suggestion"],
+    },
+    max_tokens=400,
+)
+
 @dataclass
 class Turn:
     text: str
@@ -39,6 +120,7 @@ class Session:
     chat_history: List[Tuple[str, str]]
     last_activity: float = field(default_factory=time.time)
     turn_count: int = 0
+    turn_start_dominance: int = 50  # 本回合开始时的用户气场，用于判断气场是否在下降
     
     @property
     def ai_dominance(self) -> int:
@@ -46,12 +128,21 @@ class Session:
 
 class Orchestrator:
     def __init__(self, enable_tts: Optional[bool] = None):
-        self.llm = LLMLoader()
+        self.llm = AsyncLLMLoader()
+        self.prompt_builder = PromptBuilder(self.llm.count_tokens)
         self.tts = None
         self.stt = None
         self.sessions: Dict[str, Session] = {}
         self.scenarios = self._load_scenarios()
         self._tts_requested = self._resolve_tts_flag(enable_tts)
+        # 裁判调用（同步回合中与语音合成并行）与救场建议生成
+        self._turn_pool = ThreadPoolExecutor(max_workers=TURN_POOL["workers"], thread_name_prefix="turn")
+        # 分句流水线语音合成的并行合成线程
+        self._tts_pool = ThreadPoolExecutor(max_workers=TTS_PIPELINE["workers"], thread_name_prefix="tts")
+        # 救场建议后台预计算（最低优先级，与回合线程池分开）
+        self._rescue_pool = ThreadPoolExecutor(max_workers=RESCUE_PRECOMPUTE["workers"], thread_name_prefix="rescue")
+        # 救场建议：session_id -> (turn_count, Future)，只对同一回合有效
+        self._rescue_cache: Dict[str, Tuple[int, Future]] = {}
         
         logger.info("=" * 60)
         logger.info("TalkArena Orchestrator 初始化")
@@ -315,16 +406,148 @@ class Orchestrator:
         return session
     
     def process_turn_streaming(self, session_id: str, user_input: str) -> Generator:
+        session, scenario = self._begin_turn(session_id)
+        yield self._register_user_input(session, user_input)
+        
+        # === AI 思考阶段 ===
+        think_start = time.time()
+        yield self._thinking_update(session, think_start)
+        
+        if TURN_MODE["mode"] == "combined":
+            yield from self._combined_turn(session, scenario, think_start)
+            return
+        
+        prompt = self._build_turn_prompt(session, scenario)
+        max_new_tokens, stop = self._reply_limits(session, scenario)
+        logger.debug(f"[AI思考] Prompt: {len(prompt)}条消息, max_new_tokens={max_new_tokens}")
+
+        # 流式生成：每收到一段增量就推送 ai_partial，首字延迟即为玩家感知延迟；
+        # 每凑齐一句就开始合成语音，已合成的句子按顺序以 audio_chunk 推送
+        pipeline = self._start_tts(session)
+        raw_text = ""
+        for delta in self.llm.generate_stream(prompt, max_new_tokens=max_new_tokens, task="reply",
+                                              session_id=session.session_id, stop=stop):
+            if not raw_text:
+                logger.info(f"[AI思考] 首字延迟 {time.time() - think_start:.2f}s")
+            raw_text += delta
+            update = self._partial_update(session, raw_text)
+            if update:
+                yield update
+            if pipeline:
+                pipeline.feed(delta)
+                for index, data in pipeline.ready():
+                    yield self._audio_chunk(session, index, data)
+
+        ai_text, update = self._finish_reply(session, raw_text, think_start)
+        yield update
+        
+        # === 裁判评分（核心：零和博弈）在后台进行，语音合成只需要回复文本和情绪提示 ===
+        post_start = time.time()
+        judge_future = self._turn_pool.submit(self._judge_dominance_zero_sum, session, user_input, ai_text, scenario)
+        yield from self._speak_reply(session, ai_text, pipeline, think_start)
+        
+        # 回复与语音先展示，裁判结果随后以 judged 阶段推送
+        dominance_shift, judgment = judge_future.result()
+        yield self._judged_turn(session, dominance_shift, judgment, post_start)
+    
+    async def aprocess_turn_streaming(self, session_id: str, user_input: str) -> AsyncGenerator:
+        """process_turn_streaming 的异步版本：等待网络时不占用工作线程"""
+        session, scenario = self._begin_turn(session_id)
+        yield self._register_user_input(session, user_input)
+        
+        think_start = time.time()
+        yield self._thinking_update(session, think_start)
+        
+        if TURN_MODE["mode"] == "combined":
+            async for update in self._acombined_turn(session, scenario, think_start):
+                yield update
+            return
+        
+        # 按 token 预算装填对话记录需要分词计数（CPU 密集），放到线程中，不阻塞其他 session
+        prompt = await asyncio.to_thread(self._build_turn_prompt, session, scenario)
+        max_new_tokens, stop = self._reply_limits(session, scenario)
+        logger.debug(f"[AI思考] Prompt: {len(prompt)}条消息, max_new_tokens={max_new_tokens}")
+        
+        pipeline = self._start_tts(session)
+        raw_text = ""
+        async for delta in self.llm.agenerate_stream(prompt, max_new_tokens=max_new_tokens, task="reply",
+                                                     session_id=session.session_id, stop=stop):
+            if not raw_text:
+                logger.info(f"[AI思考] 首字延迟 {time.time() - think_start:.2f}s")
+            raw_text += delta
+            update = self._partial_update(session, raw_text)
+            if update:
+                yield update
+            if pipeline:
+                pipeline.feed(delta)
+                for index, data in pipeline.ready():
+                    yield self._audio_chunk(session, index, data)
+        
+        ai_text, update = self._finish_reply(session, raw_text, think_start)
+        yield update
+        
+        # TTS 为阻塞的子进程调用，放到线程中与裁判并行执行
+        post_start = time.time()
+        judge_task = asyncio.create_task(self._ajudge_dominance_zero_sum(session, user_input, ai_text, scenario))
+        async for update in self._aspeak_reply(session, ai_text, pipeline, think_start):
+            yield update
+        
+        dominance_shift, judgment = await judge_task
+        yield self._judged_turn(session, dominance_shift, judgment, post_start)
+    
+    def _combined_turn(self, session: Session, scenario: Dict, think_start: float) -> Generator:
+        """TURN_MODE=combined：一次结构化调用同时得到台词与裁判结果，阶段顺序与 split 相同（没有 ai_partial）"""
+        prompt, schema = self._combined_request(session, scenario)
+        pipeline = self._start_tts(session)
+        result = self.llm.generate_json(prompt, schema, task="reply", session_id=session.session_id)
+        ai_text, update = self._finish_reply(session, (result or {}).get("reply", ""), think_start)
+        yield update
+        
+        post_start = time.time()
+        yield from self._speak_reply(session, ai_text, pipeline, think_start)
+        
+        dominance_shift, judgment = self._parse_judgment(result)
+        yield self._judged_turn(session, dominance_shift, judgment, post_start)
+    
+    async def _acombined_turn(self, session: Session, scenario: Dict, think_start: float) -> AsyncGenerator:
+        """_combined_turn 的异步版本"""
+        prompt, schema = await asyncio.to_thread(self._combined_request, session, scenario)
+        pipeline = self._start_tts(session)
+        result = await self.llm.agenerate_json(prompt, schema, task="reply", session_id=session.session_id)
+        ai_text, update = self._finish_reply(session, (result or {}).get("reply", ""), think_start)
+        yield update
+        
+        post_start = time.time()
+        async for update in self._aspeak_reply(session, ai_text, pipeline, think_start):
+            yield update
+        
+        dominance_shift, judgment = self._parse_judgment(result)
+        yield self._judged_turn(session, dominance_shift, judgment, post_start)
+    
+    def _combined_request(self, session: Session, scenario: Dict) -> Tuple[List[Dict[str, str]], JsonSchema]:
+        """combined 调用的 (消息列表, schema)：max_tokens 为台词预算加裁判输出预算"""
+        prompt = self._build_combined_prompt(session, scenario)
+        max_new_tokens, _ = self._reply_limits(session, scenario)
+        logger.debug(f"[AI思考] Prompt: {len(prompt)}条消息, max_new_tokens={max_new_tokens}+{JUDGE_SCHEMA.max_tokens}（台词+裁判）")
+        return prompt, replace(TURN_SCHEMA, max_tokens=max_new_tokens + JUDGE_SCHEMA.max_tokens)
+    
+    def _begin_turn(self, session_id: str) -> Tuple[Session, Dict]:
+        """开始新回合，返回 (session, scenario)"""
         if session_id not in self.sessions:
             raise ValueError(f"Session not found: {session_id}")
         
         session = self.sessions[session_id]
         scenario = self.scenarios[session.scenario_id]
         session.turn_count += 1
-        turn_id = session.turn_count
+        session.turn_start_dominance = session.user_dominance
+        self._rescue_cache.pop(session_id, None)
         
         logger.info("-" * 50)
-        logger.info(f"[SESSION {session_id}] 第 {turn_id} 回合")
+        logger.info(f"[SESSION {session_id}] 第 {session.turn_count} 回合")
+        return session, scenario
+    
+    def _register_user_input(self, session: Session, user_input: str) -> Dict:
+        """记录用户发言并计算犹豫惩罚，返回 user_sent 阶段"""
         logger.info(f"[用户输入] {user_input}")
         
         # === 计算用户犹豫惩罚（零和：用户掉，AI涨） ===
@@ -339,30 +562,42 @@ class Orchestrator:
         session.chat_history.append((session.user_name, user_input))
         session.last_activity = time.time()
         
-        yield {
+        return {
             "stage": "user_sent",
             "user_dominance": session.user_dominance,
             "ai_dominance": session.ai_dominance,
             "log": f"犹豫惩罚: -{hesitation_shift}" if hesitation_shift > 0 else None
         }
-        
-        # === AI 思考阶段 ===
-        think_start = time.time()
+    
+    def _thinking_update(self, session: Session, think_start: float) -> Dict:
         model_name = self.llm.get_model_name()
         logger.info(f"[AI思考] 开始生成回复... (模型: {model_name})")
         
-        yield {
+        return {
             "stage": "ai_thinking",
             "user_dominance": session.user_dominance,
             "ai_dominance": session.ai_dominance,
             "model_name": model_name,
+            "local_model_state": self.llm.get_local_model_state(),
             "think_start": think_start,
             "log": "AI 正在思考..."
         }
-        
-        context_lines = [f"{name}: {text}" for name, text in session.chat_history[-8:]]
-        context = "\n".join(context_lines)
-
+    
+    def _pack_prompt(self, task: str, render, history: List[Tuple[str, str]]) -> str:
+        """按该调用类型的 token 预算装填最近的对话，render(context) 生成完整 prompt"""
+        packed = self.prompt_builder.build(task, render, history, PROMPT_BUDGET["tasks"][task])
+        logger.info(f"[Prompt] {task}: {packed.tokens} tokens，对话 {packed.turns}/{packed.total_turns} 条")
+        return packed.text
+    
+    def _pack_messages(self, task: str, system: str, history: List[Tuple[str, str]], tail: str,
+                       is_assistant=None) -> List[Dict[str, str]]:
+        """稳定的 system 消息 + 按 token 预算装填的对话历史 + 每轮变化的 tail（见 PromptBuilder.build_messages）"""
+        packed = self.prompt_builder.build_messages(task, system, history, tail, PROMPT_BUDGET["tasks"][task], is_assistant)
+        logger.info(f"[Prompt] {task}: {packed.tokens} tokens，{len(packed.messages)} 条消息，对话 {packed.turns}/{packed.total_turns} 条")
+        return packed.messages
+    
+    def _roleplay_system(self, scenario: Dict) -> str:
+        """角色回复的 system 消息：场景设定、可用角色与通用回复规则，整局不变，便于命中提示缓存"""
         # 获取当前场景的角色列表
         characters = scenario.get("characters", [])
         character_list_str = ""
@@ -370,36 +605,90 @@ class Orchestrator:
             char_names = [f"{c.get('avatar', '')} {c['name']}" for c in characters]
             character_list_str = f"\n【可用角色列表】（你只能扮演以下角色，不能编造其他角色）\n" + "\n".join([f"- {name}" for name in char_names])
 
+        return f"""{scenario['system_prompt']}
+{character_list_str}
+
+【回复要求】
+1. **只能1个角色说话！严禁多个角色！**
+2. **只能使用上面【可用角色列表】中的角色名，不能编造其他角色**
+3. **绝对禁止替用户说话，不能出现"你:"开头的内容**
+4. 只输出对话内容，可含动作描写（用括号）
+5. 格式："角色名: 内容\""""
+    
+    def _roleplay_messages(self, session: Session, scenario: Dict, instructions: str,
+                           system: Optional[str] = None, prompt_name: bool = True) -> List[Dict[str, str]]:
+        """角色回复的消息列表：用户发言为 user、角色发言为 assistant，气场与本轮要求放在最后一条 user 消息"""
         ai_prompt_name = session.ai_name
         if "characters" in scenario:
             ai_prompt_name = "请根据场景角色进行回复"
 
-        prompt = f"""{scenario['system_prompt']}
-{character_list_str}
-
-【当前局势】
+        tail = f"""【当前局势】
 你的气场: {session.ai_dominance}/100
 对方气场: {session.user_dominance}/100
 （气场越高越占优势，总和为100）
 
-【对话记录】
-{context}
-
-【本轮回复要求】
-1. **只能1个角色说话！严禁多个角色！**
-2. **只能使用上面【可用角色列表】中的角色名，不能编造其他角色**
-3. **绝对禁止替用户说话，不能出现"你:"开头的内容**
-4. 完全进入角色，保持强势和攻击性
-5. 针对对方刚才说的内容进行反驳、质疑或施压
-6. 只输出对话内容，可含动作描写（用括号）
-7. 格式："角色名: 内容"
-
-{ai_prompt_name}:"""
-        
-        logger.debug(f"[AI思考] Prompt长度: {len(prompt)}字符")
-        
-        ai_text = self.llm.generate(prompt, max_new_tokens=400)
-        ai_text = self._clean_response(ai_text, session.ai_name)
+{instructions}"""
+        if prompt_name:
+            tail += f"\n\n{ai_prompt_name}:"
+        return self._pack_messages("reply", system or self._roleplay_system(scenario), session.chat_history, tail,
+                                   is_assistant=lambda name: name != session.user_name)
+    
+    def _build_turn_prompt(self, session: Session, scenario: Dict) -> List[Dict[str, str]]:
+        """构造本轮 AI 回复的消息列表，对话记录按 reply 的 token 预算装填"""
+        return self._roleplay_messages(session, scenario, TURN_INSTRUCTIONS)
+    
+    def _build_combined_prompt(self, session: Session, scenario: Dict) -> List[Dict[str, str]]:
+        """TURN_MODE=combined 的消息列表：角色设定后附加裁判职责与 JSON 输出格式（整局不变），本轮要求同 split"""
+        system = f"""{self._roleplay_system(scenario)}
+
+【裁判职责】
+回复的同时，以中立裁判的身份评判这一轮交锋（对方刚才的发言与你的回复），判断气场转移。
+{JUDGE_CRITERIA}
+
+【输出格式】（只输出 JSON，不得输出任何额外文字）
+{{"reply": "角色名: 内容", "shift": 整数，-25到+25，正数表示对方（用户）占优，负数表示你占优, "comment": "一句话点评"}}"""
+        return self._roleplay_messages(session, scenario, f"{TURN_INSTRUCTIONS}\n按【输出格式】输出本轮台词与裁判结果。",
+                                       system=system, prompt_name=False)
+    
+    def _reply_limits(self, session: Session, scenario: Dict) -> Tuple[int, Optional[List[str]]]:
+        """角色回复的 (max_new_tokens, 停止序列)
+
+        预算按场景提示词中的“不超过N字”换算；停止序列为换行后紧跟“说话人:”（半角 / 全角冒号），
+        即模型开始替用户说话，或多角色场景换下一个角色发言时截断。用户的停止序列排在前面，
+        保证 API（最多使用前 4 个）一定带上；单角色场景不以自己的角色名截断。
+        """
+        match = re.search(r"不超过\s*(\d+)\s*字", scenario.get("system_prompt", ""))
+        max_chars = int(match.group(1)) if match else REPLY_BUDGET["default_max_chars"]
+        max_new_tokens = self._tokens_for_chars(max_chars)
+        if not REPLY_BUDGET["stop_sequences"]:
+            return max_new_tokens, None
+        
+        speakers = [session.user_name, "用户"] + [c["name"] for c in scenario.get("characters", [])]
+        stop = []
+        for name in speakers:
+            for sep in (":", "："):
+                if f"\n{name}{sep}" not in stop:
+                    stop.append(f"\n{name}{sep}")
+        return max_new_tokens, stop
+    
+    def _tokens_for_chars(self, max_chars: int) -> int:
+        """把字数上限换算成 max_new_tokens（含角色名前缀与动作描写的余量）"""
+        return int(max_chars * REPLY_BUDGET["tokens_per_char"]) + REPLY_BUDGET["overhead_tokens"]
+    
+    def _partial_update(self, session: Session, raw_text: str) -> Optional[Dict]:
+        """根据已累计的流式文本构造 ai_partial 阶段，文本仍为空时返回 None"""
+        if not raw_text.strip():
+            return None
+        return {
+            "stage": "ai_partial",
+            "user_dominance": session.user_dominance,
+            "ai_dominance": session.ai_dominance,
+            "ai_text": self._clean_response(raw_text, session.ai_name)
+        }
+    
+    def _finish_reply(self, session: Session, raw_text: str, think_start: float) -> Tuple[str, Dict]:
+        """清理最终回复并计算 AI 思考惩罚，返回 (ai_text, ai_responded 阶段)"""
+        ai_text = self._clean_response(raw_text, session.ai_name)
         
         # 如果 AI 返回空，使用 fallback 回复
         if not ai_text:
@@ -415,18 +704,16 @@ class Orchestrator:
             session.user_dominance = min(95, session.user_dominance + ai_think_shift)
             logger.info(f"[AI思考惩罚] 思考 {think_time:.1f}s，AI气场 -{ai_think_shift}")
         
-        yield {
+        return ai_text, {
             "stage": "ai_responded", 
             "user_dominance": session.user_dominance,
             "ai_dominance": session.ai_dominance,
+            "ai_text": ai_text,
             "log": f"AI思考 {think_time:.1f}s，惩罚 -{ai_think_shift}" if ai_think_shift > 0 else None
         }
-        
-        # === 裁判评分（核心：零和博弈） ===
-        dominance_shift, judgment = self._judge_dominance_zero_sum(
-            session, user_input, ai_text, scenario
-        )
-        
+    
+    def _apply_judgment(self, session: Session, dominance_shift: int, judgment: str) -> Tuple[bool, Optional[str]]:
+        """应用裁判结果并检查游戏结束条件，返回 (game_over, game_result)"""
         old_user_dom = session.user_dominance
         session.user_dominance = max(5, min(95, session.user_dominance + dominance_shift))
 
@@ -445,34 +732,133 @@ class Orchestrator:
         logger.info(f"[裁判判定] 气场转移: {dominance_shift:+d}")
         logger.info(f"[裁判点评] {judgment}")
         logger.info(f"[气场结果] 用户 {old_user_dom} -> {session.user_dominance} | AI {100-old_user_dom} -> {session.ai_dominance}")
-
-        # === 生成语音 ===
-        emotion = "angry" if dominance_shift < -5 else ("happy" if dominance_shift > 5 else "neutral")
-        
+        return game_over, game_result
+    
+    def _reply_emotion(self, session: Session) -> str:
+        """语音情绪提示：语音先于裁判结果合成，按裁判前的气场局势取（用户占优 happy，AI 占优 angry）"""
+        lead = session.user_dominance - 50
+        return "angry" if lead < -5 else ("happy" if lead > 5 else "neutral")
+    
+    def _record_post_reply(self, post_start: float):
+        """记录回复之后到裁判结果到达的耗时（裁判与语音并行，约为两者中较慢的一个）"""
+        elapsed = time.time() - post_start
+        metrics.observe("turn.post_reply_s", elapsed)
+        logger.info(f"[回合] 裁判与语音合成完成 {elapsed:.2f}s")
+    
+    def _start_tts(self, session: Session) -> Optional[TTSPipeline]:
+        """开启本回合的分句合成；TTS 关闭或 TTS_PIPELINE=0 时为 None（回复结束后整段合成）"""
+        if not self.tts or not TTS_PIPELINE["enabled"]:
+            return None
+        emotion = self._reply_emotion(session)
+        scenario = self.scenarios[session.scenario_id]
+        names = [session.ai_name] + [c["name"] for c in scenario.get("characters", [])] + ["你", "助手", "AI", "Assistant"]
+        return TTSPipeline(lambda text: self.tts.synthesize(text, emotion=emotion), self._tts_pool,
+                           names=names, min_chars=TTS_PIPELINE["min_chars"])
+    
+    def _speak_reply(self, session: Session, ai_text: str, pipeline: Optional[TTSPipeline], turn_start: float) -> Generator:
+        """推送剩余的分句语音（audio_chunk 阶段），最后推送带整段语音的 complete；未开启分句合成时整段合成"""
+        if pipeline is None:
+            audio_path = self._synthesize_reply(session, ai_text, self._reply_emotion(session), turn_start)
+        else:
+            pipeline.finish(ai_text)
+            while True:
+                chunk = pipeline.next_chunk()
+                if chunk is None:
+                    break
+                yield self._audio_chunk(session, *chunk)
+            audio_path = self._finish_tts(session, pipeline, turn_start)
+        yield self._complete_turn(session, ai_text, audio_path)
+    
+    async def _aspeak_reply(self, session: Session, ai_text: str, pipeline: Optional[TTSPipeline],
+                            turn_start: float) -> AsyncGenerator:
+        """_speak_reply 的异步版本：合成、等待与拼接放到线程中执行"""
+        if pipeline is None:
+            audio_path = await asyncio.to_thread(
+                self._synthesize_reply, session, ai_text, self._reply_emotion(session), turn_start
+            )
+        else:
+            pipeline.finish(ai_text)
+            while True:
+                chunk = await asyncio.to_thread(pipeline.next_chunk)
+                if chunk is None:
+                    break
+                yield self._audio_chunk(session, *chunk)
+            audio_path = await asyncio.to_thread(self._finish_tts, session, pipeline, turn_start)
+        yield self._complete_turn(session, ai_text, audio_path)
+    
+    def _audio_chunk(self, session: Session, index: int, audio_data: bytes) -> Dict:
+        """保存一句的语音，返回 audio_chunk 阶段"""
+        audio_path = self._save_audio(session.session_id, audio_data, suffix=f"_{index}")
+        return {
+            "stage": "audio_chunk",
+            "user_dominance": session.user_dominance,
+            "ai_dominance": session.ai_dominance,
+            "audio_path": audio_path,
+            "index": index,
+        }
+    
+    def _finish_tts(self, session: Session, pipeline: TTSPipeline, turn_start: float) -> Optional[str]:
+        """分句合成结束：记录首段 / 全部语音耗时，保存拼接后的整段语音（回放与对局记录用）"""
+        if not pipeline.chunks:
+            logger.warning("[TTS] 语音合成失败，跳过")
+            return None
+        self._record_audio_times(pipeline.first_audio_at - turn_start, pipeline.last_audio_at - turn_start,
+                                 len(pipeline.chunks))
+        audio_path = self._save_audio(session.session_id, merge_audio(pipeline.chunks))
+        logger.info(f"[TTS] 生成语音: {audio_path}")
+        return audio_path
+    
+    def _record_audio_times(self, ttfa: float, full: float, chunks: int):
+        """首段语音（玩家开始听到回复）与全部语音就绪的耗时，均从 AI 开始思考算起"""
+        metrics.observe("tts.ttfa_s", ttfa)
+        metrics.observe("tts.full_audio_s", full)
+        logger.info(f"[TTS] 首段语音 {ttfa:.2f}s，全部语音 {full:.2f}s（{chunks} 段）")
+    
+    def _synthesize_reply(self, session: Session, ai_text: str, emotion: str, turn_start: float) -> Optional[str]:
+        """为 AI 回复整段合成语音，返回音频路径（TTS 关闭或失败时为 None）"""
         audio_path = None
         if self.tts:
             clean_text = re.sub(r'[（(][^）)]*[）)]', '', ai_text).strip()
             if clean_text:
                 audio_bytes = self.tts.synthesize(clean_text, emotion=emotion)
                 if audio_bytes:
-                    audio_path = self._save_audio(session_id, audio_bytes)
+                    audio_path = self._save_audio(session.session_id, audio_bytes)
                     logger.info(f"[TTS] 生成语音: {audio_path}")
+                    elapsed = time.time() - turn_start
+                    self._record_audio_times(elapsed, elapsed, 1)
                 else:
                     logger.warning("[TTS] 语音合成失败，跳过")
             else:
                 logger.warning(f"[TTS] 清理后文本为空，跳过 (ai_text={ai_text[:50] if ai_text else 'None'}...)")
-        
+        return audio_path
+    
+    def _complete_turn(self, session: Session, ai_text: str, audio_path: Optional[str]) -> Dict:
+        """记录 AI 回复，返回 complete 阶段（裁判结果尚未到达）"""
         session.chat_history.append((session.ai_name, ai_text))
         session.last_activity = time.time()
         
-        logger.info("-" * 50)
-        
-        yield {
+        return {
             "stage": "complete",
             "user_dominance": session.user_dominance,
             "ai_dominance": session.ai_dominance,
             "ai_text": ai_text,
             "audio_path": audio_path,
+            "log": "回复完成，等待裁判判定..."
+        }
+    
+    def _judged_turn(self, session: Session, dominance_shift: int, judgment: str, post_start: float) -> Dict:
+        """应用裁判结果并检查游戏结束条件，返回 judged 阶段"""
+        game_over, game_result = self._apply_judgment(session, dominance_shift, judgment)
+        self._record_post_reply(post_start)
+        if not game_over:
+            self._precompute_rescue(session)
+        
+        logger.info("-" * 50)
+        
+        return {
+            "stage": "judged",
+            "user_dominance": session.user_dominance,
+            "ai_dominance": session.ai_dominance,
             "judgment": judgment,
             "dominance_shift": dominance_shift,
             "game_over": game_over,
@@ -481,24 +867,55 @@ class Orchestrator:
         }
     
     def get_rescue_suggestion(self, session_id: str) -> str:
-        """救场逻辑：根据当前场景和对话历史，生成高情商回复供用户参考"""
+        """救场逻辑：根据当前场景和对话历史，生成高情商回复供用户参考
+
+        本回合已有预计算（或正在生成）的建议时直接复用，同一回合内重复点击不会重新生成；
+        预计算还在排队未开始时取消，改为以救场优先级立即生成。
+        """
         if session_id not in self.sessions:
             return "对局已结束"
         
         session = self.sessions[session_id]
-        scenario = self.scenarios[session.scenario_id]
+        cached = self._rescue_cache.get(session_id)
+        if cached and cached[0] == session.turn_count and cached[1].cancel():
+            cached = None
+        if cached and cached[0] == session.turn_count:
+            metrics.incr("rescue.cache.hit" if cached[1].done() else "rescue.cache.pending")
+            logger.info(f"[救场] Session {session_id} 复用第 {session.turn_count} 回合的建议"
+                        f"{'' if cached[1].done() else '（等待后台生成完成）'}")
+            suggestion = cached[1].result()
+        else:
+            metrics.incr("rescue.cache.miss")
+            future = self._submit_rescue(session, Priority.RESCUE)
+            suggestion = future.result()
         
-        context_lines = [f"{name}: {text}" for name, text in session.chat_history[-10:]]
-        context = "\n".join(context_lines)
+        if not suggestion:
+            # 生成失败不缓存，下次点击重新生成
+            self._rescue_cache.pop(session_id, None)
+        return suggestion
+    
+    def _precompute_rescue(self, session: Session):
+        """用户气场在本回合下降时，以最低优先级在后台预先生成救场建议"""
+        if not RESCUE_PRECOMPUTE["enabled"] or session.user_dominance >= session.turn_start_dominance:
+            return
+        logger.info(f"[救场] 用户气场下降 {session.turn_start_dominance} -> {session.user_dominance}，后台预计算救场建议")
+        metrics.incr("rescue.precompute")
+        self._submit_rescue(session, Priority.REPORT)
+    
+    def _submit_rescue(self, session: Session, priority: Priority) -> Future:
+        """生成救场建议（预计算在独立线程池，点击救场在回合线程池），按 (session, 当前回合) 记入缓存"""
+        pool = self._rescue_pool if priority == Priority.REPORT else self._turn_pool
+        future = pool.submit(self._generate_rescue_suggestion, session, priority)
+        self._rescue_cache[session.session_id] = (session.turn_count, future)
+        return future
+    
+    def _generate_rescue_suggestion(self, session: Session, priority: Priority) -> str:
+        scenario = self.scenarios[session.scenario_id]
         
-        prompt = f"""你是一位顶尖的沟通专家。用户在以下场景中需要帮助，请你以用户的身份（晚辈/下属）生成一段高情商回复供其参考。
+        system = f"""你是一位顶尖的沟通专家。用户在以下场景中需要帮助，请你以用户的身份（晚辈/下属）生成一段高情商回复供其参考。
 
 【场景】{scenario['name']}
 【对手】{session.ai_name}
-【当前气场】用户 {session.user_dominance} vs AI {session.ai_dominance}
-
-【对话历史】
-{context}
 
 【任务】
 你要以用户（晚辈/下属）的第一人称身份生成一条得体的回复，用户可以直接复制发送。
@@ -509,9 +926,13 @@ class Orchestrator:
 4. 能化解困境或扶回局势
 
 请直接输出台词，不要有任何解释。"""
+        prompt = self._pack_messages("rescue", system, session.chat_history, f"""【当前气场】用户 {session.user_dominance} vs AI {session.ai_dominance}
+
+请给出我下一句的台词。""")
         
-        suggestion = self.llm.generate(prompt, max_new_tokens=150)
-        logger.info(f"[救场] Session {session_id} 生成建议: {suggestion[:50]}...")
+        suggestion = self.llm.generate(prompt, max_new_tokens=self._tokens_for_chars(50), priority=priority,
+                                       task="rescue", session_id=session.session_id)
+        logger.info(f"[救场] Session {session.session_id} 生成建议: {suggestion[:50]}...")
         return suggestion
     
     def process_rescue_turn(self, session_id: str, rescue_text: str) -> Generator:
@@ -522,6 +943,8 @@ class Orchestrator:
         session = self.sessions[session_id]
         scenario = self.scenarios[session.scenario_id]
         session.turn_count += 1
+        session.turn_start_dominance = session.user_dominance
+        self._rescue_cache.pop(session_id, None)
         
         logger.info(f"[SESSION {session_id}] 救场大师介入，对手回应中...")
         
@@ -535,46 +958,16 @@ class Orchestrator:
         
         think_start = time.time()
         
-        context_lines = [f"{name}: {text}" for name, text in session.chat_history[-8:]]
-        context = "\n".join(context_lines)
-
-        # 获取当前场景的角色列表
-        characters = scenario.get("characters", [])
-        character_list_str = ""
-        if characters:
-            char_names = [f"{c.get('avatar', '')} {c['name']}" for c in characters]
-            character_list_str = f"\n【可用角色列表】（你只能扮演以下角色，不能编造其他角色）\n" + "\n".join([f"- {name}" for name in char_names])
-
-        ai_prompt_name = session.ai_name
-        if "characters" in scenario:
-            ai_prompt_name = "请根据场景角色进行回复"
-
-        prompt = f"""{scenario['system_prompt']}
-{character_list_str}
-
-【当前局势】
-你的气场: {session.ai_dominance}/100
-对方气场: {session.user_dominance}/100
-
-【对话记录】
-{context}
-
-【特别说明】
+        prompt = self._roleplay_messages(session, scenario, """【特别说明】
 刚才有一位"救场大师"介入帮助对方说话了。你需要回应这位救场大师的发言。
 可以表现出对外援介入的不满，继续保持攻势。
 
 【本轮回复要求】
-1. **只能1个角色说话！严禁多个角色！**
-2. **只能使用上面【可用角色列表】中的角色名，不能编造其他角色**
-3. **绝对禁止替用户说话，不能出现"你:"开头的内容**
-4. 完全进入角色，保持强势
-5. 回应救场大师的发言内容
-6. 只输出对话内容，可含动作描写（用括号）
-7. 格式："角色名: 内容"
-
-{ai_prompt_name}:"""
+完全进入角色，保持强势；回应救场大师的发言内容。""")
         
-        ai_text = self.llm.generate(prompt, max_new_tokens=400)
+        max_new_tokens, stop = self._reply_limits(session, scenario)
+        ai_text = self.llm.generate(prompt, max_new_tokens=max_new_tokens, task="reply",
+                                    session_id=session.session_id, stop=stop)
         ai_text = self._clean_response(ai_text, session.ai_name)
         
         if not ai_text:
@@ -622,48 +1015,47 @@ class Orchestrator:
     
     def _judge_dominance_zero_sum(self, session: Session, user_text: str, ai_text: str, scenario: Dict) -> Tuple[int, str]:
         """零和博弈裁判：返回用户气场变化值（正数=用户涨，负数=AI涨）"""
-        
-        judge_prompt = f"""你是专业的辩论/谈判裁判。分析这轮交锋，判断气场转移。
+        judge_prompt = self._build_judge_prompt(session, user_text, ai_text, scenario)
+        result = self.llm.generate_json(judge_prompt, JUDGE_SCHEMA, task="judge", session_id=session.session_id)
+        return self._parse_judgment(result)
+    
+    async def _ajudge_dominance_zero_sum(self, session: Session, user_text: str, ai_text: str, scenario: Dict) -> Tuple[int, str]:
+        """_judge_dominance_zero_sum 的异步版本"""
+        judge_prompt = await asyncio.to_thread(self._build_judge_prompt, session, user_text, ai_text, scenario)
+        result = await self.llm.agenerate_json(judge_prompt, JUDGE_SCHEMA, task="judge", session_id=session.session_id)
+        return self._parse_judgment(result)
+    
+    def _build_judge_prompt(self, session: Session, user_text: str, ai_text: str, scenario: Dict) -> List[Dict[str, str]]:
+        """裁判消息：评判规则作为不变的 system 消息，本轮交锋与气场放在 user 消息"""
+        system = f"""你是专业的辩论/谈判裁判。分析这轮交锋，判断气场转移。
 
-【场景】{scenario['name']}
+{JUDGE_CRITERIA}
+
+【输出格式】（只输出 JSON，不得输出任何额外文字）
+{{"shift": 整数，-25到+25，正数表示用户占优，负数表示AI占优, "comment": "一句话点评"}}"""
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"""【场景】{scenario['name']}
 【当前气场】用户 {session.user_dominance} vs AI {session.ai_dominance}（总和100）
 
 【用户发言】
 "{user_text}"
 
 【{session.ai_name}回应】
-"{ai_text}"
-
-【评判维度】
-1. 论点强度：论据充分性、逻辑严密性
-2. 气势表现：语气自信度、压迫感
-3. 反击有效性：是否有效回应对方攻击
-4. 心理战术：是否动摇对方信心
-
-【输出格式】（严格按此格式，只输出两行）
-气场转移: [整数，-25到+25，正数表示用户占优，负数表示AI占优]
-点评: [一句话点评]"""
-
-        result = self.llm.generate(judge_prompt, max_new_tokens=100)
-        logger.debug(f"[裁判原始输出] {result}")
-        
-        shift = 0
-        judgment = "势均力敌"
-        
-        for line in result.strip().split('\n'):
-            if '气场转移' in line:
-                match = re.search(r'[-+]?\d+', line)
-                if match:
-                    shift = max(-25, min(25, int(match.group())))
-            elif '点评' in line:
-                judgment = line.split(':', 1)[-1].split('：', 1)[-1].strip()
-        
-        return shift, judgment
+"{ai_text}\""""},
+        ]
     
-    def _save_audio(self, session_id: str, audio_data: bytes) -> str:
+    def _parse_judgment(self, result: Optional[Dict]) -> Tuple[int, str]:
+        """把裁判的结构化输出转成 (气场转移, 点评)；schema 已把转移值限制在 [-25, 25]，输出无效时判为势均力敌"""
+        logger.debug(f"[裁判输出] {result}")
+        if not result:
+            return 0, "势均力敌"
+        return result["shift"], result["comment"].strip() or "势均力敌"
+    
+    def _save_audio(self, session_id: str, audio_data: bytes, suffix: str = "") -> str:
         audio_dir = Path("outputs/audio") / session_id
         audio_dir.mkdir(parents=True, exist_ok=True)
-        audio_path = audio_dir / f"turn_{self.sessions[session_id].turn_count}.wav"
+        audio_path = audio_dir / f"turn_{self.sessions[session_id].turn_count}{suffix}.wav"
         
         with open(audio_path, "wb") as f:
             f.write(audio_data)
@@ -696,7 +1088,7 @@ class Orchestrator:
             result = "🤝 势均力敌"
         
         # 让 LLM 生成总结
-        summary_prompt = f"""你是一位专业的沟通教练。分析以下对决并给出详细点评和改进建议。
+        summary_prompt = self._pack_prompt("report_summary", lambda context: f"""你是一位专业的沟通教练。分析以下对决并给出详细点评和改进建议。
 
 【场景】{scenario['name']}
 【对手】{session.ai_name}
@@ -704,7 +1096,7 @@ class Orchestrator:
 【回合数】{session.turn_count}
 
 【对话记录】
-{dialogue}
+{context}
 
 请 output（严格按以下 format）：
 
@@ -719,9 +1111,9 @@ class Orchestrator:
 [指出1-2个关键转折点，分析为什么赢/输]
 
 ## 💡 改进建议
-[给出3条具体可操作的建议]"""
+[给出3条具体可操作的建议]""", session.chat_history)
         
-        summary = self.llm.generate(summary_prompt, max_new_tokens=800)
+        summary = self.llm.generate(summary_prompt, max_new_tokens=800, task="report_summary")
         
         logger.info("=" * 60)
         logger.info(f"[SESSION {session_id}] 对决结束")
@@ -758,6 +1150,8 @@ class Orchestrator:
         
         # 清理 session
         del self.sessions[session_id]
+        self._rescue_cache.pop(session_id, None)
+        self.llm.release_session(session_id)
         
         return summary, str(file_path)
     
@@ -769,11 +1163,8 @@ class Orchestrator:
         session = self.sessions[session_id]
         scenario = self.scenarios.get(session.scenario_id, {})
         
-        # 构建对话历史
-        history_log = "\n".join([f"{name}: {text}" for name, text in session.chat_history])
-        
         # 第一次调用：生成五维度得分
-        scores_prompt = f"""# Role
+        scores_prompt = self._pack_prompt("report_scores", lambda history_log: f"""# Role
 你是“山东人饭局情商大挑战”的打分裁判，负责给玩家在饭局对话中的表现从五个维度打分。
 
 # Input
@@ -802,16 +1193,13 @@ class Orchestrator:
 }}
 
 # Constraints
-只输出 JSON格式，不得输出任何额外解释文字"""
+只输出 JSON格式，不得输出任何额外解释文字""", session.chat_history)
         
         logger.info("[复盘报告] 步骤1: 生成五维度得分...")
-        scores_result = self.llm.generate(scores_prompt, max_new_tokens=200)
-        
-        # 解析JSON
-        try:
-            scores_data = json.loads(scores_result.strip())
-            scores = scores_data.get("metrics", {})
-        except:
+        scores_data = self.llm.generate_json(scores_prompt, REPORT_SCORES_SCHEMA, task="report_scores")
+        if scores_data:
+            scores = scores_data["metrics"]
+        else:
             logger.warning("[复盘报告] JSON解析失败，使用默认分数")
             scores = {"oily": 50, "friendliness": 50, "logic": 50, "humor": 50, "respect": 50}
         
@@ -820,7 +1208,7 @@ class Orchestrator:
         medal = get_medal_by_scores(scores)
         
         # 第二次调用：综合点评
-        summary_prompt = f"""# Role
+        summary_prompt = self._pack_prompt("report_summary", lambda history_log: f"""# Role
 你是一位在山东饭局混迹三十年、眼光毒辣的人情世故宗师。你的任务是根据玩家在“山东人饭局情商大挑战”中的对话表现，给出一份既专业又扎心的总结陈词。
 
 # Input
@@ -840,13 +1228,13 @@ class Orchestrator:
 - 结构化：第一句：定性评价；中间语句：逻辑分析；结尾句：总结。
 
 # Constraints
-直接输出总结陈词内容，不得输出任何额外解释文字"""
+直接输出总结陈词内容，不得输出任何额外解释文字""", session.chat_history)
         
         logger.info("[复盘报告] 步骤2: 生成综合点评...")
-        summary = self.llm.generate(summary_prompt, max_new_tokens=300)
+        summary = self.llm.generate(summary_prompt, max_new_tokens=300, task="report_summary")
         
         # 第三次调用：NPC OS + 改进建议
-        npc_prompt = f"""# Role
+        npc_prompt = self._pack_prompt("npc_os", lambda history_log: f"""# Role
 你是一位在山东饭局混迹三十年、毒舌且看透世事的“人情世故大宗师”。
 
 # Input Data
@@ -870,17 +1258,14 @@ class Orchestrator:
 }}
 
 # Constraints
-只输出 JSON格式，不得输出任何额外解释文字"""
+只输出 JSON格式，不得输出任何额外解释文字""", session.chat_history)
         
         logger.info("[复盘报告] 步骤3: 生成NPC OS和建议...")
-        npc_result = self.llm.generate(npc_prompt, max_new_tokens=500)
-        
-        # 解析JSON
-        try:
-            npc_data = json.loads(npc_result.strip())
-            npc_os_list = npc_data.get("npc_inner_voice", [])
-            suggestion = npc_data.get("high_light_suggestion", "没有具体建议")
-        except:
+        npc_data = self.llm.generate_json(npc_prompt, NPC_OS_SCHEMA, task="npc_os")
+        if npc_data:
+            npc_os_list = npc_data["npc_inner_voice"]
+            suggestion = npc_data["high_light_suggestion"] or "没有具体建议"
+        else:
             logger.warning("[复盘报告] NPC JSON解析失败")
             npc_os_list = [{"name": npc["name"], "os": "表现一般", "avatar": npc.get("avatar", "👤")} for npc in npc_list[:3]]
             suggestion = "多观察，少说话。"
@@ -894,6 +1279,21 @@ class Orchestrator:
                     break
         
         logger.info("[复盘报告] 生成完成")
+        json_report = metrics.report("llm.json.")
+        if json_report:
+            logger.info(f"[结构化输出] 调用/解析失败/兜底次数:\n{json_report}")
+        prompt_report = metrics.report("llm.prompt_")
+        if prompt_report:
+            logger.info(f"[Prompt] 按调用类型的 prompt token 数 / 截断次数:\n{prompt_report}")
+        cache_report = self.llm.prompt_cache_report()
+        if cache_report:
+            logger.info(f"[Prompt] 服务端提示缓存命中（cached/prompt tokens）:\n{cache_report}")
+        task_report = metrics.report("llm.task.")
+        if task_report:
+            logger.info(f"[LLM耗时] 按调用类型统计（秒）:\n{task_report}")
+        tts_report = metrics.report("tts.")
+        if tts_report:
+            logger.info(f"[TTS耗时] 首段语音 / 全部语音（秒，从 AI 开始思考算起）:\n{tts_report}")
         
         return {
             "scene_name": scene_name,
@@ -0,0 +1,455 @@
+"""
+TalkArena 核心模块测试（纯 Python，不需要模型、网络与 API Key）
+测试内容：限流器、熔断器、KV 前缀缓存、结构化输出、停止序列、本地模型常驻、分句语音合成
+"""
+import threading
+import time
+
+print("=" * 60)
+print("TalkArena 核心模块测试")
+print("=" * 60)
+
+# ============================================================
+# 1. 令牌桶限流器测试
+# ============================================================
+print("\n[1] 令牌桶限流器测试")
+
+from core.rate_limiter import Priority, PriorityRateLimiter, is_rate_limited, retry_after_seconds
+
+limiter = PriorityRateLimiter(rate=5, burst=1)
+assert limiter.acquire(Priority.REPORT) < 0.1, "桶内有令牌时应立即返回"
+
+# 令牌耗尽后同时排队：按优先级取令牌，而不是按到达顺序
+order = []
+
+def take(priority):
+    limiter.acquire(priority)
+    order.append(priority)
+
+threads = []
+for priority in (Priority.REPORT, Priority.RESCUE, Priority.JUDGE, Priority.TURN):
+    thread = threading.Thread(target=take, args=(priority,))
+    thread.start()
+    threads.append(thread)
+    time.sleep(0.01)
+for thread in threads:
+    thread.join()
+assert order == [Priority.TURN, Priority.JUDGE, Priority.RESCUE, Priority.REPORT], f"取令牌顺序错误: {order}"
+print(f"  排队顺序: {' > '.join(p.name for p in order)} ✓")
+
+# 等待足够久的低优先级请求会被提升
+aging = PriorityRateLimiter(rate=5, burst=1, aging_seconds=0.1)
+aging.acquire()
+aging_order = []
+report = threading.Thread(target=lambda: (aging.acquire(Priority.REPORT), aging_order.append(Priority.REPORT)))
+report.start()
+time.sleep(0.15)   # REPORT 排队 0.15s，已提升到 RESCUE 之前
+aging.acquire(Priority.RESCUE)
+aging_order.append(Priority.RESCUE)
+report.join()
+assert aging_order == [Priority.REPORT, Priority.RESCUE], f"老化提升错误: {aging_order}"
+print("  低优先级等待老化提升 ✓")
+
+# 429：清空令牌并暂停所有请求直到 Retry-After 到期
+paused = PriorityRateLimiter(rate=100, burst=4)
+paused.penalize(0.3)
+waited = paused.acquire(Priority.TURN)
+assert waited >= 0.29, f"429 后应暂停 0.3s，实际 {waited:.2f}s"
+print(f"  429 暂停: 等待 {waited:.2f}s ✓")
+
+try:
+    blocked = PriorityRateLimiter(rate=1, burst=1)
+    blocked.penalize(5)
+    blocked.acquire(Priority.TURN, timeout=0.1)
+    raise AssertionError("暂停期间超过 timeout 应抛出 TimeoutError")
+except TimeoutError:
+    print("  暂停期间等待超时 ✓")
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.response = FakeResponse(headers or {})
+
+
+assert is_rate_limited(FakeError(429))
+assert not is_rate_limited(FakeError(500))
+assert retry_after_seconds(FakeError(429, {"retry-after": "3"})) == 3.0
+assert retry_after_seconds(FakeError(429, {"retry-after-ms": "1500"})) == 1.5
+assert retry_after_seconds(FakeError(429)) is None
+print("  429 识别与 Retry-After 解析 ✓")
+
+print("✓ 限流器正确")
+
+# ============================================================
+# 2. 熔断器测试
+# ============================================================
+print("\n[2] 熔断器测试")
+
+from core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ModelRouter
+
+transitions = []
+breaker = CircuitBreaker("m1", failure_threshold=3, cooldown=0.1, max_cooldown=1.0,
+                         on_state_change=lambda name, old, new: transitions.append((old, new)))
+for _ in range(2):
+    breaker.record_failure()
+assert breaker.state == CLOSED, "未达到连续失败次数不应熔断"
+breaker.record_failure()
+assert breaker.state == OPEN, "连续失败 3 次应熔断"
+assert not breaker.allow_request(), "冷却期内应拒绝请求"
+print("  closed -> open ✓")
+
+time.sleep(0.12)
+assert breaker.available()
+assert breaker.allow_request(), "冷却到期应放行一个探测请求"
+assert breaker.state == HALF_OPEN
+assert not breaker.allow_request(), "half-open 只放行一个探测请求"
+breaker.record_failure()
+assert breaker.state == OPEN and breaker._cooldown == 0.2, "探测失败应重新熔断且冷却翻倍"
+print("  open -> half-open -> open（冷却翻倍）✓")
+
+time.sleep(0.22)
+assert breaker.allow_request() and breaker.state == HALF_OPEN
+breaker.release()
+assert breaker.allow_request(), "取消的探测请求应归还名额"
+breaker.record_success(1.0)
+assert breaker.state == CLOSED and breaker._cooldown == 0.1, "探测成功应恢复 closed 并重置冷却"
+assert transitions == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN),
+                       (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)], transitions
+print("  half-open -> closed ✓")
+
+# 错误率熔断：未连续失败，但滚动窗口错误率达到阈值
+rate_breaker = CircuitBreaker("m2", failure_threshold=10, error_rate_threshold=0.5, min_calls=4)
+for ok in (True, False, True, False):
+    rate_breaker.record_success() if ok else rate_breaker.record_failure()
+assert rate_breaker.state == OPEN, "错误率达到 50% 应熔断"
+print("  错误率熔断 ✓")
+
+router_config = {
+    "failure_threshold": 1, "error_rate_threshold": 0.5, "window": 20, "window_seconds": 60.0,
+    "min_calls": 5, "cooldown": 30.0, "max_cooldown": 300.0, "latency_alpha": 0.3,
+    "default_latency": 2.0, "error_penalty": 2.0, "order_bias": 0.05,
+}
+router = ModelRouter(["a", "b", "c"], router_config)
+router.record_success("a", 3.0)
+router.record_success("b", 1.0)
+assert router.best() == "b", "延迟更低的模型应优先"
+router.record_failure("b")
+assert router.acquire() == "c" and router.ranked() == ["c", "a"], "熔断的模型不参与路由"
+assert router.open_ratio() == 1 / 3
+router.mark_unhealthy("a")
+router.mark_unhealthy("c")
+assert router.acquire() is None, "全部熔断时应返回 None"
+print("  按健康分路由 ✓")
+
+print("✓ 熔断器正确")
+
+# ============================================================
+# 3. KV 前缀缓存测试
+# ============================================================
+print("\n[3] KV 前缀缓存测试")
+
+from core.prefix_cache import PrefixCache, cache_nbytes
+
+
+class FakeTensor:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def numel(self):
+        return self.tokens * 100
+
+    def element_size(self):
+        return 1
+
+
+class FakeLayer:
+    def __init__(self, tokens):
+        self.keys = FakeTensor(tokens)
+        self.values = FakeTensor(tokens)
+
+
+class FakeCache:
+    """每个 token 占 200 字节的 DynamicCache 替身"""
+
+    def __init__(self, tokens):
+        self.layers = [FakeLayer(tokens)]
+
+    def crop(self, tokens):
+        self.layers = [FakeLayer(min(tokens, layer.keys.tokens)) for layer in self.layers]
+
+
+assert cache_nbytes(FakeCache(10)) == 2000
+
+prefix_cache = PrefixCache(max_bytes=5000)
+prefix_cache.put("s1:reply:m", list(range(10)), FakeCache(15))
+assert prefix_cache.total_bytes == 2000, "只保留 prompt 部分（生成的 token 裁掉）"
+prefix_cache.put("s2:reply:m", list(range(10)), FakeCache(10))
+prefix_cache.put("s1:judge:m", list(range(5)), FakeCache(5))
+assert prefix_cache.total_bytes == 5000
+prefix_cache.put("s3:reply:m", list(range(5)), FakeCache(5))
+assert prefix_cache.total_bytes == 4000, "超出上限应按 LRU 淘汰最久未用的条目"
+assert prefix_cache.take("s1:reply:m", list(range(12))) == (None, 0), "被淘汰的条目应未命中"
+print("  按字节上限 LRU 淘汰 ✓")
+
+prefix_cache.put("big", list(range(40)), FakeCache(40))
+assert prefix_cache.total_bytes == 4000, "单条超过上限时不缓存"
+prefix_cache.drop("s1:")
+assert prefix_cache.total_bytes == 3000, "session 结束时删除其全部条目"
+print("  超大条目与 session 清理 ✓")
+
+try:
+    import torch
+except ImportError:
+    torch = None
+if torch is None:
+    print("  ⚠ 未安装 torch，跳过前缀复用测试")
+else:
+    reuse_cache = PrefixCache(max_bytes=10 ** 6, min_prefix_tokens=4)
+    reuse_cache.put("s", torch.arange(10), FakeCache(10))
+    cache, reused = reuse_cache.take("s", torch.cat([torch.arange(8), torch.tensor([99, 98])]))
+    assert reused == 8 and cache.layers[0].keys.tokens == 8, "应裁剪到公共前缀"
+    assert reuse_cache.take("s", torch.arange(10)) == (None, 0), "take 取出后条目不再留在缓存中"
+    reuse_cache.put("s", torch.arange(10), FakeCache(10))
+    cache, reused = reuse_cache.take("s", torch.arange(10))
+    assert reused == 9, "完全相同的 prompt 至少留一个 token 给本轮 prefill"
+    reuse_cache.put("s", torch.arange(10), FakeCache(10))
+    assert reuse_cache.take("s", torch.arange(3, 13)) == (None, 0), "公共前缀过短不复用"
+    print("  公共前缀裁剪与复用 ✓")
+
+print("✓ KV 前缀缓存正确")
+
+# ============================================================
+# 4. 结构化输出测试
+# ============================================================
+print("\n[4] 结构化输出测试")
+
+from core.structured_output import JsonSchema, coerce, extract_json, is_response_format_rejected, parse_structured
+
+judge_schema = JsonSchema(
+    name="judge",
+    schema={
+        "type": "object",
+        "properties": {
+            "shift": {"type": "integer", "minimum": -25, "maximum": 25},
+            "comment": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "integer", "minimum": 0, "maximum": 10}},
+            "final": {"type": "boolean"},
+        },
+        "required": ["shift", "comment"],
+    },
+    max_tokens=120,
+)
+
+assert coerce({"shift": 40, "comment": "好"}, judge_schema.schema)["shift"] == 25, "超过 maximum 应截断"
+assert coerce({"shift": -99, "comment": "好"}, judge_schema.schema)["shift"] == -25, "低于 minimum 应截断"
+assert coerce({"shift": "12.7", "comment": 3}, judge_schema.schema) == {"shift": 12, "comment": "3"}, "数字字符串转整数"
+assert coerce({"shift": 0, "comment": "", "tags": [-1, 5, 20]}, judge_schema.schema)["tags"] == [0, 5, 10], "数组元素逐个截断"
+assert coerce({"shift": 0, "comment": "", "final": "True"}, judge_schema.schema)["final"] is True
+print("  数值截断与宽松转换 ✓")
+
+for bad in ({"comment": "缺 shift"}, {"shift": "很多", "comment": ""}, {"shift": True, "comment": ""},
+            {"shift": 1, "comment": None}, {"shift": 1, "comment": "", "final": "yes"}, ["shift"]):
+    try:
+        coerce(bad, judge_schema.schema)
+        raise AssertionError(f"应拒绝: {bad}")
+    except ValueError:
+        pass
+print("  不符合 schema 时抛出 ValueError ✓")
+
+# 模型偶尔输出 Infinity / 1e400：json.loads 能解析，但既不能截断也不能转整数
+for raw in ('{"shift": Infinity, "comment": ""}', '{"shift": 1e400, "comment": ""}',
+            '{"shift": "inf", "comment": ""}', '{"shift": NaN, "comment": ""}'):
+    try:
+        parse_structured(raw, judge_schema)
+        raise AssertionError(f"应拒绝: {raw}")
+    except ValueError as e:
+        assert "$.shift" in str(e), e
+print("  非有限数字抛出 ValueError（带字段路径） ✓")
+
+assert extract_json('<think>先想想</think>```json\n{"shift": 3, "comment": "稳"}\n```') == {"shift": 3, "comment": "稳"}
+assert extract_json('裁判结果：{"shift": -3, "comment": "慌"} 以上') == {"shift": -3, "comment": "慌"}
+assert parse_structured('{"shift": 30, "comment": "压制"}', judge_schema) == {"shift": 25, "comment": "压制"}
+try:
+    parse_structured("没有 JSON", judge_schema)
+    raise AssertionError("没有 JSON 时应抛出 ValueError")
+except ValueError:
+    pass
+assert "strict" not in judge_schema.response_format("json_schema")["json_schema"], "schema 带 minimum/maximum，不能开 strict"
+assert judge_schema.response_format("off") is None
+print("  JSON 提取与 response_format ✓")
+
+
+class APIError(Exception):
+    def __init__(self, status_code, message, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+assert is_response_format_rejected(APIError(400, "Invalid parameter: 'response_format' of type 'json_schema' is not supported"))
+assert is_response_format_rejected(APIError(400, "Bad Request", body={"error": {"param": "response_format"}}))
+assert not is_response_format_rejected(APIError(400, "This model's maximum context length is 32768 tokens"))
+assert not is_response_format_rejected(APIError(500, "response_format handler crashed"))
+print("  只有与 response_format 有关的 400 才视为不支持 JSON 模式 ✓")
+
+print("✓ 结构化输出正确")
+
+# ============================================================
+# 5. 停止序列测试
+# ============================================================
+print("\n[5] 停止序列测试")
+
+from core.stop_sequences import StopSequenceFilter, truncate_at_stop
+
+stops = ["\n你:", "\n你：", "\n用户:", "\n用户："]
+assert truncate_at_stop("王总: 不行。\n你: 好吧", stops) == ("王总: 不行。", True)
+assert truncate_at_stop("王总: 不行。\n用户：行\n你: 好", stops) == ("王总: 不行。", True), "在最早出现的停止序列处截断"
+assert truncate_at_stop("王总: （拍桌子）这价格不行。\n你们公司到底有没有诚意？", stops)[1] is False, "换行后的“你们”不是说话人"
+print("  truncate_at_stop ✓")
+
+
+def run_filter(deltas, stop=stops):
+    stop_filter = StopSequenceFilter(stop)
+    out = [stop_filter.feed(d) for d in deltas]
+    return out, stop_filter.flush(), stop_filter.stopped
+
+
+# 停止序列被拆在多个增量里：可能是开头的部分先暂存，命中后不输出
+out, tail, stopped = run_filter(["  王总: 不行。", "\n", "你", ": 那好吧"])
+assert out == ["王总: 不行。", "", "", ""] and tail == "" and stopped, out
+# 暂存的部分最终没有构成停止序列：原样放出
+out, tail, stopped = run_filter(["王总: 不行。", "\n你", "们公司", "有诚意吗"])
+assert "".join(out) + tail == "王总: 不行。\n你们公司有诚意吗" and not stopped, out
+assert out[1] == "", "“\\n你”可能是停止序列开头，应先暂存"
+out, tail, stopped = run_filter(["王总: 不行。\n"])
+assert out == ["王总: 不行。"] and tail == "\n" and not stopped, "生成结束时 flush 输出暂存的文本"
+out, tail, stopped = run_filter(["\n\n", " 王总: 说。", "\n用户：", "我来"])
+assert out == ["", "王总: 说。", "", ""] and stopped, "跳过开头空白；命中后不再输出"
+print("  StopSequenceFilter 跨增量暂存 ✓")
+
+print("✓ 停止序列正确")
+
+# ============================================================
+# 6. 本地模型常驻测试
+# ============================================================
+print("\n[6] 本地模型常驻测试")
+
+from core.local_models import LocalModelManager
+
+model_specs = {name: {"model_id": f"test/{name}", "cache_dir": "./models/none", "params_b": 1.0} for name in "abc"}
+loaded = []
+
+
+def slow_load(spec):
+    time.sleep(0.2)
+    loaded.append(spec["model_id"])
+    return object(), object()
+
+
+one_model = LocalModelManager(model_specs, {}, 0, "bf16", slow_load).estimate("a")
+manager = LocalModelManager(model_specs, {"fast": ["a", "b", "c"]}, int(one_model * 2.5), "bf16", slow_load)
+manager.release(manager.acquire("a"))
+assert manager.acquire("a") is manager.resident["a"] and len(loaded) == 1, "已常驻的模型不重复加载"
+manager.release(manager.resident["a"])
+
+# 两个首次加载并发进行：预留在加载前计入预算，空闲的 a 必须让位
+workers = [threading.Thread(target=lambda name=name: manager.release(manager.acquire(name))) for name in "bc"]
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+assert sorted(manager.resident) == ["b", "c"], f"并发加载超出内存预算: {sorted(manager.resident)}"
+assert manager.used_bytes() <= manager.budget_bytes and manager._reserved == 0
+print("  并发首次加载预留内存 ✓")
+
+pinned = manager.acquire("b", pin=True)
+manager.release(pinned)
+manager.release(manager.acquire("a"))
+assert "b" in manager.resident and "c" not in manager.resident, "固定常驻的模型不参与 LRU 卸载"
+print("  LRU 卸载跳过固定常驻模型 ✓")
+
+print("✓ 本地模型常驻正确")
+
+# ============================================================
+# 7. 分句语音合成测试
+# ============================================================
+print("\n[7] 分句语音合成测试")
+
+from concurrent.futures import ThreadPoolExecutor
+
+from core.tts_pipeline import SentenceSplitter, TTSPipeline, speakable
+
+
+def split(deltas):
+    splitter = SentenceSplitter()
+    sentences = []
+    for delta in deltas:
+        sentences += splitter.feed(delta)
+    return sentences, splitter.flush()
+
+
+assert split(["王总: （拍桌子。不行！）这价格不行。你们", "有诚意吗？"]) == (
+    ["王总: （拍桌子。不行！）这价格不行。"], ["你们有诚意吗？"]), "括号内的句末标点不断句"
+assert split(["他说：“你好。", "”然后", "走了"]) == (["他说：“你好。”"], ["然后走了"]), "句末后的引号归入同一句"
+assert split(["太好了！！", "！走吧"]) == (["太好了！！！"], ["走吧"]), "连续句末标点归入同一句"
+assert split(["第一行没有标点\n大舅: 喝", "！\n\n"]) == (["第一行没有标点", "大舅: 喝！"], []), "换行断句，空行忽略"
+assert split(["半句（动作", "没闭合"]) == ([], ["半句（动作没闭合"])
+print("  SentenceSplitter 括号 / 引号 / 换行 ✓")
+
+assert speakable("王总: （拍桌子）这价格不行。", ["王总"]) == "这价格不行。"
+assert speakable("大舅：（举杯）喝！", ["大舅", "表哥"]) == "喝！", "全角冒号的角色名前缀"
+assert speakable("（沉默片刻）……") == "", "只有动作描写时不朗读"
+assert speakable("我（冷笑") == "我", "未闭合的括号去掉到结尾"
+assert speakable("表哥说: 好", ["表哥"]) == "表哥说: 好", "只去掉行首的角色名前缀"
+print("  speakable 去掉动作描写与角色名 ✓")
+
+synthesized = []
+
+
+def fake_synthesize(text):
+    synthesized.append(text)
+    if "失败" in text:
+        raise RuntimeError("合成失败")
+    time.sleep(0.05 if text.startswith("第一") else 0.01)   # 后提交的句子先合成完
+    return text.encode()
+
+
+with ThreadPoolExecutor(max_workers=3) as tts_executor:
+    pipeline = TTSPipeline(fake_synthesize, tts_executor, names=["王总"], min_chars=4)
+    pipeline.feed("王总: 第一句话。好。")
+    pipeline.feed("（点头）第三句也说完了。这句会失败。最后")
+    pipeline.finish()
+    chunks = []
+    while True:
+        chunk = pipeline.next_chunk()
+        if chunk is None:
+            break
+        chunks.append(chunk)
+    assert synthesized[0] == "第一句话。", "句子完整时立即提交，去掉角色名前缀"
+    assert "好。第三句也说完了。" in synthesized, "不足 min_chars 的句子与下一句合并"
+    assert [i for i, _ in chunks] == [0, 1, 3], f"按句子顺序输出并跳过合成失败的句子: {chunks}"
+    assert chunks[-1][1].decode() == "最后" and pipeline.sentences == 4
+    assert pipeline.first_audio_at <= pipeline.last_audio_at
+    print("  按句提交、合并短句、按序输出 ✓")
+
+    fallback = TTSPipeline(fake_synthesize, tts_executor, names=["王总"])
+    fallback.feed("王总: （沉默）")
+    fallback.finish(fallback_text="（沉默片刻）你说得很有意思，但我不同意。")
+    assert fallback.next_chunk()[1].decode() == "你说得很有意思，但我不同意。", "没有可朗读的句子时合成 fallback"
+    print("  fallback 回复 ✓")
+
+print("✓ 分句语音合成正确")
+
+# ============================================================
+# 测试总结
+# ============================================================
+print("\n" + "=" * 60)
+print("✅ 全部测试通过!")
+print("=" * 60)
@@ -68,12 +68,13 @@ def render_visual_stage(characters: list = None, current_speaker: str = None, us
     '''
 
 
-def render_aura_sidebar(user_score: int, ai_score: int) -> str:
-    """渲染侧边栏垂直气场条"""
+def render_aura_sidebar(user_score: int, ai_score: int, judged: bool = False) -> str:
+    """渲染侧边栏垂直气场条，judged 为 True 时（裁判结果刚到达）气场条闪动提示"""
+    bar_class = "aura-vertical-bar aura-judged" if judged else "aura-vertical-bar"
     return f'''
     <div class="aura-side-panel">
         <div class="aura-vertical-label">对峙气场</div>
-        <div class="aura-vertical-bar">
+        <div class="{bar_class}">
             <div class="aura-vertical-fill ai" style="height: {ai_score}%;"></div>
             <div class="aura-vertical-fill user" style="height: {user_score}%;"></div>
         </div>
@@ -3,9 +3,36 @@
 处理回合判定、评分、剧情生成
 """
 from typing import Dict, List, Tuple, Optional
-import json
+from core.structured_output import JsonSchema
 from orchestrator import logger
 
+TURN_VERDICT_SCHEMA = JsonSchema(
+    name="turn_verdict",
+    schema={
+        "type": "object",
+        "properties": {
+            "pancake": {"type": "boolean"},
+            "garlic": {"type": "boolean"},
+            "feedback": {"type": "string"},
+        },
+        "required": ["pancake", "garlic", "feedback"],
+    },
+    max_tokens=100,
+)
+
+NEXT_TURN_SCHEMA = JsonSchema(
+    name="next_turn",
+    schema={
+        "type": "object",
+        "properties": {
+            "speakerIndex": {"type": "integer", "minimum": 1},
+            "response": {"type": "string"},
+        },
+        "required": ["speakerIndex", "response"],
+    },
+    max_tokens=200,
+)
+
 class GameJudge:
     """游戏裁判系统"""
     
@@ -51,14 +78,11 @@ class GameJudge:
 
 请输出JSON："""
         
-        result = self.llm.generate(prompt, max_new_tokens=200)
-        
-        try:
-            result_json = json.loads(result)
-            return result_json
-        except:
-            logger.warning(f"[裁判] JSON解析失败: {result}")
+        result = self.llm.generate_json(prompt, TURN_VERDICT_SCHEMA, task="judge")
+        if result is None:
+            logger.warning("[裁判] JSON解析失败")
             return {"pancake": False, "garlic": False, "feedback": "评判中..."}
+        return result
     
     def generate_next_turn(self, scene_desc: str, npc_list: List[Dict], history: List[Tuple[str, str]]) -> Dict:
         """生成下一回合对话"""
@@ -92,14 +116,12 @@ class GameJudge:
 
 请输出JSON："""
         
-        result = self.llm.generate(prompt, max_new_tokens=300)
-        
-        try:
-            result_json = json.loads(result)
-            return result_json
-        except:
-            logger.warning(f"[剧情] JSON解析失败: {result}")
+        result = self.llm.generate_json(prompt, NEXT_TURN_SCHEMA, task="reply")
+        if result is None:
+            logger.warning("[剧情] JSON解析失败")
             return {"speakerIndex": 1, "response": "（沉默了一会儿）"}
+        result["speakerIndex"] = min(result["speakerIndex"], len(npc_list))
+        return result
     
     def get_rescue_suggestion(self, scene_desc: str, npc_list: List[Dict], history: List[Tuple[str, str]]) -> str:
         """获取救场建议"""
@@ -134,5 +156,5 @@ class GameJudge:
 
 建议发言："""
         
-        suggestion = self.llm.generate(prompt, max_new_tokens=200)
+        suggestion = self.llm.generate(prompt, max_new_tokens=200, task="rescue")
         return suggestion.strip()
@@ -1,4 +1,4 @@
-from typing import List, Tuple, Generator
+from typing import AsyncGenerator, List, Tuple, Generator
 from orchestrator import Orchestrator, logger
 import gradio as gr
 from ui.user import register_user, get_current_user
@@ -161,17 +161,37 @@ def process_voice_input(session_id: str, audio_file, chat_history: List) -> Gene
     yield from send_message(session_id, user_text, chat_history)
 
 def send_message(session_id: str, user_input: str, chat_history: List) -> Generator:
-    if not session_id or not user_input.strip():
+    prepared = _prepare_turn(session_id, user_input, chat_history)
+    if prepared is None:
+        yield chat_history, "", 50, 50, None, False
+        return
+
+    orch, view, actual_input = prepared
+    for update in orch.process_turn_streaming(session_id, actual_input):
+        yield view.render(update)
+
+async def send_message_async(session_id: str, user_input: str, chat_history: List) -> AsyncGenerator:
+    """send_message 的异步版本，基于 Orchestrator.aprocess_turn_streaming"""
+    prepared = _prepare_turn(session_id, user_input, chat_history)
+    if prepared is None:
         yield chat_history, "", 50, 50, None, False
         return
 
+    orch, view, actual_input = prepared
+    async for update in orch.aprocess_turn_streaming(session_id, actual_input):
+        yield view.render(update)
+
+def _prepare_turn(session_id: str, user_input: str, chat_history: List):
+    """校验输入并把用户消息加入聊天记录，返回 (orch, view, actual_input)；无法开始回合时返回 None"""
+    if not session_id or not user_input.strip():
+        return None
+
     orch = get_orchestrator()
 
     # 检查session是否存在（可能已结束）
     if session_id not in orch.sessions:
         logger.warning(f"[发送消息] Session {session_id} 不存在或已结束")
-        yield chat_history, "", 50, 50, None, False
-        return
+        return None
 
     session = orch.sessions[session_id]
 
@@ -194,97 +214,127 @@ def send_message(session_id: str, user_input: str, chat_history: List) -> Genera
     else:
         # 大师介入：AI 代替用户回答
         chat_history.append({"role": "user", "content": user_input.replace("💡 **(大师介入)**: ", ""), "metadata": {"title": "救场大师"}})
-    
-    thinking_msg_added = False
-    model_name = ""
 
     # 清理输入文本（去除展示用的前缀）
     actual_input = user_input.replace("💡 **(大师介入)**: ", "")
 
-    for update in orch.process_turn_streaming(session_id, actual_input):
+    scenario = orch.scenarios.get(session.scenario_id, {})
+    return orch, TurnView(session, scenario, chat_history), actual_input
+
+class TurnView:
+    """把 process_turn_streaming 的阶段更新渲染为 send_message 的输出元组"""
+
+    def __init__(self, session, scenario: dict, chat_history: List):
+        self.session = session
+        self.scenario = scenario
+        self.chat_history = chat_history
+        self.placeholder_idx = None
+        self.audio_streamed = False   # 已按句推送过语音时，complete 不再重复推送整段语音
+
+    def render(self, update: dict) -> Tuple:
         stage = update["stage"]
         ai_dom = update["ai_dominance"]
         user_dom = update["user_dominance"]
+        chat_history = self.chat_history
 
-        if stage == "user_sent":
-            yield chat_history, "", ai_dom, user_dom, None, False
-
-        elif stage == "ai_thinking":
+        if stage == "ai_thinking":
             model_name = update.get("model_name", "")
-            if not thinking_msg_added:
+            if self.placeholder_idx is None:
                 chat_history.append({"role": "assistant", "content": f"🤔 **正在思考...** (模型: {model_name})"})
-                thinking_msg_added = True
-            yield chat_history, "", ai_dom, user_dom, None, False
+                self.placeholder_idx = len(chat_history) - 1
+
+        elif stage == "ai_partial":
+            # 增量渲染：用当前已生成的文本替换思考占位消息
+            responses = format_ai_responses(update["ai_text"], self.session, self.scenario)
+            if responses and self.placeholder_idx is not None:
+                chat_history[self.placeholder_idx] = {"role": "assistant", "content": _combine_responses(responses) + " ▌"}
 
         elif stage == "ai_responded":
-            yield chat_history, "", ai_dom, user_dom, None, False
+            # 回复已定稿：先展示完整文本，语音合成完成后进入 complete
+            responses = format_ai_responses(update["ai_text"], self.session, self.scenario)
+            if responses and self.placeholder_idx is not None:
+                chat_history[self.placeholder_idx] = {"role": "assistant", "content": _combine_responses(responses)}
 
         elif stage == "complete":
-            ai_text = update["ai_text"]
-            audio_path = update["audio_path"]
-            judgment = update.get("judgment", "")
-            game_over = update.get("game_over", False)
-
-            # 处理多角色解析
-            responses = []
-            scenario = orch.scenarios.get(session.scenario_id, {})
-            characters = scenario.get("characters", [])
-
-            # 检查是否有角色名称出现（支持单行或多行）
-            has_character_name = any(c['name'] + ":" in ai_text or c['name'] + "：" in ai_text for c in characters)
-
-            if has_character_name:
-                lines = ai_text.split('\n') if '\n' in ai_text else [ai_text]
-                for line in lines:
-                    if ":" in line or "：" in line:
-                        sep = ":" if ":" in line else "："
-                        name, text = line.split(sep, 1)
-                        name_stripped = name.strip()
-
-                        # 只接受配置的角色
-                        valid_character_names = [c['name'] for c in characters]
-                        if name_stripped not in valid_character_names:
-                            continue
-
-                        # 查找角色头像
-                        avatar = ""
-                        for c in characters:
-                            if c['name'] == name_stripped:
-                                avatar = c.get('avatar', '')
-                                break
-                        title = f"{avatar} {name_stripped}" if avatar else name_stripped
-                        formatted_content = f"**{title}**: {text.strip()}"
-                        responses.append({"role": "assistant", "content": formatted_content})
-                    else:
-                        if line.strip():
-                            responses.append({"role": "assistant", "content": line.strip()})
-            else:
-                # 没有角色名称的情况（单角色场景）
-                ai_name = session.ai_name
-                avatar = ""
-                if not characters and "avatar" in scenario:
-                    avatar = scenario["avatar"]
-                elif len(characters) == 1:
-                    avatar = characters[0].get("avatar", "")
+            responses = format_ai_responses(update["ai_text"], self.session, self.scenario)
 
-                title = f"{avatar} {ai_name}" if avatar else ai_name
-                formatted_content = f"**{title}**: {ai_text}"
-                responses.append({"role": "assistant", "content": formatted_content})
-
-            # 替换思考消息
-            if thinking_msg_added and chat_history and chat_history[-1].get("content", "").startswith("🤔"):
-                chat_history.pop()
+            # 替换思考/增量消息
+            if self.placeholder_idx is not None and self.placeholder_idx < len(chat_history):
+                chat_history.pop(self.placeholder_idx)
+                self.placeholder_idx = None
 
             # 合并多个角色的消息为一条，避免Gradio合并显示导致嵌套
-            if len(responses) > 1:
-                # 多个角色：合并为一条消息
-                combined_content = "\n\n---\n\n".join([r["content"] for r in responses])
-                chat_history.append({"role": "assistant", "content": combined_content})
-            elif len(responses) == 1:
-                # 单个角色：直接添加
-                chat_history.append(responses[0])
-
-            yield chat_history, judgment, ai_dom, user_dom, audio_path, game_over
+            if responses:
+                chat_history.append({"role": "assistant", "content": _combine_responses(responses)})
+
+            audio_path = None if self.audio_streamed else update["audio_path"]
+            return chat_history, "", ai_dom, user_dom, audio_path, False
+
+        elif stage == "audio_chunk":
+            # 分句合成的一段语音，按顺序追加到播放器的音频流
+            self.audio_streamed = True
+            return chat_history, "", ai_dom, user_dom, update["audio_path"], False
+
+        elif stage == "judged":
+            # 裁判结果到达：更新气场与点评，游戏结束在此阶段判定
+            return chat_history, update["judgment"], ai_dom, user_dom, None, update["game_over"]
+
+        # user_sent / ai_thinking / ai_partial / ai_responded
+        return chat_history, "", ai_dom, user_dom, None, False
+
+def format_ai_responses(ai_text: str, session, scenario: dict) -> List[dict]:
+    """将 AI 回复解析为按角色拆分的 assistant 消息列表（支持多角色场景）"""
+    responses = []
+    characters = scenario.get("characters", [])
+
+    # 检查是否有角色名称出现（支持单行或多行）
+    has_character_name = any(c['name'] + ":" in ai_text or c['name'] + "：" in ai_text for c in characters)
+
+    if has_character_name:
+        lines = ai_text.split('\n') if '\n' in ai_text else [ai_text]
+        for line in lines:
+            if ":" in line or "：" in line:
+                sep = ":" if ":" in line else "："
+                name, text = line.split(sep, 1)
+                name_stripped = name.strip()
+
+                # 只接受配置的角色
+                valid_character_names = [c['name'] for c in characters]
+                if name_stripped not in valid_character_names:
+                    continue
+
+                # 查找角色头像
+                avatar = ""
+                for c in characters:
+                    if c['name'] == name_stripped:
+                        avatar = c.get('avatar', '')
+                        break
+                title = f"{avatar} {name_stripped}" if avatar else name_stripped
+                formatted_content = f"**{title}**: {text.strip()}"
+                responses.append({"role": "assistant", "content": formatted_content})
+            else:
+                if line.strip():
+                    responses.append({"role": "assistant", "content": line.strip()})
+    else:
+        # 没有角色名称的情况（单角色场景）
+        ai_name = session.ai_name
+        avatar = ""
+        if not characters and "avatar" in scenario:
+            avatar = scenario["avatar"]
+        elif len(characters) == 1:
+            avatar = characters[0].get("avatar", "")
+
+        title = f"{avatar} {ai_name}" if avatar else ai_name
+        formatted_content = f"**{title}**: {ai_text}"
+        responses.append({"role": "assistant", "content": formatted_content})
+
+    return responses
+
+def _combine_responses(responses: List[dict]) -> str:
+    """多个角色合并为一条消息，单个角色直接返回内容"""
+    if len(responses) > 1:
+        return "\n\n---\n\n".join([r["content"] for r in responses])
+    return responses[0]["content"]
 
 def handle_rescue(session_id: str, chat_history: List) -> Tuple:
     """处理救场请求 - 生成高情商回复供用户参考"""
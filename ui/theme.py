@@ -547,6 +547,9 @@ body, html {
 .aura-vertical-fill.ai { background: #C62828; }
 .aura-vertical-fill.user { background: #4A90E2; }
 
+/* 裁判结果到达时气场条闪动 */
+.aura-vertical-bar.aura-judged { animation: pulse 0.6s ease 2; }
+
 .aura-vertical-values {
     display: flex;
     flex-direction: column;